@@ -14,14 +14,17 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from contextlib import contextmanager
 from optparse import make_option
 import socket
+import time
 
 from django.core.management.base import BaseCommand, CommandError
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 from sunburnt import SolrError
 
 from openemory.accounts.models import UserProfile, EsdPerson
+from openemory.publication.indexing import index_publications
 from openemory.publication.models import Article, Publication
 from openemory.util import solr_interface
 from django.conf import settings
@@ -35,9 +38,20 @@ class Command(BaseCommand):
     v_normal = 1  # 1 = normal, 0 = minimal, 2 = all
     v_all = 2
 
+    #: number of owners to combine in a single Solr article query
+    OWNER_QUERY_SIZE = 200
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', action='store', type=int, default=100,
+                            help='Number of documents to send to Solr per add (default: %(default)s)')
+        parser.add_argument('--workers', action='store', type=int, default=4,
+                            help='Number of concurrent threads for reindexing articles (default: %(default)s)')
+
     def handle(self, verbosity=1, *args, **options):
 
         self.verbosity = int(verbosity)
+        self.chunk_size = max(options.get('chunk_size', 100), 1)
+        self.workers = options.get('workers', 4)
 
         if self.verbosity >= self.v_normal:
             print('Indexing ESD data for %d faculty members in Solr' % \
@@ -61,25 +75,39 @@ class Command(BaseCommand):
 
         # get all faculty information currently in solr,
         # to check for changes and faculty no longer in ESD
-        self.indexed_faculty_data = dict((f['username'], f)
-                                         for f in self.indexed_faculty())
+        with self.timed('Fetching indexed faculty'):
+            self.indexed_faculty_data = dict((f['username'], f)
+                                             for f in self.indexed_faculty())
         self.updated_faculty = set()
         self.active_faculty = set()
 
         # add/update faculty indexes for all ESD faculty persons
-        self.index_faculty()
+        with self.timed('Indexing faculty'):
+            self.index_faculty()
         # remove any previously indexed persons not in current run
-        self.remove_deactivated_faculty()
+        with self.timed('Removing deactivated faculty'):
+            self.remove_deactivated_faculty()
         # update articles for any updated or removed authors
-        self.cascade_updated_articles()
+        with self.timed('Reindexing articles by updated faculty'):
+            self.cascade_updated_articles()
         # commit all changes in Solr so they will be immediately available
-        self.solr.commit()
+        with self.timed('Committing'):
+            self.solr.commit()
+
+    @contextmanager
+    def timed(self, phase):
+        # report elapsed time for a phase of the indexing run
+        start = time.time()
+        yield
+        if self.verbosity >= self.v_normal:
+            print('%s: %.2f sec' % (phase, time.time() - start))
 
     def index_faculty(self):
         '''Add or update solr index for every EsdPerson record in the
         database.  Keeps track of updated and active faculty to allow
         updating related articles and removing deactivated faculty.
         '''
+        docs = []
         for p in EsdPerson.faculty.all():
 
             if self.verbosity >= self.v_all:
@@ -92,7 +120,13 @@ class Command(BaseCommand):
                 self.updated_faculty.add(p.username)
 
             self.active_faculty.add(p.username)
-            self.solr.add(p.index_data())
+            docs.append(index_data)
+            if len(docs) >= self.chunk_size:
+                self.solr.add(docs)
+                docs = []
+
+        if docs:
+            self.solr.add(docs)
 
     def compare_index_data(self, index_data, old_index_data):
         '''Articles are indexed on author division/department/affiliation.
@@ -142,16 +176,20 @@ class Command(BaseCommand):
         a previously-indexed faculty member is no longer in ESD).
         '''
         updated_articles = set()
-        for username in self.updated_faculty:
-            for article in self.articles_by_faculty(username):
-                updated_articles.add(article['pid'])
+        for article in self.articles_by_faculty(self.updated_faculty):
+            updated_articles.add(article['pid'])
 
-        repo = Repository()
-        for pid in updated_articles:
-            if self.verbosity >= self.v_all:
-                print('Indexing article', pid)
-            article = repo.get_object(pid, type=Publication)
-            self.solr.add(article.index_data())
+        if self.verbosity >= self.v_normal:
+            print('Reindexing %d articles by %d updated faculty' % \
+                  (len(updated_articles), len(self.updated_faculty)))
+
+        counts = index_publications(updated_articles, Repository(), self.solr,
+                                    chunk_size=self.chunk_size,
+                                    workers=self.workers)
+
+        if self.verbosity >= self.v_normal:
+            print('Reindexed %d articles; skipped %d unchanged; %d errors' % \
+                  (counts['indexed'], counts['unchanged'], counts['errors']))
 
     def indexed_faculty(self):
         # generator: return solr data for all currently indexed EsdPerson
@@ -161,18 +199,34 @@ class Command(BaseCommand):
         for faculty in self.all_solr_results(q):
             yield faculty
 
-    def articles_by_faculty(self, username):
-        # generator: return solr data for all articles associated with a user
-        if self.verbosity >= self.v_all:
-            print('Fetching articles by', username)
-        try:
-            profile = UserProfile.objects.get(user__username=username)
-        except UserProfile.DoesNotExist:
-            return
-
-        q = profile.recent_articles_query()
-        for article in self.all_solr_results(q):
-            yield article
+    def articles_by_faculty(self, usernames):
+        # generator: return solr data for all articles associated with
+        # any of the specified users, combining owners into as few
+        # queries as possible
+        usernames = sorted(usernames)
+        for i in range(0, len(usernames), self.OWNER_QUERY_SIZE):
+            # as with UserProfile.recent_articles_query, only users
+            # with a profile have articles
+            chunk = sorted(UserProfile.objects.filter(
+                user__username__in=usernames[i:i + self.OWNER_QUERY_SIZE]) \
+                .values_list('user__username', flat=True))
+            if not chunk:
+                continue
+            if self.verbosity >= self.v_all:
+                print('Fetching articles by', ', '.join(chunk))
+            ownerfilter = None
+            for username in chunk:
+                if ownerfilter is None:
+                    ownerfilter = self.solr.Q(owner=username)
+                else:
+                    ownerfilter |= self.solr.Q(owner=username)
+            # same criteria as UserProfile.recent_articles_query
+            q = self.solr.query(ownerfilter) \
+                    .filter(content_model=Publication.ARTICLE_CONTENT_MODEL,
+                            state='A') \
+                    .field_limit('pid')
+            for article in self.all_solr_results(q):
+                yield article
 
     def all_solr_results(self, q):
         PAGE_SIZE = 100
@@ -545,12 +545,64 @@ class EsdPerson(models.Model):
 
     @property
     def affiliations(self):
+        # use positions preloaded by :meth:`by_netid` when available
+        if self._affiliations is not None:
+            return self._affiliations
         try:
             profile = self.profile()
         except UserProfile.DoesNotExist:
             return []
         return profile.position_set.all()
 
+    _affiliations = None
+
+    #: maximum number of values in a single ``IN`` clause; Oracle
+    #: (ESD) does not allow more than 1000
+    BATCH_SIZE = 500
+
+    @classmethod
+    def by_netid(cls, netids):
+        '''Resolve ESD records for many users at once, for use when
+        indexing a batch of publications.  Fetches
+        :class:`~django.contrib.auth.models.User`, :class:`UserProfile`,
+        :class:`EsdPerson` and :class:`Position` records with a few
+        ``IN`` queries per :attr:`BATCH_SIZE` netids, instead of several
+        queries per netid.  As with :meth:`UserProfile.esd_data`, only
+        users with a local profile *and* an ESD record are included.
+
+        :param netids: list or set of usernames (as stored on
+            :class:`~django.contrib.auth.models.User`)
+        :returns: dictionary of username -> :class:`EsdPerson`, with
+            :attr:`affiliations` preloaded
+        '''
+        netids = sorted(set(netids))
+        records = {}
+        for i in range(0, len(netids), cls.BATCH_SIZE):
+            chunk = netids[i:i + cls.BATCH_SIZE]
+            # users and profiles in a single query
+            profiles = dict((p.user.username, p) for p in
+                            UserProfile.objects.filter(user__username__in=chunk) \
+                                               .select_related('user'))
+            if not profiles:
+                continue
+
+            # ESD stores netids in upper case
+            esd = dict((e.netid, e) for e in
+                       cls.objects.filter(netid__in=[n.upper() for n in profiles]))
+
+            positions = {}
+            for pos in Position.objects.filter(holder__in=list(profiles.values())):
+                positions.setdefault(pos.holder_id, []).append(pos)
+
+            for username, profile in profiles.items():
+                person = esd.get(username.upper(), None)
+                if person is None:
+                    continue
+                person._affiliations = positions.get(profile.pk, [])
+                records[username] = person
+
+        return records
+
     def index_data(self):
         '''Indexing information for this :class:`EsdPerson` instance
         in a format that :meth:`sunburnt.SolrInterface.add` can
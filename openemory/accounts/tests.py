@@ -14,6 +14,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from collections import defaultdict
 from contextlib import contextmanager
 import datetime
 import hashlib
@@ -24,6 +25,7 @@ import os
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
 from django.core import mail
+from django.core.management import call_command
 from django.core.paginator import Paginator
 from django.core.urlresolvers import reverse
 from django.db import DatabaseError
@@ -46,6 +48,7 @@ import sunburnt
 from openemory.accounts.auth import permission_required, login_required
 from openemory.accounts.backends import FacultyOrLocalAdminBackend
 from openemory.accounts.forms import FeedbackForm, ProfileForm, captchafield
+from openemory.accounts.management.commands.index_faculty import Command as IndexFacultyCommand
 from openemory.accounts.models import researchers_by_interest, Bookmark, \
      pids_by_tag, articles_by_tag, UserProfile, EsdPerson, Degree, \
      Position, Grant, Announcement, ExternalLink
@@ -2373,3 +2376,76 @@ class EsdPersonTest(TestCase):
         lnodine_esd = EsdPerson.objects.get(netid='LNODINE')
         self.assertEqual('Lawrence K.', lnodine_esd.first_name,
                          'first_name should be inferred from full name when firstmid_name is empty')
+
+    def test_by_netid(self):
+        mmouse_profile = self.mmouse.userprofile
+        mmouse_profile.position_set.add(Position(name='Head Mouse'))
+        # student has a profile but no esd data; unknown user has neither
+        records = EsdPerson.by_netid(['mmouse', 'student', 'nobody'])
+        self.assertEqual(['mmouse'], list(records.keys()))
+        self.assertEqual('P9418306', records['mmouse'].ppid)
+        # positions should be preloaded as affiliations
+        self.assertEqual(['Head Mouse'],
+                         [p.name for p in records["mmouse"].affiliations])
+
+
+class IndexFacultyCommandTest(TestCase):
+
+    @patch('openemory.accounts.management.commands.index_faculty.index_publications')
+    @patch('openemory.accounts.management.commands.index_faculty.EsdPerson')
+    @patch('openemory.accounts.management.commands.index_faculty.solr_interface')
+    def test_index_faculty(self, mocksolr_interface, mockesd, mockindex):
+        people = [Mock(username='user%d' % i) for i in range(5)]
+        for p in people:
+            p.index_data.return_value = {'username': p.username}
+        faculty = MagicMock()
+        faculty.__iter__.return_value = iter(people)
+        faculty.count.return_value = len(people)
+        mockesd.faculty.all.return_value = faculty
+        mocksolr = mocksolr_interface.return_value
+        # no faculty currently indexed
+        response = MagicMock()
+        response.__iter__.return_value = iter([])
+        response.result.numFound = 0
+        mocksolr.query.return_value.paginate.return_value.execute.return_value = response
+        mockindex.return_value = defaultdict(int)
+
+        call_command('index_faculty', verbosity=0, chunk_size=2)
+        # index data is generated once per person
+        for p in people:
+            p.index_data.assert_called_once_with()
+        # and sent to solr in chunks
+        self.assertEqual([[{'username': 'user0'}, {'username': 'user1'}],
+                          [{'username': 'user2'}, {'username': 'user3'}],
+                          [{'username': 'user4'}]],
+                         [args[0] for args, kwargs in mocksolr.add.call_args_list])
+        mocksolr.commit.assert_called_once_with()
+
+    @patch('openemory.accounts.management.commands.index_faculty.UserProfile')
+    def test_articles_by_faculty(self, mockprofile):
+        def profiles(user__username__in):
+            # every user except 'noprofile' has a profile
+            result = Mock()
+            result.values_list.return_value = [u for u in user__username__in
+                                               if u != 'noprofile']
+            return result
+        mockprofile.objects.filter.side_effect = profiles
+
+        cmd = IndexFacultyCommand()
+        cmd.verbosity = 0
+        cmd.OWNER_QUERY_SIZE = 2
+        cmd.solr = MagicMock()
+        cmd.all_solr_results = Mock(side_effect=lambda q: iter([{'pid': 'test:1'}]))
+
+        articles = list(cmd.articles_by_faculty(set(['mmouse', 'dduck', 'noprofile', 'gfoot'])))
+        # owners are combined into queries of OWNER_QUERY_SIZE
+        self.assertEqual([{'pid': 'test:1'}, {'pid': 'test:1'}], articles)
+        self.assertEqual(2, cmd.solr.query.call_count)
+        # users without a profile are not queried
+        self.assertEqual(['dduck', 'gfoot', 'mmouse'],
+                         [kwargs['owner'] for args, kwargs in cmd.solr.Q.call_args_list])
+
+        # no users with profiles: no queries
+        cmd.solr.reset_mock()
+        self.assertEqual([], list(cmd.articles_by_faculty(['noprofile'])))
+        cmd.solr.query.assert_not_called()
@@ -35,7 +35,7 @@ from django.http import HttpResponse, Http404, HttpResponseForbidden, \
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.http import require_http_methods
 from eulcommon.djangoextras.http import HttpResponseSeeOtherRedirect, content_negotiation
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 from eulfedora.views import login_and_store_credentials_in_session
 from django_auth_ldap.backend import LDAPBackend as EmoryLDAPBackend
 from eulxml.xmlmap.dc import DublinCore
@@ -14,18 +14,28 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from contextlib import contextmanager
+import hashlib
 import logging
+import threading
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
 from django.urls import reverse
 from django.contrib.sites.models import Site
 from django.utils.encoding import iri_to_uri
 
 
 from eulfedora import models, server
+from eulfedora.api import ResourceIndex, api_called
+from lxml import etree
+import requests
 from pidservices.clients import parse_ark
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 
+from openemory.common.models import ReservedArk
+
 
 logger = logging.getLogger(__name__)
 
@@ -66,7 +76,111 @@ except:
         raise
 
 
-class ManagementRepository(server.Repository):
+# per-process pool of Fedora HTTP sessions, keyed on base url and user
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def pooled_session(api, retries=None):
+    '''Return a shared :class:`requests.Session` for the base url and
+    credentials of the specified eulfedora API object, creating it on
+    first use.  Sessions keep connections to Fedora alive across
+    requests, so views and scripts that initialize a new
+    :class:`Repository` don't pay for a new TCP/TLS handshake each
+    time.  Sessions are keyed on user as well as url so that any
+    server-side session state is never shared between credentials.
+
+    Connection pool size is configured with ``FEDORA_POOL_MAXSIZE``
+    (default 10), which should be at least the number of threads that
+    make Fedora requests concurrently.
+    '''
+    key = (api.base_url, api.username)
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            # keep the headers eulfedora configured for its own session
+            session.headers.update(api.session.headers)
+            maxsize = getattr(settings, 'FEDORA_POOL_MAXSIZE', 10)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=maxsize,
+                max_retries=retries or 0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
+
+def use_pooled_session(api, retries=None):
+    '''Configure an eulfedora API object to use the shared session
+    from :meth:`pooled_session` and the configured ``FEDORA_TIMEOUT``
+    (in seconds), if any.  Does nothing if ``FEDORA_SESSION_POOL`` is
+    set to False.'''
+    if not getattr(settings, 'FEDORA_SESSION_POOL', True):
+        return api
+    api.session = pooled_session(api, retries)
+    timeout = getattr(settings, 'FEDORA_TIMEOUT', None)
+    if timeout is not None:
+        api.request_options['timeout'] = timeout
+    return api
+
+
+# Fedora API call statistics for the request handled in each thread
+_api_stats = threading.local()
+_api_stats_lock = threading.Lock()
+
+
+def _count_api_call(sender, time_taken=0, **kwargs):
+    # only count calls made while a request is being tracked in this thread
+    stats = getattr(_api_stats, 'stats', None)
+    if stats is not None:
+        with _api_stats_lock:
+            stats['calls'] += 1
+            stats['time'] += time_taken
+
+
+def current_api_stats():
+    '''Fedora API call statistics for the request being handled in
+    the current thread, if any; pass to :meth:`track_api_calls` to
+    include calls made from worker threads.'''
+    return getattr(_api_stats, 'stats', None)
+
+
+@contextmanager
+def track_api_calls(stats):
+    '''Count Fedora API calls made in the current thread (e.g., a
+    request, or a worker thread started by a view) against the
+    specified statistics: a dictionary with ``calls`` and ``time``, as
+    returned by :meth:`current_api_stats`.'''
+    previous = getattr(_api_stats, 'stats', None)
+    _api_stats.stats = stats
+    try:
+        yield
+    finally:
+        _api_stats.stats = previous
+
+if api_called is not None:
+    api_called.connect(_count_api_call,
+                       dispatch_uid='openemory.common.fedora.count_api_call')
+
+
+class Repository(server.Repository):
+    """Extend the default Fedora Repository object to use pooled,
+    persistent HTTP sessions (see :meth:`pooled_session`)."""
+
+    def __init__(self, *args, **kwargs):
+        super(Repository, self).__init__(*args, **kwargs)
+        use_pooled_session(self.api, getattr(self, 'retries', None))
+
+    @property
+    def risearch(self):
+        "instance of :class:`eulfedora.api.ResourceIndex`, with the same root url, credentials and session pool"
+        if self._risearch is None:
+            self._risearch = use_pooled_session(
+                ResourceIndex(self.fedora_root, self.username, self.password),
+                getattr(self, 'retries', None))
+        return self._risearch
+
+
+class ManagementRepository(Repository):
     """Extend the default Fedora Repository object to automatically
     initialize with configured management user and password
     from Django settings.
@@ -78,10 +192,78 @@ class ManagementRepository(server.Repository):
             password=settings.FEDORA_MANAGEMENT_PASSWORD)
 
 
+class CachedXmlDatastreamObject(models.XmlDatastreamObject):
+    """Extend :class:`eulfedora.models.XmlDatastreamObject` to share
+    datastream content across requests and processes through the
+    configured Django cache.  Cached content is keyed on pid, datastream
+    id and the object's last modification date (from the object
+    profile), so any change to the object in Fedora results in a new
+    key; entries are also removed when the datastream is saved.
+
+    The raw XML is cached rather than the parsed
+    :class:`~eulxml.xmlmap.XmlObject`, since the parsed content is
+    mutable and lxml documents cannot be pickled.
+
+    Content changes are detected by comparing a digest of the canonical
+    XML with the content as loaded, so only datastreams that have
+    really changed are saved.
+    """
+    _content_cache_key = None
+
+    def _cache_key(self):
+        # only current versions of existing objects can be cached
+        if not self.exists or self.as_of_date is not None or self.obj.modified is None:
+            return None
+        key = '%s %s %s' % (self.obj.pid, self.id, self.obj.modified.isoformat())
+        return 'fedora-ds:%s' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_content(self):
+        if self._content is None and self.exists and self.as_of_date is None:
+            self._content_cache_key = self._cache_key()
+            data = cache.get(self._content_cache_key) \
+                if self._content_cache_key else None
+            if data is None:
+                r = self.obj.api.getDatastreamDissemination(self.obj.pid, self.id)
+                data = r.content
+                if self._content_cache_key:
+                    cache.set(self._content_cache_key, data,
+                              getattr(settings, 'FEDORA_DATASTREAM_CACHE_TIMEOUT', 60 * 60 * 24))
+            self._content = self._convert_content(data, None)
+            # store a digest of the current content, as eulfedora does,
+            # so only datastreams that actually change are saved
+            self.digest = self._content_digest()
+        return super(CachedXmlDatastreamObject, self)._get_content()
+
+    content = property(_get_content, models.XmlDatastreamObject._set_content,
+                       None, models.XmlDatastreamObject.content.__doc__)
+
+    def _content_digest(self):
+        # digest canonical XML rather than the serialization, so that
+        # differences in attribute order or namespace declarations alone
+        # don't cause an unchanged datastream to be saved as a new version
+        if self._raw_content() is None:
+            return None
+        return hashlib.sha1(etree.tostring(self.content.node, method='c14n')).hexdigest()
+
+    def save(self, logmessage=None):
+        success = super(CachedXmlDatastreamObject, self).save(logmessage)
+        if success and self._content_cache_key:
+            cache.delete(self._content_cache_key)
+            self._content_cache_key = None
+        return success
+
+
+class CachedXmlDatastream(models.XmlDatastream):
+    """:class:`eulfedora.models.XmlDatastream` that loads content
+    through :class:`CachedXmlDatastreamObject`.  Intended for
+    read-mostly XML datastreams that are needed on most page views."""
+    _datastreamClass = CachedXmlDatastreamObject
+
+
 class DigitalObject(models.DigitalObject):
     """Extend the default fedora DigitalObject class."""
 
-    dc = models.XmlDatastream("DC", "Dublin Core", models.DublinCore, defaults={
+    dc = CachedXmlDatastream("DC", "Dublin Core", models.DublinCore, defaults={
             'control_group': 'M',
             'format': 'http://www.openarchives.org/OAI/2.0/oai_dc/',
             'versionable': True,
@@ -98,6 +280,19 @@ class DigitalObject(models.DigitalObject):
 
     PID_TOKEN = '{%PID%}'
     ENCODED_PID_TOKEN = iri_to_uri(PID_TOKEN)
+
+    @classmethod
+    def ark_target(cls, pidspace):
+        '''Get a pidman-ready target for the object view, with a
+        :attr:`PID_TOKEN` placeholder for the noid.'''
+        # first just reverse the view name.
+        pid = '%s:%s' % (pidspace, cls.PID_TOKEN)
+        target = reverse("publication:view", kwargs={'pid': pid})
+        # reverse() encodes the PID_TOKEN, so unencode just that part
+        target = target.replace(cls.ENCODED_PID_TOKEN, cls.PID_TOKEN)
+        # reverse() returns a full path - absolutize so we get scheme & server also
+        return absolutize_url(target)
+
     def get_default_pid(self):
         '''Default pid logic for DigitalObjects in openemory.  Mint a
         new ARK via the PID manager, store the ARK in the MODS
@@ -106,30 +301,36 @@ class DigitalObject(models.DigitalObject):
         Fedora pidspace.'''
 
         if pidman is not None:
-            # pidman wants a target for the new pid
-            '''Get a pidman-ready target for a named view.'''
-
-            # first just reverse the view name.
-            pid = '%s:%s' % (self.default_pidspace, self.PID_TOKEN)
-            target = reverse("publication:view", kwargs={'pid': pid})
-            # reverse() encodes the PID_TOKEN, so unencode just that part
-            target = target.replace(self.ENCODED_PID_TOKEN, self.PID_TOKEN)
-            # reverse() returns a full path - absolutize so we get scheme & server also
-            target = absolutize_url(target)
             # pid name is not required, but helpful for managing pids
             pid_name = self.label
-            # ask pidman for a new ark in the configured pidman domain
-            ark_uri = pidman.create_ark(settings.PIDMAN_DOMAIN, target, name=pid_name)
+            # claim a pre-minted ark from the local pool if possible,
+            # so ingest doesn't have to wait on the PID manager
+            try:
+                # savepoint, so a database error doesn't break an enclosing transaction
+                with transaction.atomic():
+                    reserved = ReservedArk.claim(name=pid_name)
+            except DatabaseError as err:
+                # e.g., the reserved ark table has not been created yet
+                logger.error('Error claiming a reserved ARK: %s' % err)
+                reserved = None
+            if reserved is not None:
+                ark_uri = reserved.ark_uri
+            else:
+                logger.warning('No reserved ARK available; minting ARK from the PID manager')
+                # ask pidman for a new ark in the configured pidman domain
+                ark_uri = pidman.create_ark(settings.PIDMAN_DOMAIN,
+                                            self.ark_target(self.default_pidspace),
+                                            name=pid_name).decode("utf-8")
             # pidman returns the full, resolvable ark
             # parse into dictionary with nma, naan, and noid
-            parsed_ark = parse_ark(ark_uri.decode("utf-8"))
+            parsed_ark = parse_ark(ark_uri)
             naan = parsed_ark['naan']  # name authority number
             noid = parsed_ark['noid']  # nice opaque identifier
             ark = "ark:/%s/%s" % (naan, noid)
 
             # Add full uri ARK to dc:identifier and  descMetadata
-            self.dc.content.identifier_list.append(ark_uri.decode("utf-8"))
-            self.descMetadata.content.ark_uri = ark_uri.decode("utf-8")
+            self.dc.content.identifier_list.append(ark_uri)
+            self.descMetadata.content.ark_uri = ark_uri
             self.descMetadata.content.ark = ark
 
             # use the noid to construct a pid in the configured pidspace
@@ -142,3 +343,34 @@ class DigitalObject(models.DigitalObject):
     def noid(self):
         pidspace, noid = self.pid.split(':')
         return noid
+
+
+def request_object(request, repo, pid, type=None):
+    '''Request-scoped identity map for Fedora objects.  Returns the
+    object previously loaded for the same pid, type and repository
+    user during the current request if there is one; otherwise
+    initializes it with :meth:`~eulfedora.server.Repository.get_object`
+    and stores it on the request, so that views and decorators that
+    need the same object (e.g. a ``last_modified`` check followed by
+    the view itself) share a single set of Fedora API calls.
+
+    :param request: current :class:`~django.http.HttpRequest`; if None,
+        the object is loaded without caching
+    :param repo: :class:`~eulfedora.server.Repository` to load from
+    :param pid: object pid
+    :param type: object type (optional)
+    '''
+    if type is None:
+        type = models.DigitalObject
+    if request is None:
+        return repo.get_object(pid=pid, type=type)
+
+    objects = getattr(request, '_fedora_objects', None)
+    if objects is None:
+        objects = request._fedora_objects = {}
+    # objects are only shared when loaded with the same credentials,
+    # since permissions determine what content is accessible
+    key = (pid, getattr(repo, 'username', None), type)
+    if key not in objects:
+        objects[key] = repo.get_object(pid=pid, type=type)
+    return objects[key]
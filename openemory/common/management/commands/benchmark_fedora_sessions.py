@@ -0,0 +1,88 @@
+# file openemory/common/management/commands/benchmark_fedora_sessions.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from openemory.common import fedora
+from openemory.common.fedora import Repository
+
+
+class ConnectionCounter(logging.Handler):
+    '''Count new connections opened by urllib3, based on its debug
+    logging.'''
+
+    def __init__(self):
+        super(ConnectionCounter, self).__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().startswith('Starting new'):
+            self.count += 1
+
+
+class Command(BaseCommand):
+    '''Benchmark Fedora access with and without pooled HTTP sessions.
+    Simulates concurrent page views: each request initializes a new
+    :class:`~openemory.common.fedora.Repository` and loads the profile
+    of the specified object, the way views do.  Reports elapsed time
+    and the number of new TCP/TLS connections opened for each mode.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('pid', help='pid of an existing object to load')
+        parser.add_argument('-r', '--requests', action='store', type=int, default=200,
+                            help='Number of simulated requests per mode (default: %(default)s)')
+        parser.add_argument('-c', '--concurrency', action='store', type=int, default=8,
+                            help='Number of concurrent threads (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        pid = options['pid']
+        if not Repository().get_object(pid).exists:
+            raise CommandError('%s does not exist' % pid)
+
+        counter = ConnectionCounter()
+        urllib3_logger = logging.getLogger('urllib3.connectionpool')
+        previous_level = urllib3_logger.level
+        urllib3_logger.setLevel(logging.DEBUG)
+        urllib3_logger.addHandler(counter)
+        try:
+            for label, pooled in (('Unpooled', False), ('Pooled', True)):
+                # start each pooled run without established connections
+                fedora._sessions.clear()
+                counter.count = 0
+                with override_settings(FEDORA_SESSION_POOL=pooled):
+                    elapsed = self.run(pid, options['requests'], options['concurrency'])
+                self.stdout.write('%s: %d requests in %.2f sec (%.1f/sec); %d new connections\n' %
+                                  (label, options['requests'], elapsed,
+                                   options['requests'] / elapsed, counter.count))
+        finally:
+            urllib3_logger.removeHandler(counter)
+            urllib3_logger.setLevel(previous_level)
+
+    def run(self, pid, total, concurrency):
+        def view(i):
+            Repository().get_object(pid).modified
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            list(executor.map(view, range(total)))
+        return time.time() - start
@@ -0,0 +1,91 @@
+# file openemory/common/management/commands/benchmark_title_match.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openemory.util import percent_match, solr_interface, TitleMatcher
+
+
+class Command(BaseCommand):
+    '''Benchmark matching query titles against a set of candidate
+    titles with :meth:`~openemory.util.percent_match` called for each
+    pair, and with :class:`~openemory.util.TitleMatcher`, and check
+    that both find the same matches.  Candidate titles are read from a
+    file (one per line) or, by default, from the Solr index.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('titles', nargs='?', default=None,
+                            help='File of candidate titles, one per line (default: titles from Solr)')
+        parser.add_argument('-c', '--candidates', action='store', type=int, default=2000,
+                            help='Number of candidate titles (default: %(default)s)')
+        parser.add_argument('-q', '--queries', action='store', type=int, default=20,
+                            help='Number of query titles, sampled from the candidates (default: %(default)s)')
+        parser.add_argument('-p', '--percent', action='store', type=float, default=90,
+                            help='Percent match required (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        if options['titles']:
+            with open(options['titles']) as titlefile:
+                titles = [line.strip() for line in titlefile if line.strip()]
+        else:
+            solr = solr_interface()
+            results = solr.query(title__any=True).field_limit('title') \
+                          .paginate(rows=options['candidates']).execute()
+            titles = [r['title'] for r in results]
+        titles = titles[:options['candidates']]
+        if not titles:
+            raise CommandError('No candidate titles')
+
+        # sample queries, changing some slightly so that near matches are included
+        rand = random.Random(0)
+        queries = []
+        for title in rand.sample(titles, min(options['queries'], len(titles))):
+            if rand.random() < 0.5:
+                title = title.lower().rstrip('.') + '.'
+            queries.append(title)
+        percent = options['percent']
+
+        start = time.time()
+        expected = []
+        for query in queries:
+            matches = []
+            for title in titles:
+                try:
+                    success, match = percent_match(query, title, percent)
+                except ZeroDivisionError:
+                    continue
+                if success:
+                    matches.append((title, match))
+            expected.append(matches)
+        pairwise = time.time() - start
+
+        start = time.time()
+        matcher = TitleMatcher(titles)
+        setup = time.time() - start
+        start = time.time()
+        found = [matcher.matches(query, percent) for query in queries]
+        batch = time.time() - start
+
+        self.stdout.write('%d queries against %d titles at %s%%\n' % (len(queries), len(titles), percent))
+        self.stdout.write('percent_match: %.3f sec\n' % pairwise)
+        self.stdout.write('TitleMatcher: %.3f sec (plus %.3f sec setup)\n' % (batch, setup))
+        self.stdout.write('Matches: %d; results %s\n' % (sum(len(m) for m in found),
+                          'identical' if found == expected else 'DIFFER'))
@@ -0,0 +1,99 @@
+# file openemory/common/management/commands/mint_arks.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from collections import defaultdict
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pidservices.clients import parse_ark
+
+from openemory.common import fedora
+from openemory.common.fedora import DigitalObject
+from openemory.common.models import ReservedArk
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    '''Maintain the pool of pre-minted ARKs used when ingesting new
+    objects (see :class:`~openemory.common.models.ReservedArk`).
+    Updates the PID manager with the names of any ARKs claimed since
+    the last run, then mints new ARKs until the requested number are
+    available.  Intended to be run regularly from cron.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--noact', action='store_true', default=False,
+                            help='Report what would be done but do not mint or update ARKs')
+        parser.add_argument('-s', '--size', action='store', type=int,
+                            default=getattr(settings, 'PIDMAN_ARK_POOL_SIZE', 100),
+                            help='Number of available ARKs to keep in the pool (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
+        self.counts = defaultdict(int)
+
+        if fedora.pidman is None:
+            raise CommandError('PID manager is not configured')
+        pidman = fedora.pidman
+
+        # update names for ARKs claimed since the last run
+        for ark in ReservedArk.objects.filter(claimed__isnull=False, updated=False):
+            self.output(2, 'Updating %s with name "%s"' % (ark.noid, ark.name))
+            if options['noact']:
+                self.counts['updated'] += 1
+                continue
+            try:
+                if ark.name:
+                    pidman.update_ark(ark.noid, name=ark.name)
+                ark.updated = True
+                ark.save()
+                self.counts['updated'] += 1
+            except Exception as e:
+                self.output(0, 'Error updating %s: %s' % (ark.noid, e))
+                self.counts['errors'] += 1
+
+        available = ReservedArk.objects.filter(claimed__isnull=True).count()
+        needed = max(options['size'] - available, 0)
+        self.output(1, '%d ARKs available; minting %d' % (available, needed))
+
+        if needed and not options['noact']:
+            target = DigitalObject.ark_target(settings.FEDORA_PIDSPACE)
+            for i in range(needed):
+                try:
+                    ark_uri = pidman.create_ark(settings.PIDMAN_DOMAIN, target).decode('utf-8')
+                    ReservedArk.objects.create(ark_uri=ark_uri,
+                                               noid=parse_ark(ark_uri)['noid'])
+                    self.output(2, 'Minted %s' % ark_uri)
+                    self.counts['minted'] += 1
+                except Exception as e:
+                    # if pidman is unavailable, don't keep trying
+                    self.output(0, 'Error minting ARK: %s' % e)
+                    self.counts['errors'] += 1
+                    break
+
+        # summarize what was done
+        self.stdout.write("Names updated: %s\n" % self.counts['updated'])
+        self.stdout.write("Minted: %s\n" % self.counts['minted'])
+        self.stdout.write("Available: %s\n" % ReservedArk.objects.filter(claimed__isnull=True).count())
+        self.stdout.write("Errors: %s\n" % self.counts['errors'])
+
+    def output(self, v, msg):
+        '''simple function to handle logging output based on verbosity'''
+        if self.verbosity >= v:
+            self.stdout.write("%s\n" % msg)
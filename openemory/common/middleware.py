@@ -0,0 +1,53 @@
+# file openemory/common/middleware.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import logging
+import time
+
+from django.conf import settings
+
+from openemory.common.fedora import track_api_calls
+
+logger = logging.getLogger(__name__)
+
+
+class FedoraApiCallMiddleware(object):
+    '''Count the Fedora API calls made while handling each request.
+    The count, total time spent waiting on Fedora (summed across
+    threads) and the overall view latency are logged at debug level
+    along with the view name, and, when ``DEBUG`` is enabled, returned
+    in ``X-Fedora-Api-Calls``, ``X-Fedora-Api-Time`` and
+    ``X-Response-Time`` response headers.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'calls': 0, 'time': 0.0}
+        start = time.time()
+        with track_api_calls(stats):
+            response = self.get_response(request)
+        elapsed = time.time() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else request.path
+        logger.debug('%s: %.3f sec; %d Fedora API calls (%.3f sec)', view,
+                     elapsed, stats['calls'], stats['time'])
+        if settings.DEBUG:
+            response['X-Fedora-Api-Calls'] = str(stats['calls'])
+            response['X-Fedora-Api-Time'] = '%.3f' % stats['time']
+            response['X-Response-Time'] = '%.3f' % elapsed
+        return response
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservedArk',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('ark_uri', models.CharField(unique=True, max_length=255)),
+                ('noid', models.CharField(unique=True, max_length=50)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('claimed', models.DateTimeField(db_index=True, null=True, blank=True)),
+                ('name', models.CharField(max_length=255, blank=True)),
+                ('updated', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
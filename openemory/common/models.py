@@ -15,3 +15,50 @@
 #   limitations under the License.
 
 # Create your models here.
+
+from django.db import models
+from django.utils import timezone
+
+
+class ReservedArk(models.Model):
+    '''An ARK minted in advance from the PID manager and held in a
+    local pool, so that new objects can be assigned a pid without
+    waiting on the PID manager at ingest.  ARKs are added to the pool
+    by the ``mint_arks`` command, claimed by
+    :meth:`openemory.common.fedora.DigitalObject.get_default_pid`, and
+    then updated in the PID manager with the name of the object that
+    claimed them the next time ``mint_arks`` runs.'''
+    ark_uri = models.CharField(max_length=255, unique=True)
+    noid = models.CharField(max_length=50, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+    #: date the ARK was claimed for a new object; null if still available
+    claimed = models.DateTimeField(null=True, blank=True, db_index=True)
+    #: name for the ARK in the PID manager, set when claimed
+    name = models.CharField(max_length=255, blank=True)
+    #: set once the PID manager has been updated after the ARK is claimed
+    updated = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.ark_uri
+
+    #: number of available ARKs to try when claiming, in case of contention
+    CLAIM_ATTEMPTS = 5
+
+    @classmethod
+    def claim(cls, name=''):
+        '''Claim the oldest available ARK from the pool.  Claims are
+        made with a conditional update, so concurrent ingests never
+        claim the same ARK.
+
+        :param name: name to be set in the PID manager for the ARK
+        :returns: the claimed :class:`ReservedArk`, or None if the pool
+            is empty
+        '''
+        available = cls.objects.filter(claimed__isnull=True).order_by('pk')
+        for ark in available[:cls.CLAIM_ATTEMPTS]:
+            now = timezone.now()
+            if cls.objects.filter(pk=ark.pk, claimed__isnull=True) \
+                          .update(claimed=now, name=name or ''):
+                ark.claimed = now
+                ark.name = name or ''
+                return ark
@@ -20,6 +20,8 @@ import os
 from django.conf import settings
 from urlparse import urlsplit, parse_qs
 
+from django.core.cache import cache
+from django.db import DatabaseError
 from django.test import TestCase
 from mock import patch, Mock
 
@@ -27,8 +29,10 @@ from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 from eulxml.xmlmap import load_xmlobject_from_file
 
 from openemory.common import romeo
-from openemory.common.fedora import absolutize_url
-from openemory.publication.models import Publication
+from openemory.common.models import ReservedArk
+from openemory.common.fedora import absolutize_url, request_object, \
+     CachedXmlDatastreamObject, pooled_session, use_pooled_session
+from openemory.publication.models import Publication, PublicationMods
 
 logger = logging.getLogger(__name__)
 DIR_NAME = os.path.dirname(__file__)
@@ -79,11 +83,134 @@ class DigitalObjectTests(TestCase):
         settings.PIDMAN_HOST = _pidman_host
         settings.PIDMAN_DOMAIN = _pidman_domain
 
+    @patch('openemory.common.fedora.pidman')
+    def test_get_default_pid_reserved(self, mockpidman):
+        ReservedArk.objects.create(ark_uri=self.testark, noid=self.noid)
+        obj = Publication(Mock())
+        obj.label = 'my test object'
+        pid = obj.get_default_pid()
+        self.assertEqual('%s:%s' % (settings.FEDORA_PIDSPACE, self.noid), pid)
+        # reserved ark used without calling pidman
+        mockpidman.create_ark.assert_not_called()
+        self.assertEqual(self.testark, obj.descMetadata.content.ark_uri)
+        ark = ReservedArk.objects.get(noid=self.noid)
+        self.assertNotEqual(None, ark.claimed)
+        self.assertEqual('my test object', ark.name)
+        self.assertFalse(ark.updated)
+
+    @patch('openemory.common.fedora.ReservedArk')
+    @patch('openemory.common.fedora.pidman')
+    def test_get_default_pid_reserved_error(self, mockpidman, mockreserved):
+        # e.g., migration not applied: fall back to minting a new ark
+        mockreserved.claim.side_effect = DatabaseError('no such table')
+        mockpidman.create_ark.return_value = self.testark.encode('utf-8')
+        obj = Publication(Mock())
+        obj.label = 'my test object'
+        pid = obj.get_default_pid()
+        self.assertEqual('%s:%s' % (settings.FEDORA_PIDSPACE, self.noid), pid)
+        self.assertEqual(1, mockpidman.create_ark.call_count)
+
+    def test_reserved_ark_claim(self):
+        self.assertEqual(None, ReservedArk.claim())
+        first = ReservedArk.objects.create(ark_uri='http://p.id/ark:/123/abc', noid='abc')
+        ReservedArk.objects.create(ark_uri='http://p.id/ark:/123/def', noid='def')
+        self.assertEqual(first.pk, ReservedArk.claim('one').pk)
+        self.assertEqual('def', ReservedArk.claim('two').noid)
+        # pool is now empty
+        self.assertEqual(None, ReservedArk.claim('three'))
+
     def test_noid(self):
         A = Publication(Mock())
         A.pid="test:efg12"
         self.assertEqual(A.noid, 'efg12')
 
+    def test_request_object(self):
+        request = Mock(spec=['user'])
+        repo = Mock(username='guest')
+        obj = request_object(request, repo, 'test:1', type=Publication)
+        repo.get_object.assert_called_once_with(pid='test:1', type=Publication)
+        # same pid, type and user reuses the object loaded for this request
+        self.assertEqual(obj, request_object(request, repo, 'test:1', type=Publication))
+        self.assertEqual(1, repo.get_object.call_count)
+
+        # different credentials load a separate copy
+        mgmt_repo = Mock(username='fedoraAdmin')
+        request_object(request, mgmt_repo, 'test:1', type=Publication)
+        mgmt_repo.get_object.assert_called_once_with(pid='test:1', type=Publication)
+
+        # no request - no caching
+        request_object(None, repo, 'test:1', type=Publication)
+        self.assertEqual(2, repo.get_object.call_count)
+
+    def test_cached_xml_datastream(self):
+        cache.clear()
+        mods = b'<mods xmlns="http://www.loc.gov/mods/v3"><titleInfo><title>Cached</title></titleInfo></mods>'
+
+        def mock_obj():
+            obj = Mock(pid='test:1', _create=False, ds_list={'descMetadata': None},
+                       modified=datetime(2014, 1, 1))
+            obj.api.getDatastreamDissemination.return_value = Mock(content=mods,
+                                                                   url='http://fedora/test')
+            obj.api.modifyDatastream.return_value = Mock(status_code=200)
+            return obj
+
+        obj = mock_obj()
+        ds = CachedXmlDatastreamObject(obj, 'descMetadata', 'MODS',
+                                       objtype=PublicationMods, versionable=True)
+        self.assertEqual('Cached', ds.content.title)
+        self.assertEqual(1, obj.api.getDatastreamDissemination.call_count)
+        self.assertFalse(ds.isModified())
+
+        # second object with the same modification date uses the cache
+        other = mock_obj()
+        other_ds = CachedXmlDatastreamObject(other, 'descMetadata', 'MODS',
+                                             objtype=PublicationMods, versionable=True)
+        self.assertEqual('Cached', other_ds.content.title)
+        other.api.getDatastreamDissemination.assert_not_called()
+
+        # modified object is not served from the cache
+        changed = mock_obj()
+        changed.modified = datetime(2014, 2, 1)
+        changed_ds = CachedXmlDatastreamObject(changed, 'descMetadata', 'MODS',
+                                               objtype=PublicationMods, versionable=True)
+        changed_ds.content
+        self.assertEqual(1, changed.api.getDatastreamDissemination.call_count)
+
+        # saving invalidates the cached content
+        other_ds.content.title = 'Updated'
+        self.assertTrue(other_ds.save())
+        refetch = mock_obj()
+        CachedXmlDatastreamObject(refetch, 'descMetadata', 'MODS',
+                                  objtype=PublicationMods, versionable=True).content
+        self.assertEqual(1, refetch.api.getDatastreamDissemination.call_count)
+
+
+    def test_pooled_session(self):
+        def mock_api(username):
+            api = Mock(base_url='http://fedora/', username=username, request_options={})
+            api.session.headers = {'User-Agent': 'eulfedora'}
+            return api
+
+        session = pooled_session(mock_api('guest'))
+        self.assertEqual('eulfedora', session.headers['User-Agent'])
+        # same url and credentials share a session
+        self.assert_(session is pooled_session(mock_api('guest')))
+        # different credentials do not
+        self.assert_(session is not pooled_session(mock_api('fedoraAdmin')))
+
+        api = mock_api('guest')
+        with self.settings(FEDORA_TIMEOUT=5):
+            use_pooled_session(api)
+        self.assert_(api.session is session)
+        self.assertEqual(5, api.request_options['timeout'])
+
+        api = mock_api('guest')
+        orig_session = api.session
+        with self.settings(FEDORA_SESSION_POOL=False):
+            use_pooled_session(api)
+        self.assert_(api.session is orig_session)
+
+
 class RomeoTests(TestCase):
     fixtures_dir = os.path.join(DIR_NAME, 'fixtures', 'romeo')
     def fixture_text(self, fname):
@@ -16,17 +16,27 @@
 
 '''Tools for querying NCBI Entrez E-utilities, notably including PubMed.'''
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
 import logging
+import shutil
+import socket
+import tempfile
+import threading
 from time import sleep
+from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
 from urllib.request import urlopen
+from django.conf import settings
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 
 from django_auth_ldap.backend import LDAPBackend as EmoryLDAPBackend
 from eulxml import xmlmap
 from django.contrib.auth.models import User
+from lxml import etree
 
 from openemory.publication.models import NlmArticle
 
@@ -57,9 +67,35 @@ class EntrezClient(object):
     '``email`` query argument added to all eutils queries'
     EUTILS_QUERY_DELAY_SECONDS = 0.34
     'minimum seconds to pause between consecutive eutils requests'
-
-    def __init__(self):
+    EUTILS_API_KEY_DELAY_SECONDS = 0.11
+    '''minimum seconds to pause between consecutive eutils requests when
+    an API key is used'''
+    EUTILS_RETRIES = 3
+    'number of times to retry a query after a transient error'
+    EUTILS_TIMEOUT = 60
+    'seconds to wait for an eutils response before retrying'
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+    'HTTP response codes that are retried'
+
+    def __init__(self, api_key=None):
+        '''
+        :param api_key: optional NCBI API key, added to all eutils
+            queries to allow a higher request rate; defaults to
+            ``ENTREZ_API_KEY`` in Django settings, if set
+        '''
+        if api_key is None:
+            api_key = getattr(settings, 'ENTREZ_API_KEY', None)
+        self.api_key = api_key or None
         self.last_query_time = None
+        # queries may be made from several threads (see read_ahead)
+        self._timing_lock = threading.Lock()
+
+    @property
+    def query_delay(self):
+        'minimum seconds between queries, depending on whether an API key is used'
+        if self.api_key:
+            return self.EUTILS_API_KEY_DELAY_SECONDS
+        return self.EUTILS_QUERY_DELAY_SECONDS
 
     def esearch(self, **kwargs):
         '''Query ESearch, forwarding all arguments as URL query arguments.
@@ -82,20 +118,47 @@ class EntrezClient(object):
             kwargs['retmode'] = 'xml'
         return self._query(self.EFETCH, kwargs, EFetchResponse)
 
-    def _query(self, base_url, qargs, response_xmlclass):
+    def efetch_stream(self, **kwargs):
+        '''Query EFetch like :meth:`efetch`, but download the response to
+        a temporary file instead of parsing it, so that articles can be
+        parsed one at a time with :meth:`iter_articles`.
+
+        :returns: temporary file object, positioned at the start
+        '''
+        if 'retmode' not in kwargs:
+            kwargs = kwargs.copy()
+            kwargs['retmode'] = 'xml'
+        return self._query(self.EFETCH, kwargs)
+
+    def esummary(self, **kwargs):
+        '''Query ESummary, forwarding all arguments as URL query arguments.
+        Adds ``tool`` and ``email`` query arguments if they are not
+        included.
+
+        :returns: :class:`ESummaryResponse`
+        '''
+        return self._query(self.ESUMMARY, kwargs, ESummaryResponse)
+
+    def _query(self, base_url, qargs, response_xmlclass=None):
         '''Utility method: Adds required query arguments, returns response
-        as a caller-specified :class:`~eulxml.xmlmap.XmlObject`. Delays if
-        necessary to enforce EUtils query speed policy.
+        as a caller-specified :class:`~eulxml.xmlmap.XmlObject`, or, if no
+        class is specified, as a temporary file. Delays if
+        necessary to enforce EUtils query speed policy, and retries with
+        exponential backoff (or the server's Retry-After, if given) on
+        connection errors, timeouts and :attr:`RETRY_STATUS` responses.
         '''
-        self._enforce_query_timing()
+        if response_xmlclass is None:
+            load = _spool
+        else:
+            load = lambda source: xmlmap.load_xmlobject_from_file(source, xmlclass=response_xmlclass)
+
         qargs = qargs.copy()
         if 'tool' not in qargs:
             qargs['tool'] = self.EUTILS_TOOL
         if 'email' not in qargs:
             qargs['email'] = self.EUTILS_EMAIL
-        # TODO: When we start making more than one query we need to sleep to
-        # avoid making more than 3 requests per second per E-Utilities
-        # policies.
+        if self.api_key and 'api_key' not in qargs:
+            qargs['api_key'] = self.api_key
         qurl = base_url + urlencode(qargs)
         logger.debug('EntrezClient querying: ' + qurl)
 
@@ -105,36 +168,150 @@ class EntrezClient(object):
         url_validator = URLValidator()
         try:
             url_validator(qurl)
-            target_file = urlopen(qurl)
-            return xmlmap.load_xmlobject_from_file(target_file, xmlclass=response_xmlclass)
         except ValidationError:
-            return xmlmap.load_xmlobject_from_file(qurl, xmlclass=response_xmlclass)
+            return load(qurl)
+
+        for attempt in range(self.EUTILS_RETRIES + 1):
+            self._enforce_query_timing()
+            try:
+                target_file = urlopen(qurl, timeout=self.EUTILS_TIMEOUT)
+                return load(target_file)
+            except HTTPError as err:
+                if err.code not in self.RETRY_STATUS or attempt == self.EUTILS_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                try:
+                    delay = max(delay, int(err.headers.get('Retry-After', 0)))
+                except (TypeError, ValueError):
+                    pass
+                error = err
+            except (URLError, socket.timeout, ConnectionError) as err:
+                if attempt == self.EUTILS_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                error = err
+            logger.warning('EntrezClient retrying %s in %s sec after error: %s' % \
+                           (base_url, delay, error))
+            sleep(delay)
 
     def _enforce_query_timing(self):
         '''Enforce EUtils query speed policy by sleeping to keep queries
-        separated by at least :data:`EUTILS_QUERY_DELAY_SECONDS`.
+        separated by at least :attr:`query_delay`.  Each query reserves
+        the next available time slot under a lock, so the limit holds
+        across all threads using this client.
         '''
-        now = datetime.now()
-        if self.last_query_time is not None:
-            next_query_allowed = self.last_query_time + timedelta(seconds=self.EUTILS_QUERY_DELAY_SECONDS)
-            logger.debug('EntrezClient timing next=%s; now=%s' % \
-                    (str(next_query_allowed), str(now)))
-            if now < next_query_allowed:
-                delay = next_query_allowed - now
-                # don't calculate anything larger than seconds: this assumes
-                # that EUTILS_QUERY_DELAY_SECONDS < 1day
-                delay_seconds = delay.seconds + delay.microseconds / 1000000.0
-                logger.debug('EntrezClient sleeping for ' + str(delay_seconds))
-                sleep(delay_seconds)
-        self.last_query_time = now
+        with self._timing_lock:
+            now = datetime.now()
+            next_query_allowed = now
+            if self.last_query_time is not None:
+                next_query_allowed = max(now, self.last_query_time +
+                                         timedelta(seconds=self.query_delay))
+                logger.debug('EntrezClient timing next=%s; now=%s' % \
+                        (str(next_query_allowed), str(now)))
+            self.last_query_time = next_query_allowed
+        if now < next_query_allowed:
+            delay = next_query_allowed - now
+            # don't calculate anything larger than seconds: this assumes
+            # that the query delay < 1day
+            delay_seconds = delay.seconds + delay.microseconds / 1000000.0
+            logger.debug('EntrezClient sleeping for ' + str(delay_seconds))
+            sleep(delay_seconds)
+
+
+def _spool(source):
+    '''Copy a response (file object or local path) to a temporary file
+    and return the temporary file, positioned at the start.'''
+    spooled = tempfile.TemporaryFile()
+    if isinstance(source, str):
+        with open(source, 'rb') as infile:
+            shutil.copyfileobj(infile, spooled)
+    else:
+        shutil.copyfileobj(source, spooled)
+        source.close()
+    spooled.seek(0)
+    return spooled
+
+
+def iter_articles(source):
+    '''Parse EFetch XML incrementally, returning one
+    :class:`~openemory.publication.models.NlmArticle` at a time.  Each
+    article element is detached from the document as soon as it has
+    been parsed, so memory use depends on the size of a single article
+    and not on the number of articles in the response.
+
+    :param source: file object or path of an EFetch response
+    '''
+    for event, element in etree.iterparse(source, events=('end',), tag='article',
+                                          no_network=True, huge_tree=True):
+        parent = element.getparent()
+        if parent is not None:
+            parent.remove(element)
+        yield NlmArticle(element)
+
+
+def read_ahead(querysets, depth=1):
+    '''Iterate over :class:`ArticleQuerySet` chunks, fetching up to
+    ``depth`` following chunks in background threads while the current
+    one is being processed.  Chunks are returned in order, with their
+    articles already fetched.  Queries still share the request rate limit
+    of their :class:`EntrezClient`.
+
+    :param querysets: iterable of :class:`ArticleQuerySet`, e.g. the
+        pages of a :class:`~django.core.paginator.Paginator`
+    :param depth: number of chunks to fetch ahead; 0 fetches each chunk
+        only when it is used
+    '''
+    if depth < 1:
+        for qs in querysets:
+            yield qs
+        return
+
+    executor = ThreadPoolExecutor(max_workers=depth)
+    pending = deque()
+    try:
+        for qs in querysets:
+            pending.append((qs, executor.submit(qs.fetch)))
+            if len(pending) > depth:
+                qs, future = pending.popleft()
+                future.result()
+                yield qs
+        while pending:
+            qs, future = pending.popleft()
+            future.result()
+            yield qs
+    finally:
+        # stopped early: don't fetch chunks that will not be used
+        for qs, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
 
 
 class ArticleQuerySet(object):
-    def __init__(self, entrez, results, start=None, stop=None, **kwargs):
+    '''Lazily-fetched, sliceable list of articles from an ESearch result
+    stored in Entrez history.
+
+    If a ``prefilter`` is specified, each slice is first queried with
+    ESummary and only the document ids returned by
+    ``prefilter(list_of_ids)`` are fetched with EFetch, so that full
+    article XML is not downloaded for documents that will be skipped.
+    Iterating over a prefiltered slice returns only the remaining
+    articles; the number of ids removed is available as
+    :attr:`skipped` once the slice has been fetched.
+
+    If ``stream`` is True, fetching a slice only downloads the EFetch
+    response to a temporary file, and articles are parsed one at a time
+    while iterating (see :meth:`iter_articles`), so that memory use
+    does not grow with the size of the slice.
+    '''
+    def __init__(self, entrez, results, start=None, stop=None, prefilter=None,
+                 stream=False, **kwargs):
         self.entrez = entrez
         self.results = results
+        self.prefilter = prefilter
+        self.stream = stream
         self.query_opts = kwargs
         self._chunk = None
+        self.skipped = 0
 
         if start is None:
             start = 0
@@ -188,17 +365,22 @@ class ArticleQuerySet(object):
                 stop = self.stop
 
             return ArticleQuerySet(self.entrez, self.results,
-                    start, stop, **self.query_opts)
+                    start, stop, prefilter=self.prefilter, stream=self.stream,
+                    **self.query_opts)
 
-        elif isinstance(key, (int, long)):
+        elif isinstance(key, int):
             if key < 0:
                 key = len(self) + key
             if key < 0 or key >= len(self):
                 raise IndexError('index out of range')
 
-            if self._chunk is None:
-                self._chunk = self._execute()
-            return self._chunk.articles[key]
+            self.fetch()
+            if self.stream:
+                try:
+                    return next(islice(self, key, None))
+                except StopIteration:
+                    raise IndexError('index out of range')
+            return self._chunk[key]
 
         else:
             raise TypeError('index must be a number or a slice')
@@ -207,12 +389,35 @@ class ArticleQuerySet(object):
         query_opts = self.query_opts.copy()
         query_opts['retstart'] = self.start
         query_opts['retmax'] = len(self)
-        return self.entrez.efetch(**query_opts)
-
-    def __iter__(self):
+        if self.prefilter is not None:
+            summary = self.entrez.esummary(**query_opts)
+            docids = [doc.docid for doc in summary.documents]
+            fetch_ids = self.prefilter(docids)
+            self.skipped = len(docids) - len(fetch_ids)
+            if not fetch_ids:
+                return []
+            query_opts = {'db': query_opts.get('db', 'pmc'),
+                          'id': ','.join(str(docid) for docid in fetch_ids)}
+
+        if self.stream:
+            return self.entrez.efetch_stream(**query_opts)
+        return self.entrez.efetch(**query_opts).articles
+
+    def fetch(self):
+        '''Query for the articles in this slice, if not already done.
+
+        :returns: this :class:`ArticleQuerySet`
+        '''
         if self._chunk is None:
             self._chunk = self._execute()
-        return iter(self._chunk.articles)
+        return self
+
+    def __iter__(self):
+        self.fetch()
+        if self.stream and self._chunk:
+            self._chunk.seek(0)
+            return iter_articles(self._chunk)
+        return iter(self._chunk)
 
     @property
     def count(self):
@@ -232,6 +437,23 @@ class ESearchResponse(xmlmap.XmlObject):
     '''first page of document UIDs (*not* PMIDs) matching the query'''
 
 
+class ESummaryDocument(xmlmap.XmlObject):
+    '''Minimal wrapper for a single document summary in ESummary XML
+    returns'''
+    docid = xmlmap.IntegerField('Id')
+    '''document UID (for PubMed Central, the PMC id)'''
+    title = xmlmap.StringField('Item[@Name="Title"]')
+    '''document title'''
+    pmid = xmlmap.IntegerField('Item[@Name="PmId"]')
+    '''PubMed id, if any'''
+
+
+class ESummaryResponse(xmlmap.XmlObject):
+    '''Minimal wrapper for ESummary XML returns'''
+    documents = xmlmap.NodeListField('DocSum', ESummaryDocument)
+    '''list of :class:`ESummaryDocument`'''
+
+
 class EFetchAuthor(xmlmap.XmlObject):
     '''Minimal wrapper for author in EFetch XML returns'''
     surname = xmlmap.StringField('name/surname')
@@ -18,6 +18,7 @@ from collections import defaultdict
 import logging
 from optparse import make_option
 import os
+import time
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Max
@@ -26,8 +27,9 @@ from eulxml import xmlmap
 
 from openemory.harvest.entrez import EFetchResponse,EFetchAuthor
 from openemory.harvest.models import OpenEmoryEntrezClient, HarvestRecord
+from openemory.publication.models import LastRun, NlmArticle
 import datetime
-from openemory.harvest.entrez import ArticleQuerySet
+from openemory.harvest.entrez import ArticleQuerySet, read_ahead
 from progressbar import ETA, Percentage, ProgressBar, Bar
 
 logger = logging.getLogger(__name__)
@@ -38,8 +40,27 @@ class Command(BaseCommand):
 
     This command connects to PubMed Central via its public web interface and
     finds articles that include Emory in their "Affiliation" metadata.
+
+    By default only articles added to PubMed Central (by Entrez date)
+    since the last successful harvest are searched.  The watermark is
+    stored as a :class:`~openemory.publication.models.LastRun` and is
+    only advanced when a run covering the whole range from the
+    watermark to the present completes without errors.  Use ``--full``
+    to search everything since :data:`FULL_MIN_DATE`, or ``--min-date``
+    and ``--max-date`` to backfill a specific range without moving the
+    watermark.
     '''
     help = __doc__
+
+    #: name of the :class:`LastRun` record used as the harvest watermark
+    LAST_RUN_NAME = 'Fetch PMC metadata'
+
+    #: earliest Entrez date searched by a full harvest, and by the first
+    #: incremental harvest when no watermark has been stored yet
+    FULL_MIN_DATE = '2015/09/01'
+
+    #: date format used for Entrez queries
+    DATE_FORMAT = '%Y/%m/%d'
     
     def add_arguments(self, parser):  
         parser.add_argument('-n', '--simulate', action='store_true', default=False, help='Simulate querying for articles')
@@ -48,109 +69,187 @@ class Command(BaseCommand):
         parser.add_argument('--min-date', default=None, help='Search for records added on or after this date. Format YYYY/MM/DD.')
         parser.add_argument('--max-date', default=None, help='Search for records added on or before this date. Format YYYY/MM/DD')
         parser.add_argument('--auto-date', action='store_true', default=False, help='Calculate min and max dates based on most recently harvested records')
+        parser.add_argument('--full', action='store_true', default=False, help='Search all records added since %s instead of since the last harvest' % self.FULL_MIN_DATE)
         parser.add_argument('--progress', action='store_true', default=False, help='Displays a progress bar based on remaining records to process.')
+        parser.add_argument('--api-key', default=None, help='NCBI API key, allowing more requests per second (default: ENTREZ_API_KEY setting)')
+        parser.add_argument('--no-prefilter', action='store_false', dest='prefilter', default=True, help='Fetch full article XML for every search result, including articles already harvested')
+        parser.add_argument('--no-stream', action='store_false', dest='stream', default=True, help='Load each chunk of fetched articles completely instead of parsing one article at a time')
+        parser.add_argument('--read-ahead', type=int, default=1, help='Number of chunks to fetch while the current chunk is processed; 0 to disable (default: %(default)s)')
 
     
     def handle(self, *args, **options):
-        today = datetime.date.today()
-        formated_today = today.strftime('%Y/%m/%d')
+        start = time.time()
+        run_start = datetime.datetime.now()
+        formated_today = run_start.strftime(self.DATE_FORMAT)
         self.verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
         # number of articles we want to harvest in this run
         self.max_articles = int(options['max_articles']) if options['max_articles'] else None
-        # self.min_date = options['min_date']
-        # self.max_date = options['max_date']
-        self.min_date = '2015/09/01'
-        self.max_date = formated_today
-        self.auto_date = False
         self.v_normal = 1
 
+        last_run, created = LastRun.objects.get_or_create(name=self.LAST_RUN_NAME,
+            defaults={'start_time': datetime.datetime.strptime(self.FULL_MIN_DATE, self.DATE_FORMAT)})
+
+        self.auto_date = options['auto_date']
+        if options['full']:
+            self.min_date = self.FULL_MIN_DATE
+            self.max_date = formated_today
+        elif options['min_date'] or options['max_date'] or self.auto_date:
+            # explicit range (backfill) or range based on harvested records
+            self.min_date = options['min_date']
+            self.max_date = options['max_date']
+        else:
+            # incremental: the watermark day is searched again, since entrez
+            # dates have no time; records already harvested are skipped
+            self.min_date = last_run.start_time.strftime(self.DATE_FORMAT)
+            self.max_date = formated_today
+
         stats = defaultdict(int)
-        done= False
+        self.done = False
         chunks = self.article_chunks(**options)
 
         if options['progress']:
-            pbar = ProgressBar(widgets=[Percentage(), ' ', ETA(),  ' ', Bar()], maxval=chunks.count).start()
-        for p in chunks.page_range:
+            self.pbar = ProgressBar(widgets=[Percentage(), ' ', ETA(),  ' ', Bar()], maxval=chunks.count).start()
+        pages = read_ahead((chunks.page(p).object_list for p in chunks.page_range),
+                           options['read_ahead'])
+        for articles in pages:
             if self.verbosity > self.v_normal:
                 self.stdout.write('Starting article chunk.\n')
+            # articles already harvested are removed by the prefilter
+            articles.fetch()
+            stats['existing'] += articles.skipped
 
-            for article in chunks.page(p).object_list:
-                # author = EFetchAuthor(article)
-                # for attr in dir(author):
-                #     if hasattr( author, attr ):
-                #         print( "obj.%s = %s" % (attr, getattr(author, attr)))
-                stats['articles'] += 1
-                # print article.docid
-                # print article.authors[4].surname
-                # print article.authors[4].aff_ids
-                # print article.authors[4].affiliation()
-                # for attr in dir(article):
-                #     if hasattr( article, attr ):
-                #         print( "obj.%s = %s" % (attr, getattr(article, attr)))
-                if self.verbosity > self.v_normal:
-                    # python2.6 fails with ascii encoding errors (on unicode
-                    # titles) unless we explicitly encode output to
-                    # sys.stdout.write
-                    msg = u'Processing [%s] "%s"\n' % \
-                          (article.docid, article.article_title)
-                    self.stdout.write(msg.encode(self.stdout.encoding))
-                
-                if HarvestRecord.objects.filter(pmcid=article.docid).exists():
-                    if self.verbosity >= self.v_normal:
-                        self.stdout.write('[%s] has already been harvested; skipping\n' \
-                                          % (article.docid,))
-                    continue
-                    
-                if article.identifiable_authors(derive=True):
-                    try:
-                        # don't save when sinulated
-                        if options['simulate']:
-                            self.stdout.write('Not Saving [%s] (simulated run)\n' % article.docid)
-                        #really save when not simulated
-                        else:
-                            HarvestRecord.init_from_fetched_article(article)
-                        stats['harvested'] += 1
-                        if self.max_articles and stats['harvested'] >= self.max_articles:
-                            done = True
-                            break
-                    except Exception as err:
-                        self.stdout.write('Error creating record from article: %s\n' % err)
-                        stats['errors'] += 1
-                        
-                else:
-                    if self.verbosity >= self.v_normal:
-                        self.stdout.write('[%s] has no identifiable authors; skipping\n' \
-                                          % (article.docid,))
-                    stats['noauthor'] += 1
-
-                if options['progress']:
-                    pbar.update(stats['articles'])
-            if done:
+            # new records for the whole chunk are created together
+            new_articles = self.harvestable(articles, stats, options)
+            errors = []
+            try:
+                records = HarvestRecord.init_from_fetched_articles(new_articles, errors)
+                # already harvested since the start of this run
+                stats['existing'] += stats['chunk'] - len(records) - len(errors)
+                stats['harvested'] += len(records)
+            except Exception as err:
+                self.stdout.write('Error creating records from articles: %s\n' % err)
+                # errors while filtering also count, so the watermark is not advanced
+                stats['errors'] += max(stats['chunk'], 1)
+            for pmcid, err in errors:
+                self.stdout.write('Error creating record from article [%s]: %s\n' % (pmcid, err))
+            stats['errors'] += len(errors)
+            stats['chunk'] = 0
+
+            if self.done:
                 if self.verbosity > self.v_normal:
                     self.stdout.write('Harvested %s articles ... stopping \n' % stats['harvested'])
+                pages.close()
                 break
         if options['progress']:
-            pbar.finish()
+            self.pbar.finish()
+
+        # only advance the watermark if everything from the watermark to
+        # the present was searched and harvested
+        if not (options['simulate'] or self.done or stats['errors']) and \
+               self.covers(self.date_opts, last_run.start_time, run_start) and \
+               run_start > last_run.start_time:
+            # compare-and-set so that overlapping runs never move the watermark back
+            updated = LastRun.objects.filter(pk=last_run.pk, start_time=last_run.start_time) \
+                                     .update(start_time=run_start)
+            if self.verbosity >= self.v_normal:
+                if updated:
+                    self.stdout.write('Watermark advanced to %s\n' % run_start)
+                else:
+                    self.stdout.write('Watermark was updated by another run; not changed\n')
 
         # summarize what was done
         if self.date_opts:
             self.stdout.write('Date Range: %(mindate)s - %(maxdate)s' % self.date_opts)
-        self.stdout.write('\nArticles processed: %(articles)d\n' % stats)
+        self.stdout.write('\nArticles found: %d\n' % chunks.count)
+        self.stdout.write('Articles processed: %(articles)d\n' % stats)
         self.stdout.write('Articles harvested: %(harvested)d\n' % stats)
+        self.stdout.write('Articles skipped (already harvested): %(existing)d\n' % stats)
         self.stdout.write('Errors harvesting articles: %(errors)d\n' % stats)
         self.stdout.write('Articles skipped (no identifiable authors): %(noauthor)d\n' % stats)
+        self.stdout.write('Elapsed: %.1f sec\n' % (time.time() - start))
+
+    def harvestable(self, articles, stats, options):
+        '''Generator that filters a chunk of fetched articles to those
+        that should be harvested: not already harvested, and with
+        identifiable Emory authors.  Updates ``stats`` and sets
+        :attr:`done` once ``--max-articles`` have been found; nothing
+        is returned for simulated runs.  ``stats['chunk']`` is the
+        number of articles returned.'''
+        for article in articles:
+            stats['articles'] += 1
+            if self.verbosity > self.v_normal:
+                self.stdout.write(u'Processing [%s] "%s"\n' % \
+                                  (article.docid, article.article_title))
+
+            if article.docid in self.harvested:
+                if self.verbosity >= self.v_normal:
+                    self.stdout.write('[%s] has already been harvested; skipping\n' \
+                                      % (article.docid,))
+                stats['existing'] += 1
+                continue
+
+            try:
+                authors = article.identifiable_authors(derive=True,
+                                                       affiliation_user=self.affiliation_user)
+            except Exception as err:
+                self.stdout.write('Error identifying authors for [%s]: %s\n' % (article.docid, err))
+                stats['errors'] += 1
+                continue
+
+            if authors:
+                # don't save when simulated
+                if options['simulate']:
+                    self.stdout.write('Not Saving [%s] (simulated run)\n' % article.docid)
+                    stats['harvested'] += 1
+                else:
+                    stats['chunk'] += 1
+                    yield article
+                if self.max_articles and stats['harvested'] + stats['chunk'] >= self.max_articles:
+                    self.done = True
+                    break
+            else:
+                if self.verbosity >= self.v_normal:
+                    self.stdout.write('[%s] has no identifiable authors; skipping\n' \
+                                      % (article.docid,))
+                stats['noauthor'] += 1
+
+            if options['progress']:
+                self.pbar.update(stats['articles'])
 
     def article_chunks(self, count, **kwargs):
         '''
         :param count: chunk size if requested, default is 20
+        :param api_key: optional NCBI API key
+        :param prefilter: skip articles that have already been harvested
+            before fetching full article XML; default is True
+        :param stream: parse fetched articles one at a time; default is True
         '''
-        entrez = OpenEmoryEntrezClient()
+        entrez = OpenEmoryEntrezClient(api_key=kwargs.get('api_key', None))
+
+        # one query for all harvested ids, so that chunks fetched in
+        # background threads don't need database access
+        self.harvested = set(HarvestRecord.objects.values_list('pmcid', flat=True))
+        # user for Emory-affiliated authors, looked up once per run
+        self.affiliation_user = NlmArticle.get_affiliation_user()
+        prefilter = None
+        if kwargs.get('prefilter', True):
+            prefilter = lambda pmcids: [pmcid for pmcid in pmcids if pmcid not in self.harvested]
 
         self.date_opts = self._date_opts(self.min_date, self.max_date, self.auto_date)
-        qs = entrez.get_emory_articles(**self.date_opts)
+        qs = entrez.get_emory_articles(prefilter=prefilter, stream=kwargs.get('stream', True),
+                                       **self.date_opts)
         return Paginator(qs, count)
 
 
+    def covers(self, date_opts, watermark, now):
+        '''Check whether the Entrez date range in ``date_opts`` includes
+        every day from the ``watermark`` through ``now``.'''
+        if not date_opts:
+            return False
+        mindate = datetime.datetime.strptime(date_opts['mindate'], self.DATE_FORMAT)
+        maxdate = datetime.datetime.strptime(date_opts['maxdate'], self.DATE_FORMAT)
+        return mindate.date() <= watermark.date() and maxdate.date() >= now.date()
+
     def _date_opts(self, min_date, max_date, auto_date):
         '''
         Ensure that datetype, mindate and max date are set correctly
@@ -14,10 +14,10 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from django.db import models
+from django.db import models, transaction
 from django.core.files.base import ContentFile
 from django.contrib.auth.models import User
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 from eulxml.xmlmap import load_xmlobject_from_string, load_xmlobject_from_file
 from openemory.harvest.entrez import EntrezClient, ArticleQuerySet
 from openemory.publication.models import Publication, NlmArticle, Article
@@ -118,6 +118,111 @@ class HarvestRecord(models.Model):
         return record
 
 
+    @staticmethod
+    def init_from_fetched_articles(articles, errors=None):
+        '''Initialize and save new
+        :class:`~openemory.harvest.models.HarvestRecord` instances for
+        a batch of :class:`~openemory.publication.models.NlmArticle`
+        objects, like :meth:`init_from_fetched_article`, but with a
+        fixed number of database queries for the whole batch: one to
+        find articles that have already been harvested (which are
+        skipped), one to create the records, one to find their ids and
+        one to add their authors, all in a single transaction.  Each
+        article's content file is written as soon as it is read, so
+        ``articles`` may be a generator of streamed articles.
+
+        If the batch cannot be created, each record is saved on its
+        own, so that one bad article does not keep the others from
+        being harvested.
+
+        :param errors: optional list; ``(pmcid, exception)`` is
+            appended for each article that could not be saved
+        :returns: list of saved :class:`HarvestRecord` instances
+        '''
+        if errors is None:
+            errors = []
+        pending = []
+        try:
+            for article in articles:
+                # see init_from_fetched_article for why strings are converted
+                record = HarvestRecord(title=str(article.article_title),
+                                       pmcid=article.docid,
+                                       fulltext=article.fulltext_available)
+                try:
+                    authors = list(article.identifiable_authors())
+                    # write the file without saving; records are created below
+                    record.content.save('%d.xml' % article.docid,
+                                        ContentFile(article.serialize(pretty=True)),
+                                        save=False)
+                except Exception as err:
+                    if record.content:
+                        record.content.delete(save=False)
+                    errors.append((article.docid, err))
+                    continue
+                pending.append((record, authors))
+            if not pending:
+                return []
+
+            harvested = set(HarvestRecord.objects.filter(
+                pmcid__in=[record.pmcid for record, authors in pending]) \
+                .values_list('pmcid', flat=True))
+        except Exception:
+            # don't leave content files for records that were not created
+            for record, authors in pending:
+                record.content.delete(save=False)
+            raise
+
+        new = []
+        for record, authors in pending:
+            if record.pmcid in harvested:
+                record.content.delete(save=False)
+            else:
+                harvested.add(record.pmcid)
+                new.append((record, authors))
+        if not new:
+            return []
+
+        records = [record for record, authors in new]
+        try:
+            with transaction.atomic():
+                HarvestRecord.objects.bulk_create(records)
+                # not all databases return ids from a bulk insert
+                ids = dict(HarvestRecord.objects.filter(
+                    pmcid__in=[record.pmcid for record in records]).values_list('pmcid', 'id'))
+                RecordAuthor = HarvestRecord.authors.through
+                RecordAuthor.objects.bulk_create([
+                    RecordAuthor(harvestrecord_id=ids[record.pmcid], user_id=user_id)
+                    for record, authors in new
+                    for user_id in set(user.pk for user in authors)])
+        except Exception:
+            # save records one at a time, keeping the ones that succeed
+            return HarvestRecord._save_fetched_records(new, errors)
+
+        for record in records:
+            record.pk = ids[record.pmcid]
+        return records
+
+    @staticmethod
+    def _save_fetched_records(new, errors):
+        '''Save records (with content files already written) and
+        their authors individually, as :meth:`init_from_fetched_article`
+        does, for :meth:`init_from_fetched_articles` when a batch could
+        not be created.  Content files are removed for records that
+        fail, and ``(pmcid, exception)`` is added to ``errors``.'''
+        records = []
+        for record, authors in new:
+            # ids may have been set by the rolled-back bulk insert
+            record.pk = None
+            try:
+                with transaction.atomic():
+                    record.save()
+                    record.authors.set(authors)
+                records.append(record)
+            except Exception as err:
+                record.content.delete(save=False)
+                errors.append((record.pmcid, err))
+        return records
+
     def as_publication_article(self, repo=None):
         '''Initialize (but do not save) a new
         :class:`~openemory.publication.models.Article` instance and
@@ -167,11 +272,16 @@ class OpenEmoryEntrezClient(EntrezClient):
     # FIXME: This doesn't feel like a "model" per se, but not sure precisely
     # where else it belongs...
 
-    def get_emory_articles(self, **kwargs):
+    def get_emory_articles(self, prefilter=None, stream=False, **kwargs):
         '''Search Entrez for Emory articles, currently limited to PMC
         articles with "emory" in the affiliation metadata.
 
-        :returns: :class:`~openemory.harvest.entrez.ESearchResponse`
+        :param prefilter: optional function to select which PMC ids
+            should be fetched, based on ESummary results; see
+            :class:`~openemory.harvest.entrez.ArticleQuerySet`
+        :param stream: if True, parse fetched articles one at a time
+            instead of loading each chunk completely
+        :returns: :class:`~openemory.harvest.entrez.ArticleQuerySet`
         '''
         # basic args for query
         qargs = {
@@ -185,7 +295,9 @@ class OpenEmoryEntrezClient(EntrezClient):
         qargs.update(kwargs)
 
         search_result = self.esearch(**qargs)
-        qs = ArticleQuerySet(self, search_result, 
+        qs = ArticleQuerySet(self, search_result,
+            prefilter=prefilter,
+            stream=stream,
             db='pmc',       # search PubMed Central
             usehistory='y', # use stored server-side history
             WebEnv=search_result.webenv,
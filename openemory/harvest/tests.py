@@ -17,10 +17,13 @@
 import os
 
 from datetime import timedelta, datetime
+from io import StringIO
+from urllib.error import HTTPError
 
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.core import paginator
 from mock import patch, Mock
@@ -29,7 +32,7 @@ from eulxml import xmlmap
 from openemory.accounts.models import EsdPerson
 from openemory.accounts.tests import USER_CREDENTIALS
 from openemory.harvest.entrez import (EntrezClient, ArticleQuerySet,
-    EFetchResponse, ESearchResponse)
+    EFetchResponse, ESearchResponse, ESummaryResponse, read_ahead)
 from openemory.harvest.models import OpenEmoryEntrezClient, HarvestRecord
 from openemory.publication.models import NlmArticle
 from openemory.harvest.management.commands.fetch_pmc_metadata import Command as fetch_pmc_cmd
@@ -250,6 +253,32 @@ class EntrezTest(TestCase):
         # article field testing handled below in EFetchArticleTest
 
 
+    @patch('openemory.harvest.entrez.sleep')
+    @patch('openemory.harvest.entrez.urlopen')
+    def test_query_retry(self, mock_urlopen, mock_sleep):
+        entrez = EntrezClient(api_key='abc123')
+        self.assertEqual(entrez.EUTILS_API_KEY_DELAY_SECONDS, entrez.query_delay)
+        error = HTTPError(EntrezClient.ESEARCH, 503, 'Service Unavailable', {}, None)
+        mock_urlopen.side_effect = [error, open(fixture_path('esearch-response-withhist.xml'), 'rb')]
+        response = entrez.esearch(db='pmc', term='emory')
+        self.assertEqual(2, mock_urlopen.call_count)
+        self.assertTrue(isinstance(response, ESearchResponse))
+        self.assertTrue('api_key=abc123' in mock_urlopen.call_args[0][0])
+        # backed off before retrying
+        self.assertTrue(1 in [args[0] for args, kwargs in mock_sleep.call_args_list])
+
+        # errors that are not transient are not retried
+        mock_urlopen.reset_mock()
+        mock_urlopen.side_effect = HTTPError(EntrezClient.ESEARCH, 400, 'Bad Request', {}, None)
+        self.assertRaises(HTTPError, entrez.esearch, db='pmc', term='emory')
+        self.assertEqual(1, mock_urlopen.call_count)
+
+        # without an api key, the anonymous rate applies
+        with self.settings(ENTREZ_API_KEY=None):
+            self.assertEqual(EntrezClient.EUTILS_QUERY_DELAY_SECONDS,
+                             EntrezClient().query_delay)
+
+
 class ArticleQuerySetTest(TestCase):
     def fixture_path(self, fname):
         return os.path.join(os.path.dirname(__file__), 'fixtures', fname)
@@ -367,6 +396,75 @@ class ArticleQuerySetTest(TestCase):
         check(qs[10:20][:9000],  10, 20, 'very large positive subslice stop')
         check(qs[10:20][:-9000], 10, 10, 'very large negative subslice stop')
 
+    def test_read_ahead(self):
+        self.mock_client.efetch.return_value = self.fetch_response
+        qs = ArticleQuerySet(self.mock_client, results=self.search_response)
+        chunks = [qs[i:i + 5] for i in range(0, 20, 5)]
+        for depth in (0, 2):
+            self.mock_client.efetch.reset_mock()
+            fetched = list(read_ahead([chunk[:] for chunk in chunks], depth))
+            self.assertEqual(4, len(fetched))
+            # with read-ahead, chunks are fetched before they are returned
+            self.assertEqual(4 if depth else 0, self.mock_client.efetch.call_count)
+            # chunks are returned in order
+            self.assertEqual([0, 5, 10, 15], [chunk.start for chunk in fetched])
+            for chunk in fetched:
+                self.assertEqual(self.fetch_response.articles[0], list(chunk)[0])
+            # each chunk is only fetched once
+            self.assertEqual(4, self.mock_client.efetch.call_count)
+
+    def test_prefilter(self):
+        summary = xmlmap.load_xmlobject_from_file(self.fixture_path('esummary-retrieval-from-hist.xml'),
+                xmlclass=ESummaryResponse)
+        self.mock_client.esummary.return_value = summary
+        self.mock_client.efetch.return_value = self.fetch_response
+        harvested = set([2701312, 2701976])
+        prefilter = Mock(side_effect=lambda ids: [i for i in ids if i not in harvested])
+        qs = ArticleQuerySet(self.mock_client, results=self.search_response,
+                             prefilter=prefilter, db='pmc', usehistory='y')
+        chunk = qs[:20]
+        articles = list(chunk)
+        self.assertEqual(self.fetch_response.articles[0], articles[0])
+        self.assertEqual(2, chunk.skipped)
+        # summary retrieved from history for the slice
+        args, kwargs = self.mock_client.esummary.call_args
+        self.assertEqual(0, kwargs['retstart'])
+        self.assertEqual(20, kwargs['retmax'])
+        prefilter.assert_called_once_with([doc.docid for doc in summary.documents])
+        # only ids not removed by the prefilter are fetched
+        args, kwargs = self.mock_client.efetch.call_args
+        fetched = kwargs['id'].split(',')
+        self.assertEqual(len(summary.documents) - 2, len(fetched))
+        self.assertTrue('2701312' not in fetched)
+        self.assertTrue('retstart' not in kwargs)
+
+        # nothing is fetched when every id is removed
+        self.mock_client.efetch.reset_mock()
+        chunk = ArticleQuerySet(self.mock_client, results=self.search_response,
+                                prefilter=lambda ids: [])[:20]
+        self.assertEqual([], list(chunk))
+        self.assertEqual(len(summary.documents), chunk.skipped)
+        self.assertEqual(0, self.mock_client.efetch.call_count)
+
+    def test_stream(self):
+        self.mock_client.efetch_stream.return_value = \
+            open(self.fixture_path('efetch-retrieval-from-hist.xml'), 'rb')
+        qs = ArticleQuerySet(self.mock_client, results=self.search_response,
+                             stream=True, db='pmc', usehistory='y')
+        chunk = qs[:20]
+        articles = list(chunk)
+        self.mock_client.efetch_stream.assert_called_once()
+        self.assertEqual(0, self.mock_client.efetch.call_count)
+        self.assertEqual([a.docid for a in self.fetch_response.articles],
+                         [a.docid for a in articles])
+        self.assertTrue(isinstance(articles[0], NlmArticle))
+        # articles are detached from the response document as they are parsed
+        self.assertEqual(None, articles[0].node.getparent())
+        # chunk can be iterated again and indexed
+        self.assertEqual(articles[1].docid, chunk[1].docid)
+        self.assertEqual(len(articles), len(list(chunk)))
+        self.assertEqual(1, self.mock_client.efetch_stream.call_count)
+
 
 class HarvestRecordTest(TestCase):
     fixtures = ['site_admin_group', 'users', 'harvest_records']
@@ -409,6 +507,75 @@ class HarvestRecordTest(TestCase):
             self.assert_(testauthor in record.authors.all())
             record.content.delete()
 
+    def test_init_from_fetched_articles(self):
+        # first article is in the db fixture; the second is new
+        new_article = self.fetch_response.articles[1]
+        HarvestRecord.objects.filter(pmcid=new_article.docid).delete()
+        testauthor = User(username='author')
+        testauthor.save()
+        count = HarvestRecord.objects.count()
+
+        with patch.object(self.article, 'identifiable_authors', new=Mock(return_value=[])):
+            with patch.object(new_article, 'identifiable_authors',
+                              new=Mock(return_value=[testauthor, testauthor])):
+                # duplicates within the batch are only created once
+                records = HarvestRecord.init_from_fetched_articles(
+                    iter([self.article, new_article, new_article]))
+
+        self.assertEqual(1, len(records))
+        self.assertEqual(count + 1, HarvestRecord.objects.count())
+        record = HarvestRecord.objects.get(pmcid=new_article.docid)
+        self.assertEqual(record.pk, records[0].pk)
+        self.assertEqual(new_article.article_title, record.title)
+        self.assertEqual(new_article.fulltext_available, record.fulltext)
+        self.assertEqual([testauthor], list(record.authors.all()))
+        self.assertEqual(new_article.serialize(pretty=True), record.content.read(),
+            'article xml should be saved in content file field')
+        record.content.delete()
+
+        # nothing new: only the existence check is made
+        with self.assertNumQueries(1):
+            self.assertEqual([], HarvestRecord.init_from_fetched_articles([new_article]))
+        self.assertEqual([], HarvestRecord.init_from_fetched_articles([]))
+
+    def test_init_from_fetched_articles_errors(self):
+        new_article = self.fetch_response.articles[1]
+        HarvestRecord.objects.filter(pmcid__in=[self.article.docid, new_article.docid]).delete()
+        count = HarvestRecord.objects.count()
+        errors = []
+        with patch.object(self.article, 'identifiable_authors', new=Mock(return_value=[])):
+            with patch.object(new_article, 'identifiable_authors',
+                              new=Mock(side_effect=Exception('ldap error'))):
+                # an article that can't be read is skipped
+                records = HarvestRecord.init_from_fetched_articles(
+                    iter([new_article, self.article]), errors)
+        self.assertEqual([self.article.docid], [r.pmcid for r in records])
+        self.assertEqual([new_article.docid], [pmcid for pmcid, err in errors])
+        self.assertEqual(count + 1, HarvestRecord.objects.count())
+        records[0].content.delete()
+        records[0].delete()
+
+        # when the batch can't be created, records are saved one at a time
+        errors = []
+        orig_save = HarvestRecord.save
+        def save(record, *args, **kwargs):
+            if record.pmcid == new_article.docid:
+                raise Exception('database error')
+            return orig_save(record, *args, **kwargs)
+        with patch.object(self.article, 'identifiable_authors', new=Mock(return_value=[])):
+            with patch.object(new_article, 'identifiable_authors', new=Mock(return_value=[])):
+                with patch.object(HarvestRecord.objects, 'bulk_create',
+                                  side_effect=Exception('bulk insert failed')):
+                    with patch.object(HarvestRecord, 'save', new=save):
+                        records = HarvestRecord.init_from_fetched_articles(
+                            [new_article, self.article], errors)
+        self.assertEqual([self.article.docid], [r.pmcid for r in records])
+        self.assertEqual([new_article.docid], [pmcid for pmcid, err in errors])
+        record = HarvestRecord.objects.get(pmcid=self.article.docid)
+        self.assertEqual(self.article.serialize(pretty=True), record.content.read())
+        self.assertFalse(HarvestRecord.objects.filter(pmcid=new_article.docid).exists())
+        record.content.delete()
+
     def test_mark_ingested(self):
         record = HarvestRecord.objects.get(pmcid=self.article.docid)
         record.mark_ingested()
@@ -532,4 +699,42 @@ class FetchPMCMetadataTest(TestCase):
         with self.assertRaises(CommandError) as context:
             fetch_pmc_cmd._date_opts(c, '2013/01/01', '2012/01/01', False)
 
-        self.assertEqual(context.exception.message, 'Max date must be greter than Min date')
\ No newline at end of file
+        self.assertEqual(context.exception.message, 'Max date must be greter than Min date')
+
+    @patch('openemory.harvest.management.commands.fetch_pmc_metadata.OpenEmoryEntrezClient')
+    def test_watermark(self, mockentrez):
+        from openemory.publication.models import LastRun
+        LastRun.objects.create(name=fetch_pmc_cmd.LAST_RUN_NAME,
+                               start_time=datetime(2016, 1, 1, 12, 0, 0))
+        entrez = mockentrez.return_value
+        entrez.efetch.return_value.articles = []
+        entrez.get_emory_articles.return_value = ArticleQuerySet(entrez, Mock(count=0))
+
+        # incremental run searches from the watermark and advances it
+        call_command('fetch_pmc_metadata', verbosity=1, stdout=StringIO())
+        args, kwargs = mockentrez.return_value.get_emory_articles.call_args
+        self.assertEqual('2016/01/01', kwargs['mindate'])
+        self.assertEqual(datetime.now().strftime('%Y/%m/%d'), kwargs['maxdate'])
+        self.assertEqual('edat', kwargs['datetype'])
+        watermark = LastRun.objects.get(name=fetch_pmc_cmd.LAST_RUN_NAME).start_time
+        self.assertEqual(datetime.now().date(), watermark.date())
+
+        # explicit backfill searches the requested range; watermark unchanged
+        call_command('fetch_pmc_metadata', verbosity=1, min_date='2012/01/01',
+                     max_date='2012/02/02', stdout=StringIO())
+        args, kwargs = mockentrez.return_value.get_emory_articles.call_args
+        self.assertEqual('2012/01/01', kwargs['mindate'])
+        self.assertEqual('2012/02/02', kwargs['maxdate'])
+        self.assertEqual(watermark, LastRun.objects.get(name=fetch_pmc_cmd.LAST_RUN_NAME).start_time)
+
+        # full harvest searches from the earliest date
+        call_command('fetch_pmc_metadata', verbosity=1, full=True, stdout=StringIO())
+        args, kwargs = mockentrez.return_value.get_emory_articles.call_args
+        self.assertEqual(fetch_pmc_cmd.FULL_MIN_DATE, kwargs['mindate'])
+
+        # simulated runs never move the watermark
+        LastRun.objects.filter(name=fetch_pmc_cmd.LAST_RUN_NAME) \
+                       .update(start_time=datetime(2016, 1, 1, 12, 0, 0))
+        call_command('fetch_pmc_metadata', verbosity=1, simulate=True, stdout=StringIO())
+        self.assertEqual(datetime(2016, 1, 1, 12, 0, 0),
+                         LastRun.objects.get(name=fetch_pmc_cmd.LAST_RUN_NAME).start_time)
@@ -16,7 +16,8 @@
 
 from django.contrib import admin
 from django import forms
-from openemory.publication.models import ArticleStatistics, FeaturedArticle, License, LastRun
+from openemory.publication.models import ArticleStatistics, FeaturedArticle, License, LastRun, \
+     IndexFailure
 
 class ArticleStatisticsAdmin(admin.ModelAdmin):
     list_display = ('pid', 'year', 'quarter', 'num_views', 'num_downloads')
@@ -46,6 +47,12 @@ class LastRunAdmin(admin.ModelAdmin):
     fields = ['name', 'start_time']
     list_editable = ('start_time',)
 
+class IndexFailureAdmin(admin.ModelAdmin):
+    list_display = ('pid', 'attempts', 'last_attempt', 'error')
+    search_fields = ('pid',)
+    # set attempts to 0 to have index_changed retry an object again
+    list_editable = ('attempts',)
+
 
 
 
@@ -53,3 +60,4 @@ admin.site.register(ArticleStatistics, ArticleStatisticsAdmin)
 admin.site.register(License, LicenseAdmin)
 admin.site.register(FeaturedArticle)
 admin.site.register(LastRun, LastRunAdmin)
+admin.site.register(IndexFailure, IndexFailureAdmin)
@@ -0,0 +1,189 @@
+# file openemory/publication/duplicates.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Near-duplicate detection for
+:class:`~openemory.publication.models.Publication` objects.
+
+Each publication is indexed with a list of duplicate-candidate keys
+(see :meth:`duplicate_keys`): its normalized DOI and PubMed Central id,
+if any, and locality-sensitive hash bands of a MinHash signature of
+its normalized title.  Publications that share a key are candidate
+duplicates; title candidates are confirmed by comparing title
+shingles, so the work done is proportional to the number of
+candidates rather than to the number of pairs of publications.
+
+'''
+
+import hashlib
+import random
+import zlib
+
+from openemory.util import normalize_title
+
+#: Solr field duplicate-candidate keys are indexed in
+DUPLICATE_KEY_FIELD = 'duplicate_key'
+
+#: length of the character shingles titles are compared on
+SHINGLE_SIZE = 4
+
+#: number of bands and rows per band in a title MinHash signature;
+#: titles with a shingle similarity above about (1/BANDS)**(1/ROWS),
+#: or 0.5, are likely to share at least one band key
+BANDS = 16
+ROWS = 4
+
+_PRIME = (1 << 61) - 1
+# fixed seed, so that signatures are the same in every process
+_random = random.Random(5381)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+                 for i in range(BANDS * ROWS)]
+
+
+def title_shingles(title):
+    '''Set of overlapping character shingles of a title, after
+    normalizing it with :meth:`openemory.util.normalize_title` and
+    removing whitespace.'''
+    normalized = normalize_title(title or '').replace(' ', '')
+    if len(normalized) <= SHINGLE_SIZE:
+        return set([normalized]) if normalized else set()
+    return set(normalized[i:i + SHINGLE_SIZE]
+               for i in range(len(normalized) - SHINGLE_SIZE + 1))
+
+
+def title_similarity(shingles1, shingles2):
+    '''Jaccard similarity of two sets of title shingles, from 0 to 1.'''
+    if not shingles1 or not shingles2:
+        return 0.0
+    return float(len(shingles1 & shingles2)) / len(shingles1 | shingles2)
+
+
+def minhash(shingles):
+    '''MinHash signature of a set of shingles, as a list of
+    ``BANDS * ROWS`` integers.'''
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes)
+            for a, b in _PERMUTATIONS]
+
+
+def normalize_doi(doi):
+    '''Normalize a DOI for comparison: lower case, without any
+    ``doi:`` or resolver URL prefix.'''
+    doi = doi.strip().lower()
+    for prefix in ('doi:', 'https://doi.org/', 'http://doi.org/',
+                   'https://dx.doi.org/', 'http://dx.doi.org/'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi.strip()
+
+
+def duplicate_keys(title=None, doi=None, pmcid=None):
+    '''Duplicate-candidate keys for a publication, to be indexed in
+    :data:`DUPLICATE_KEY_FIELD`: ``doi:<doi>``, ``pmc:<pmcid>`` and one
+    ``title:<band>:<hash>`` key for each band of the title MinHash
+    signature.
+
+    :returns: list of strings
+    '''
+    keys = []
+    if doi and normalize_doi(doi):
+        keys.append('doi:%s' % normalize_doi(doi))
+    if pmcid:
+        keys.append('pmc:%s' % pmcid)
+    shingles = title_shingles(title)
+    if shingles:
+        signature = minhash(shingles)
+        for band in range(BANDS):
+            rows = signature[band * ROWS:(band + 1) * ROWS]
+            digest = hashlib.sha1(' '.join(str(r) for r in rows).encode('utf-8'))
+            keys.append('title:%d:%s' % (band, digest.hexdigest()[:16]))
+    return keys
+
+
+def find_clusters(docs, threshold=0.8, max_bucket=50):
+    '''Group publications into clusters of candidate duplicates.
+    Publications that share a DOI or PMC id key are always grouped;
+    publications that share a title band key are grouped if their
+    title similarity (see :meth:`title_similarity`) is at least
+    ``threshold``.  Keys shared by more than ``max_bucket``
+    publications (e.g. generic titles like "Editorial") are ignored.
+
+    :param docs: iterable of dictionaries with ``pid``, ``title`` and
+        :data:`DUPLICATE_KEY_FIELD`
+    :returns: tuple of a list of clusters, largest first, each a
+        dictionary with ``pids`` (sorted list) and ``reasons`` (set of
+        ``doi``, ``pmc`` and ``title``), and the number of keys
+        ignored because they were too common
+    '''
+    titles = {}
+    buckets = {}
+    for doc in docs:
+        titles[doc['pid']] = doc.get('title') or ''
+        for key in doc.get(DUPLICATE_KEY_FIELD) or []:
+            buckets.setdefault(key, []).append(doc['pid'])
+
+    # union-find over pids
+    parent = {}
+
+    def find(pid):
+        parent.setdefault(pid, pid)
+        while parent[pid] != pid:
+            parent[pid] = parent[parent[pid]]
+            pid = parent[pid]
+        return pid
+
+    reasons = {}
+
+    def union(pid1, pid2, reason):
+        root1, root2 = find(pid1), find(pid2)
+        if root1 != root2:
+            parent[root2] = root1
+            reasons.setdefault(root1, set()).update(reasons.pop(root2, set()))
+        reasons.setdefault(root1, set()).add(reason)
+
+    shingles = {}
+    compared = set()
+    ignored = 0
+    for key, pids in buckets.items():
+        if len(pids) < 2:
+            continue
+        if len(pids) > max_bucket:
+            ignored += 1
+            continue
+        kind = key.split(':', 1)[0]
+        if kind != 'title':
+            for pid in pids[1:]:
+                union(pids[0], pid, kind)
+            continue
+        for i, pid1 in enumerate(pids):
+            for pid2 in pids[i + 1:]:
+                pair = (pid1, pid2) if pid1 < pid2 else (pid2, pid1)
+                if pair in compared:
+                    continue
+                compared.add(pair)
+                for pid in pair:
+                    if pid not in shingles:
+                        shingles[pid] = title_shingles(titles[pid])
+                if title_similarity(shingles[pid1], shingles[pid2]) >= threshold:
+                    union(pid1, pid2, 'title')
+
+    clusters = {}
+    for pid in parent:
+        clusters.setdefault(find(pid), []).append(pid)
+    results = [{'pids': sorted(pids), 'reasons': reasons.get(root, set())}
+               for root, pids in clusters.items() if len(pids) > 1]
+    results.sort(key=lambda c: (-len(c['pids']), c['pids']))
+    return results, ignored
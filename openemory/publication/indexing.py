@@ -0,0 +1,110 @@
+# file openemory/publication/indexing.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+'''
+Bulk indexing of :class:`~openemory.publication.models.Publication`
+objects into Solr, for scripts that reindex many objects at once.
+
+'''
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from openemory.publication.models import Publication
+from openemory.util import filter_unchanged
+
+logger = logging.getLogger(__name__)
+
+
+def index_publications(pids, repo, solr, chunk_size=50, workers=4,
+                       skip_unchanged=True):
+    '''Reindex the specified publications in chunks.  For each chunk,
+    objects are loaded and index data generated concurrently in a
+    small thread pool (the work is dominated by Fedora round trips and
+    PDF text extraction), author ESD data is resolved once for the
+    whole chunk with :meth:`Publication.prefetch_author_esd`, and the
+    changed documents are sent to Solr with a single add.
+
+    Errors on individual objects are logged and counted but do not
+    stop the rest of the chunk from being indexed.
+
+    :param pids: list of pids to index
+    :param repo: :class:`eulfedora.server.Repository` to load objects from
+    :param solr: :class:`sunburnt.SolrInterface`
+    :param chunk_size: number of objects per Solr add
+    :param workers: number of concurrent threads
+    :param skip_unchanged: if True, documents identical to the indexed
+        version are not resent (see :meth:`openemory.util.filter_unchanged`)
+    :returns: dictionary of counts: ``indexed``, ``unchanged``,
+        ``skipped`` (nonexistent objects) and ``errors``
+    '''
+    counts = defaultdict(int)
+    pids = list(pids)
+
+    def load(pid):
+        obj = repo.get_object(pid, type=Publication)
+        # access the metadata needed for author prefetching in the worker
+        if obj.exists:
+            obj.author_netids
+            return obj
+
+    def get_index_data(obj):
+        return obj.index_data()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for i in range(0, len(pids), chunk_size):
+            chunk = pids[i:i + chunk_size]
+
+            articles = []
+            for pid, result in zip(chunk, _map_safely(executor, load, chunk)):
+                if isinstance(result, Exception):
+                    logger.error('Error loading %s for indexing: %s' % (pid, result))
+                    counts['errors'] += 1
+                elif result is None:
+                    counts['skipped'] += 1
+                else:
+                    articles.append(result)
+
+            # ESD lookups use the database, so resolve them in this thread
+            Publication.prefetch_author_esd(articles)
+
+            docs = []
+            for obj, result in zip(articles, _map_safely(executor, get_index_data, articles)):
+                if isinstance(result, Exception):
+                    logger.error('Error generating index data for %s: %s' % (obj.pid, result))
+                    counts['errors'] += 1
+                else:
+                    docs.append(result)
+
+            if skip_unchanged and docs:
+                docs, unchanged = filter_unchanged(solr, docs)
+                counts['unchanged'] += unchanged
+            if docs:
+                solr.add(docs)
+                counts['indexed'] += len(docs)
+
+    return counts
+
+
+def _map_safely(executor, fn, items):
+    # like executor.map, but returns exceptions as results instead of raising
+    def call(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return e
+    return list(executor.map(call, items))
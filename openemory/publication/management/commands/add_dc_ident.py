@@ -23,7 +23,7 @@ from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 from django.core.paginator import Paginator
 
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 
 from openemory.publication.models import Publication
 from openemory.util import pmc_access_url
@@ -23,7 +23,7 @@ from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 from django.core.paginator import Paginator
 
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 
 from openemory.publication.models import Publication
 
@@ -131,6 +131,7 @@ class Command(BaseCommand):
                         # save article
                         if not options['noact']:
                             article.save()
+                            counts['unchanged_ds'] += article.skipped_writes
                 except Exception as e:
                     self.output(0, "Error processing pid: %s : %s " % (article.pid, e.message))
                     counts['errors'] +=1
@@ -141,6 +142,7 @@ class Command(BaseCommand):
         self.stdout.write("Added to collection: %s\n" % counts['collection'])
         self.stdout.write("Added itemID: %s\n" % counts['itemId'])
         self.stdout.write("Modified DC NS: %s\n" % counts['DC'])
+        self.stdout.write("Unchanged datastreams not saved: %s\n" % counts['unchanged_ds'])
         self.stdout.write("Skipped: %s\n" % counts['skipped'])
         self.stdout.write("Errors: %s\n" % counts['errors'])
 
@@ -0,0 +1,108 @@
+# file openemory/publication/management/commands/benchmark_symp.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import glob
+import os
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from eulxml import xmlmap
+
+from openemory.common.fedora import Repository
+from openemory.publication.models import Publication
+from openemory.publication.symp import SympAtom
+
+
+def chained_value(atom, field):
+    '''Choose a field value by walking the source precedence chain on
+    every access, the way :class:`SympAtom` properties worked before
+    :meth:`SympAtom.resolved`; used as the baseline.'''
+    for attr, name in SympAtom.SOURCE_PRECEDENCE:
+        source = getattr(atom, attr)
+        if source and getattr(source, field):
+            return getattr(source, field)
+    return SympAtom.RESOLVED_FIELDS[field]
+
+
+class Command(BaseCommand):
+    '''Benchmark conversion of Symplectic-Elements ATOM records
+    (:class:`~openemory.publication.symp.SympAtom`) to
+    :class:`~openemory.publication.models.Publication` metadata.
+    For each ATOM file, reports the time to choose every field value
+    by walking the source precedence chain on each access (the old
+    behavior), with the single-pass :meth:`SympAtom.resolved` map, and
+    for a complete :meth:`Publication.from_symp` on an unsaved object.
+    RoMEO lookups are skipped unless ``--romeo`` is specified, so that
+    timings are not dominated by the network.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*',
+                            help='ATOM files to convert (default: SympAtom fixtures)')
+        parser.add_argument('-i', '--iterations', action='store', type=int, default=100,
+                            help='Number of times to convert each file (default: %(default)s)')
+        parser.add_argument('--romeo', action='store_true', default=False,
+                            help='Include RoMEO journal and publisher lookups in from_symp')
+
+    def handle(self, *args, **options):
+        files = options['files'] or sorted(glob.glob(os.path.join(settings.BASE_DIR,
+            'publication', 'fixtures', 'SympAtom*.xml')))
+        if not files:
+            raise CommandError('No ATOM files to benchmark')
+        iterations = max(options['iterations'], 1)
+
+        repo = Repository()
+        pid = '%s:benchmark' % settings.FEDORA_PIDSPACE
+
+        for filename in files:
+            with open(filename, 'rb') as atomfile:
+                data = atomfile.read()
+
+            def chained():
+                atom = xmlmap.load_xmlobject_from_string(data, xmlclass=SympAtom)
+                for field in SympAtom.RESOLVED_FIELDS:
+                    chained_value(atom, field)
+
+            def resolved():
+                atom = xmlmap.load_xmlobject_from_string(data, xmlclass=SympAtom)
+                for field in SympAtom.RESOLVED_FIELDS:
+                    getattr(atom, field)
+
+            def from_symp():
+                obj = repo.get_object(pid, create=True, type=Publication)
+                obj.sympAtom.content = xmlmap.load_xmlobject_from_string(data, xmlclass=SympAtom)
+                obj.from_symp()
+
+            self.stdout.write('%s:\n' % os.path.basename(filename))
+            self.report('Chained fields', chained, iterations)
+            self.report('Resolved fields', resolved, iterations)
+            if options['romeo']:
+                self.report('from_symp', from_symp, iterations)
+            else:
+                with patch('openemory.publication.models.romeo') as mockromeo:
+                    mockromeo.search_journal_title.return_value = []
+                    mockromeo.search_publisher_name.return_value = []
+                    self.report('from_symp', from_symp, iterations)
+
+    def report(self, label, fn, iterations):
+        start = time.time()
+        for i in range(iterations):
+            fn()
+        elapsed = time.time() - start
+        self.stdout.write('  %s: %.2f ms per record\n' % (label, elapsed * 1000 / iterations))
@@ -23,7 +23,7 @@ from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 from django.core.paginator import Paginator
 
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 
 from openemory.publication.models import Publication
 from openemory.util import solr_interface
@@ -168,6 +168,7 @@ class Command(BaseCommand):
                         # save article
                         if not options['noact']:
                             article.save()
+                            counts['unchanged_ds'] += article.skipped_writes
                 except Exception as e:
                     self.output(0, "Error processing pid: %s : %s " % (obj['pid'], e.message))
                     counts['errors'] +=1
@@ -180,6 +181,7 @@ class Command(BaseCommand):
         self.stdout.write("Updated License from Copyright section: %s\n" % counts['copyright_license'])
         self.stdout.write("Updated Copyright: %s\n" % counts['copyright'])
         self.stdout.write("Added to collection: %s\n" % counts['collection'])
+        self.stdout.write("Unchanged datastreams not saved: %s\n" % counts['unchanged_ds'])
 #        self.stdout.write("Added itemID: %s\n" % counts['itemid'])
         self.stdout.write("Skipped: %s\n" % counts['skipped'])
         self.stdout.write("Errors: %s\n" % counts['errors'])
@@ -0,0 +1,95 @@
+# file openemory/publication/management/commands/elements_stub.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import random
+import socketserver
+import time
+
+from django.core.management.base import BaseCommand
+
+from openemory.publication.symp_import import SympBase
+
+
+class StubServer(socketserver.ThreadingMixIn, HTTPServer):
+    # handle each request in its own thread, like Elements
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    '''Run a local stub of the Symplectic-Elements API that accepts
+    publication PUTs and relationship POSTs, for benchmarking
+    ``import_to_symplectic`` without touching a real Elements
+    instance, e.g.::
+
+        python manage.py elements_stub --port 8099 --latency 0.2
+        python manage.py import_to_symplectic --base-url http://localhost:8099 ...
+
+    Responses can be delayed and a fraction of requests can be failed
+    with 503 or 429 responses to exercise retries.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--port', action='store', type=int, default=8099,
+                            help='Port to listen on (default: %(default)s)')
+        parser.add_argument('-l', '--latency', action='store', type=float, default=0.1,
+                            help='Seconds to wait before each response (default: %(default)s)')
+        parser.add_argument('-e', '--error-rate', action='store', type=float, default=0,
+                            help='Fraction of requests to fail with a 503 or 429 response (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        command = self
+        response_xml = ('<api:import-record xmlns:api="%s"/>' % SympBase.api_ns).encode('utf-8')
+
+        class StubHandler(BaseHTTPRequestHandler):
+            # keep connections alive, as Elements does
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                # read and discard the request body
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(options['latency'])
+                if random.random() < options['error_rate']:
+                    status = random.choice([503, 429])
+                    self.send_response(status)
+                    if status == 429:
+                        self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(response_xml)))
+                self.end_headers()
+                self.wfile.write(response_xml)
+
+            do_PUT = respond
+            do_POST = respond
+
+            def log_message(self, format, *args):
+                if command.verbosity >= 2:
+                    command.stdout.write('%s\n' % (format % args))
+
+        self.verbosity = int(options['verbosity'])
+        server = StubServer(('localhost', options['port']), StubHandler)
+        self.stdout.write('Stub Elements API listening on http://localhost:%d\n' % options['port'])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
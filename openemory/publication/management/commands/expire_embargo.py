@@ -22,7 +22,7 @@ from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 from django.core.paginator import Paginator
 
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 
 from openemory.publication.models import Publication
 from openemory.util import solr_interface
@@ -96,6 +96,7 @@ class Command(BaseCommand):
                 self.output(0,"Error getting page: %s : %s " % (p, e.message))
                 counts['errors'] +=1
                 continue
+            articles = []
             for obj in objs:
                 try:
                     article = repo.get_object(type=Publication, pid=obj['pid'])
@@ -103,6 +104,19 @@ class Command(BaseCommand):
                         self.output(1, "Skipping %s because pid does not exist" % obj['pid'])
                         counts['skipped'] +=1
                         continue
+                    articles.append(article)
+                except Exception as e:
+                    self.output(0, "Error processing pid: %s : %s " % (obj['pid'], e))
+                    counts['errors'] +=1
+
+            # resolve author ESD data for the whole page at once
+            try:
+                Publication.prefetch_author_esd(articles)
+            except Exception as e:
+                self.output(0, "Error resolving author data for page %s: %s " % (p, e))
+
+            for article in articles:
+                try:
                     #do not try to index items without valid fulltext field
                     data = article.index_data()
                     if 'fulltext' in data and data['fulltext'] != None and data['fulltext'].strip():
@@ -114,7 +128,7 @@ class Command(BaseCommand):
                         self.output(1, "Skipping %s because fulltext does not exist" % article.pid)
                         counts['skipped'] +=1
                 except Exception as e:
-                    self.output(0, "Error processing pid: %s : %s " % (obj['pid'], e.message))
+                    self.output(0, "Error processing pid: %s : %s " % (article.pid, e))
                     counts['errors'] +=1
 
         # summarize what was done
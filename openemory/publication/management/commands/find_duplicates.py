@@ -0,0 +1,107 @@
+# file openemory/publication/management/commands/find_duplicates.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from collections import defaultdict
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from openemory.publication.duplicates import find_clusters, duplicate_keys, \
+     DUPLICATE_KEY_FIELD
+from openemory.publication.models import Publication
+from openemory.util import solr_interface
+
+
+class Command(BaseCommand):
+    '''Report clusters of candidate duplicate
+    :class:`~openemory.publication.models.Publication` objects across
+    the whole repository, based on the duplicate-candidate keys
+    maintained in the Solr index (shared DOI or PubMed Central id, or
+    similar titles; see :mod:`openemory.publication.duplicates`).
+    Withdrawn publications are not included unless ``--withdrawn`` is
+    specified.  Keys are calculated from the indexed title and PMC id
+    for any publication indexed before duplicate keys were added.
+    '''
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('-t', '--threshold', action='store', type=float, default=0.8,
+                            help='Minimum title similarity (0 to 1) for a title match (default: %(default)s)')
+        parser.add_argument('--max-bucket', action='store', type=int, default=50,
+                            help='Ignore keys shared by more than this many publications (default: %(default)s)')
+        parser.add_argument('--withdrawn', action='store_true', default=False,
+                            help='Include withdrawn publications')
+        parser.add_argument('-b', '--batch-size', action='store', type=int, default=1000,
+                            help='Number of index records to request from Solr at a time (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
+        self.counts = defaultdict(int)
+        try:
+            solr = solr_interface()
+        except socket.error as se:
+            raise CommandError('Failed to connect to Solr (%s)' % se)
+
+        start = time.time()
+        docs = self.load_docs(solr, options)
+        clusters, ignored = find_clusters(docs, threshold=options['threshold'],
+                                          max_bucket=max(options['max_bucket'], 2))
+        titles = dict((d['pid'], d['title']) for d in docs)
+
+        for i, cluster in enumerate(clusters, 1):
+            self.stdout.write('Cluster %d (%s):\n' % (i, ', '.join(sorted(cluster['reasons']))))
+            for pid in cluster['pids']:
+                self.stdout.write('  %s  %s\n' % (pid, titles[pid]))
+
+        # summarize what was done
+        self.stdout.write("\n")
+        self.stdout.write("Publications checked: %s\n" % len(docs))
+        self.stdout.write("Keys calculated (not yet indexed): %s\n" % self.counts['calculated'])
+        self.stdout.write("Common keys ignored: %s\n" % ignored)
+        self.stdout.write("Candidate duplicate clusters: %s\n" % len(clusters))
+        self.stdout.write("Publications in clusters: %s\n" % sum(len(c['pids']) for c in clusters))
+        self.stdout.write("Elapsed: %.1f sec\n" % (time.time() - start))
+
+    def load_docs(self, solr, options):
+        '''Load pid, title and duplicate keys for all publications from
+        Solr, in batches.'''
+        query = solr.query(content_model=Publication.ARTICLE_CONTENT_MODEL)
+        if not options['withdrawn']:
+            query = query.exclude(withdrawn=True)
+        query = query.field_limit(['pid', 'title', 'pmcid', DUPLICATE_KEY_FIELD]) \
+                     .sort_by('pid')
+
+        batch_size = max(options['batch_size'], 1)
+        docs = []
+        start = 0
+        while True:
+            results = query.paginate(start=start, rows=batch_size).execute()
+            for result in results:
+                title = result.get('title', '')
+                if isinstance(title, list):
+                    title = title[0] if title else ''
+                doc = {'pid': result['pid'], 'title': title,
+                       DUPLICATE_KEY_FIELD: result.get(DUPLICATE_KEY_FIELD, None)}
+                if not doc[DUPLICATE_KEY_FIELD]:
+                    doc[DUPLICATE_KEY_FIELD] = duplicate_keys(title, pmcid=result.get('pmcid', None))
+                    self.counts['calculated'] += 1
+                docs.append(doc)
+            if self.verbosity >= 2:
+                self.stdout.write('Loaded %d index records\n' % len(docs))
+            if len(results) < batch_size:
+                return docs
+            start += batch_size
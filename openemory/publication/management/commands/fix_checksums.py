@@ -19,7 +19,7 @@ from getpass import getpass
 import logging
 from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 from openemory.publication.models import Publication
 from django.conf import settings
 import sys
@@ -19,18 +19,24 @@ import sys
 import os
 import pytz
 import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from urllib.parse import urlparse
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
 from collections import defaultdict
 from datetime import datetime
 from django.core.management.base import BaseCommand, CommandError
-from eulfedora.server import Repository
 from optparse import make_option
 from time import gmtime, strftime
 from django.contrib.auth.models import User
 import requests
 
-from openemory.common.fedora import ManagementRepository
+from openemory.common.fedora import Repository, ManagementRepository
 from openemory.publication.models import Publication, LastRun
 
 
@@ -51,11 +57,23 @@ class Command(BaseCommand):
     '''
     args = "[pid pid ...]"
     help = __doc__
+
+    #: resource index dissemination type of every SYMPLECTIC-ATOM datastream
+    ATOM_DISSEMINATION = 'info:fedora/*/SYMPLECTIC-ATOM'
     
     def add_arguments(self, parser):  
         parser.add_argument('-n', '--noact', action='store_true', default=False, help='Reports the pid and total number of object that would be processed')
         parser.add_argument('-d', '--date',action='store', default=False, help='Specify Start Date in format 24-Hour format (YYYY-MM-DDTHH:MM:SS).')
         parser.add_argument('-f', '--force', action='store_true', default=False, help='Updates even if SYMPLECTIC-ATOM has not been modified since last run.')
+        parser.add_argument('--page-size', action='store', type=int, default=500,
+                            help='Number of objects to request from the resource index at a time (default: %(default)s)')
+        parser.add_argument('-w', '--workers', action='store', type=int, default=1,
+                            help='Number of objects to process concurrently (default: %(default)s)')
+        parser.add_argument('--copy-mode', choices=['stream', 'reference', 'memory'], default='stream',
+                            help='How attached file content is copied to the content datastream: ' +
+                                 'stream it through a Fedora upload (default), have Fedora copy it by ' +
+                                 'reference to the existing datastream (requires Fedora to be able to read ' +
+                                 'its own API), or load it into memory')
 
 
     def handle(self, *args, **options):
@@ -65,6 +83,7 @@ class Command(BaseCommand):
 
         #counters
         self.counts = defaultdict(int)
+        self.lock = threading.Lock()
 
         # duplicates list
         self.duplicates = {}
@@ -108,178 +127,231 @@ class Command(BaseCommand):
             if len(args) != 0:
                 pids = list(args)
             else:
-                query = """SELECT ?pid
-                        WHERE {
-                            ?pid <info:fedora/fedora-system:def/view#disseminates> ?ds.
-                             ?pid <info:fedora/fedora-system:def/model#createdDate> ?created.
-                        FILTER (
-                             regex(str(?ds), 'SYMPLECTIC-ATOM') &&
-                             ?created >= xsd:dateTime('%sZ')
-                        )
-                        }""" % date_str
-                pids = [o['pid'] for o in self.repo.risearch.sparql_query(query)]
+                pids = self.find_pids(date_str, max(options['page_size'], 1))
         except Exception as e:
-            raise Exception("Error getting pids: %s" % e.message)
+            raise Exception("Error getting pids: %s" % e)
 
         self.counts['total'] = len(pids)
 
-        for pid in pids:
+        start = time.time()
+        workers = max(options['workers'], 1)
+        if workers == 1:
             try:
-                logging.info("Processing %s" % pid)
-                # Load first as Publication becauce that is the most likely type
-                obj = self.repo.get_object(pid=pid)
-                if not obj.exists:
-                    logging.warning("Skipping because %s does not exist" % pid)
-                    continue
-                ds = obj.getDatastreamObject('SYMPLECTIC-ATOM')
-                if not ds:
-                    logging.warning("Skipping %s because SYMPLECTIC-ATOM ds does not exist" % pid)
-                    continue
-                ds_mod = ds.last_modified().strftime("%Y-%m-%dT%H:%M:%S")
-                if date_str and  ds_mod < date_str and (not options['force']):
-                    logging.warning("Skipping %s because SYMPLECTIC-ATOM ds not modified since last run %s " % (pid, ds_mod))
-                    self.counts['skipped']+=1
-                    continue
-                license = obj.getDatastreamObject('SYMPLECTIC-LICENCE')
-                if not license.content:
-                    logging.warning("Skipping %s because SYMPLECTIC-LICENCE ds not modified since last run %s " % (pid, ds_mod))
-                    self.counts['skipped']+=1
-                    payload = {"text": "No Assent Publication.\n pid: %s" % pid}
-                    r = requests.post(settings.SLACK_TOKEN, data=json.dumps(payload))
-
-
-                # WHEN ADDING NEW CONTENT TYPES:
-                # 1. Make sure object content modle has from_symp() function
-                # 2. Add to  content_types dict
-                # 3. Add elif block (see few lines below)
-                # 4. Add line in summary section of this script
-
-                #choose content type
-                content_types = {'Article': 'journal article', 'Book': 'book', 'Chapter': 'chapter', 'Conference': 'conference', 'Poster': 'poster', 'Report': 'report', 'Presentation': 'presentation'}
-                obj_types = ds.content.node.xpath('atom:category/@label', namespaces={'atom': 'http://www.w3.org/2005/Atom'})
-                if obj_types[1] in content_types.values():
-                    logging.info("Processing %s as Publication" % pid)
-                    obj = self.repo.get_object(pid=pid, type=Publication)
-                else:
-                    logging.info("Skipping %s Invalid Content Type" % pid)
-                    continue
-
-
-                obj.from_symp()
-
-                 # get a list of predicates
-                properties = []
-                for p in list(obj.rels_ext.content.predicates()):
-                  properties.append(str(p))
-                # skip if the rels-ext has the "replaces tag, which indicates duplicates"
-                replaces_tag = "http://purl.org/dc/terms/replaces"
-                if replaces_tag in properties:
-                    self.counts['duplicates']+=1
-                    # get the pid of the original object this is replaceing
-                    replaces_pid = obj.rels_ext.content.serialize().split('<dcterms:replaces rdf:resource="')[1].split('"')[0]
-                    # add to duplicate dict
-                    self.duplicates[pid.replace('info:fedora/','')] = replaces_pid.replace('info:fedora/','')
-
-
-                    if not obj.is_withdrawn:
-
-                        try:
-                            user = User.objects.get(username=u'oebot')
-
-                        except ObjectDoesNotExist:
-
-                            user = User.objects.get_or_create(username=u'bob', password=u'bobspassword',)[0]
-                            user.first_name = "Import"
-                            user.last_name = "Process"
-                            user.save()
-
-                        reason = "Duplicate."
-                        self.counts['withdrawn']+=1
-                        obj.provenance.content.init_object(obj.pid, 'pid')
-                        obj.provenance.content.withdrawn(user,reason)
-                        obj.state = 'I'
-                        logging.info("Withdrew duplicate pid: %s" % obj.pid)
-
+                for pid in pids:
+                    self.process_pid(pid, date_str)
+            except (KeyboardInterrupt, SystemExit):
+                if self.counts['duplicates'] > 0:
+                  self.write_dup_report(self.duplicates, self.errors, error="interrupt")
+                raise
+        else:
+            # each object is processed independently; Fedora sessions are
+            # pooled, so workers should not exceed FEDORA_POOL_MAXSIZE
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = [executor.submit(self.process_pid_in_thread, pid, date_str)
+                       for pid in pids]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except (KeyboardInterrupt, SystemExit):
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=True)
+                if self.counts['duplicates'] > 0:
+                  self.write_dup_report(self.duplicates, self.errors, error="interrupt")
+                raise
+            executor.shutdown(wait=True)
+        elapsed = time.time() - start
 
+        # summarize what was done
+        self.stdout.write("\n\n")
+        self.stdout.write("Total number selected: %s\n" % self.counts['total'])
+        self.stdout.write("Skipped: %s\n" % self.counts['skipped'])
+        self.stdout.write("Duplicates: %s\n" % self.counts['duplicates'])
+        self.stdout.write("Withdrew: %s\n" % self.counts['withdrawn'])
+        self.stdout.write("PDFs converted: %s\n" % self.counts['pdf'])
+        self.stdout.write("Errors: %s\n" % self.counts['errors'])
+        self.stdout.write("Publications converted: %s\n" % self.counts['Publication'])
+        self.stdout.write("Elapsed: %.1f sec (%.2f objects/sec with %d workers)\n" % \
+                          (elapsed, len(pids) / elapsed if elapsed else 0, workers))
 
-                else:
-                    self.counts['pdf']+=1
+        if self.counts['duplicates'] > 0 or self.counts['errors'] > 0:
+          self.write_dup_report(self.duplicates, self.errors)
 
+    def find_pids(self, date_str, page_size):
+        '''Find objects with a SYMPLECTIC-ATOM datastream created on or
+        after the specified UTC date.  Objects are matched on the indexed
+        dissemination type of the datastream, instead of a regex over
+        every dissemination in the repository, and are requested from
+        the resource index in pages ordered by creation date.'''
+        pids = []
+        seen = set()
+        since = '%sZ' % date_str
+        while True:
+            query = """SELECT ?pid ?created
+                    WHERE {
+                        ?ds <info:fedora/fedora-system:def/view#disseminationType> <%s> .
+                        ?pid <info:fedora/fedora-system:def/view#disseminates> ?ds .
+                        ?pid <info:fedora/fedora-system:def/model#createdDate> ?created .
+                    FILTER (
+                         ?created >= xsd:dateTime('%s')
+                    )
+                    }
+                    ORDER BY ?created""" % (self.ATOM_DISSEMINATION, since)
+            results = list(self.repo.risearch.sparql_query(query, limit=page_size))
+            new = [r for r in results if r['pid'] not in seen]
+            for r in new:
+                pids.append(r['pid'])
+                seen.add(r['pid'])
+            if len(results) < page_size:
+                return pids
+            if not new:
+                # a full page created in the same instant; ask for more at once
+                page_size *= 2
+                continue
+            # next page starts at the last creation date seen; objects
+            # created in that same instant are returned again and skipped
+            since = results[-1]['created']
+
+    def incr(self, key):
+        # counts are shared between worker threads
+        with self.lock:
+            self.counts[key] += 1
+
+    def process_pid_in_thread(self, pid, date_str):
+        try:
+            self.process_pid(pid, date_str)
+        finally:
+            # worker threads open their own database connections
+            connection.close()
+
+    def process_pid(self, pid, date_str):
+        '''Convert a single Elements-created object.  Errors are logged
+        and recorded for the report without affecting other objects.'''
+        obj = None
+        try:
+            logging.info("Processing %s" % pid)
+            # Load first as Publication becauce that is the most likely type
+            obj = self.repo.get_object(pid=pid)
+            if not obj.exists:
+                logging.warning("Skipping because %s does not exist" % pid)
+                return
+            ds = obj.getDatastreamObject('SYMPLECTIC-ATOM')
+            if not ds:
+                logging.warning("Skipping %s because SYMPLECTIC-ATOM ds does not exist" % pid)
+                return
+            ds_mod = ds.last_modified().strftime("%Y-%m-%dT%H:%M:%S")
+            if date_str and  ds_mod < date_str and (not self.options['force']):
+                logging.warning("Skipping %s because SYMPLECTIC-ATOM ds not modified since last run %s " % (pid, ds_mod))
+                self.incr('skipped')
+                return
+            license = obj.getDatastreamObject('SYMPLECTIC-LICENCE')
+            if not license.content:
+                logging.warning("Skipping %s because SYMPLECTIC-LICENCE ds not modified since last run %s " % (pid, ds_mod))
+                self.incr('skipped')
+                payload = {"text": "No Assent Publication.\n pid: %s" % pid}
+                r = requests.post(settings.SLACK_TOKEN, data=json.dumps(payload))
+
+
+            # WHEN ADDING NEW CONTENT TYPES:
+            # 1. Make sure object content modle has from_symp() function
+            # 2. Add to  content_types dict
+            # 3. Add elif block (see few lines below)
+            # 4. Add line in summary section of this script
+
+            #choose content type
+            content_types = {'Article': 'journal article', 'Book': 'book', 'Chapter': 'chapter', 'Conference': 'conference', 'Poster': 'poster', 'Report': 'report', 'Presentation': 'presentation'}
+            obj_types = ds.content.node.xpath('atom:category/@label', namespaces={'atom': 'http://www.w3.org/2005/Atom'})
+            if obj_types[1] in content_types.values():
+                logging.info("Processing %s as Publication" % pid)
+                obj = self.repo.get_object(pid=pid, type=Publication)
+            else:
+                logging.info("Skipping %s Invalid Content Type" % pid)
+                return
 
-                # convert attached PDF fle to be used with OE
-                # filter datastreams for only application/pdf
-                mime = None
-                mime_ds_list = None
 
-                if obj.descMetadata.content.genre == "Article" or obj.descMetadata.content.genre == "Book" or obj.descMetadata.content.genre == "Chapter":
-                    mime_ds_list = [i for i in obj.ds_list if obj.ds_list[i].mimeType in obj.allowed_mime_types.values()]
-                elif obj.descMetadata.content.genre == "Conference":
+            obj.from_symp()
 
-                    mime_ds_list = [i for i in obj.ds_list if obj.ds_list[i].mimeType in obj.allowed_mime_conference.values()]
-                elif obj.descMetadata.content.genre == "Report":
-                    mime_ds_list = [i for i in obj.ds_list if obj.ds_list[i].mimeType in obj.allowed_mime_report.values()]
+             # get a list of predicates
+            properties = []
+            for p in list(obj.rels_ext.content.predicates()):
+              properties.append(str(p))
+            # skip if the rels-ext has the "replaces tag, which indicates duplicates"
+            replaces_tag = "http://purl.org/dc/terms/replaces"
+            if replaces_tag in properties:
+                self.incr('duplicates')
+                # get the pid of the original object this is replaceing
+                replaces_pid = obj.rels_ext.content.serialize().split('<dcterms:replaces rdf:resource="')[1].split('"')[0]
+                # add to duplicate dict
+                self.duplicates[pid.replace('info:fedora/','')] = replaces_pid.replace('info:fedora/','')
 
-                elif obj.descMetadata.content.genre == "Poster":
-                    mime_ds_list = [i for i in obj.ds_list if obj.ds_list[i].mimeType in obj.allowed_mime_poster.values()]
 
-                elif obj.descMetadata.content.genre == "Presentation":
-                    mime_ds_list = [i for i in obj.ds_list if obj.ds_list[i].mimeType in obj.allowed_mime_presentation.values()]
+                if not obj.is_withdrawn:
 
-                else:
-                     logging.info("Skipping because mime type is not allowed")
-                     continue
+                    try:
+                        user = User.objects.get(username=u'oebot')
 
+                    except ObjectDoesNotExist:
 
-                if mime_ds_list:
-                    # sort by DS timestamp does not work yet asks for global name obj because of lambda function
-                    new_dict = {}
-                    for mime in mime_ds_list:
-                        new_dict[mime] = obj.getDatastreamObject(mime).last_modified()
+                        user = User.objects.get_or_create(username=u'bob', password=u'bobspassword',)[0]
+                        user.first_name = "Import"
+                        user.last_name = "Process"
+                        user.save()
 
-                    sorted_mimes = sorted(new_dict.items(), key=lambda x: x[1])
+                    reason = "Duplicate."
+                    self.incr('withdrawn')
+                    obj.provenance.content.init_object(obj.pid, 'pid')
+                    obj.provenance.content.withdrawn(user,reason)
+                    obj.state = 'I'
+                    logging.info("Withdrew duplicate pid: %s" % obj.pid)
 
-                    # sorted_mimes = sorted(mime_ds_list, key=lambda p: str(obj.getDatastreamObject(p).last_modified()))
-                    mime = sorted_mimes[-1][0]  # most recent
 
-                if not options['noact']:
-                    obj.save()
-                    # obj.index_data()
 
-                    if mime:
-                        mime_type =  obj.ds_list[mime].mimeType
-                        self.repo.api.addDatastream(pid=obj.pid, dsID='content', dsLabel='%s' % mime_type,
-                                                mimeType=mime_type, logMessage='added %s content from %s' % (mime_type,mime),
-                                                controlGroup='M', versionable=True, content=obj.getDatastreamObject(mime).content)
-                        logging.info("Converting %s to %s Content" % (mime,mime_type))
-                        self.counts[mime_type]+=1
-                        self.counts['Publication']+=1
+            else:
+                self.incr('pdf')
+
+
+            # convert attached PDF fle to be used with OE
+            # filter datastreams for only application/pdf
+            mime = None
+
+            if obj.descMetadata.content.genre == "Article" or obj.descMetadata.content.genre == "Book" or obj.descMetadata.content.genre == "Chapter":
+                allowed_mime = obj.allowed_mime_types
+            elif obj.descMetadata.content.genre == "Conference":
+                allowed_mime = obj.allowed_mime_conference
+            elif obj.descMetadata.content.genre == "Report":
+                allowed_mime = obj.allowed_mime_report
+            elif obj.descMetadata.content.genre == "Poster":
+                allowed_mime = obj.allowed_mime_poster
+            elif obj.descMetadata.content.genre == "Presentation":
+                allowed_mime = obj.allowed_mime_presentation
+            else:
+                 logging.info("Skipping because mime type is not allowed")
+                 return
 
+            # most recent datastream with an allowed mimetype, from
+            # a single datastream listing
+            mime = obj.newest_datastream(allowed_mime.values())
 
+            if not self.options['noact']:
+                obj.save()
+                # obj.index_data()
 
+                if mime:
+                    mime_type = obj.datastream_profiles()[mime][0]
+                    self.copy_content(obj, mime, mime_type)
+                    logging.info("Converting %s to %s Content" % (mime,mime_type))
+                    self.incr(mime_type)
+                    self.incr('Publication')
 
-            except (KeyboardInterrupt, SystemExit):
-                if self.counts['duplicates'] > 0:
-                  self.write_dup_report(self.duplicates, error="interrupt")
-                raise
+        except (KeyboardInterrupt, SystemExit):
+            raise
 
-            except Exception as e:
-                logging.error("Error processing %s: %s" % (pid, e.message))
+        except Exception as e:
+            logging.error("Error processing %s: %s" % (pid, e))
+            if obj is not None:
                 logging.error(obj.rels_ext.content.serialize(pretty=True))
-                self.counts['errors']+=1
-                self.errors[pid] = e.message
-
-        # summarize what was done
-        self.stdout.write("\n\n")
-        self.stdout.write("Total number selected: %s\n" % self.counts['total'])
-        self.stdout.write("Skipped: %s\n" % self.counts['skipped'])
-        self.stdout.write("Duplicates: %s\n" % self.counts['duplicates'])
-        self.stdout.write("Withdrew: %s\n" % self.counts['withdrawn'])
-        self.stdout.write("PDFs converted: %s\n" % self.counts['pdf'])
-        self.stdout.write("Errors: %s\n" % self.counts['errors'])
-        self.stdout.write("Publications converted: %s\n" % self.counts['Publication'])
-
-        if self.counts['duplicates'] > 0 or self.counts['errors'] > 0:
-          self.write_dup_report(self.duplicates, self.errors)
+            self.incr('errors')
+            self.errors[pid] = str(e)
 
     def write_dup_report(self, duplicates, errors, **kwarg):
         '''write a report listing the pids of the duplicate objects and the \
@@ -305,6 +377,54 @@ class Command(BaseCommand):
           else:
             f.write("\nFinished report at: %s EST" % strftime("%Y-%m-%dT%H:%M:%S"))
 
+    #: size of chunks used when streaming datastream content
+    CHUNK_SIZE = 1024 * 1024
+
+    def copy_content(self, obj, dsid, mime_type):
+        '''Copy the content of an attached file datastream to the
+        ``content`` datastream, using the configured copy mode.  In
+        ``reference`` mode Fedora copies the content itself from a
+        ``local.fedora.server`` URL for the existing datastream; in
+        ``stream`` mode the content is streamed in chunks from Fedora
+        into a Fedora upload, so large files are never held in memory.
+        If a reference copy fails, the content is streamed instead.'''
+        add_args = dict(pid=obj.pid, dsID='content', dsLabel='%s' % mime_type,
+                        mimeType=mime_type, logMessage='added %s content from %s' % (mime_type, dsid),
+                        controlGroup='M', versionable=True)
+        mode = self.options.get('copy_mode', 'stream')
+
+        if mode == 'reference':
+            root_path = urlparse(self.repo.fedora_root).path
+            location = 'http://local.fedora.server%sobjects/%s/datastreams/%s/content' % \
+                       (root_path, obj.pid, dsid)
+            try:
+                r = self.repo.api.addDatastream(dsLocation=location, **add_args)
+                if r.status_code == requests.codes.created:
+                    return r
+            except Exception as e:
+                logging.warning("Copy by reference failed for %s/%s; streaming instead: %s" % (obj.pid, dsid, e))
+            mode = 'stream'
+
+        if mode == 'stream':
+            # close the response even if the upload fails, so the
+            # connection is returned to the pooled session
+            with closing(self.repo.api.getDatastreamDissemination(obj.pid, dsid, stream=True)) as r:
+                size = r.headers.get('Content-Length', None)
+                if size is not None:
+                    upload_id = self.repo.api.upload(r.iter_content(self.CHUNK_SIZE),
+                                                     size=int(size), content_type=mime_type)
+                else:
+                    # size is needed for a streaming upload; spool to disk instead
+                    with tempfile.TemporaryFile() as tmp:
+                        for chunk in r.iter_content(self.CHUNK_SIZE):
+                            tmp.write(chunk)
+                        tmp.seek(0)
+                        upload_id = self.repo.api.upload(tmp, content_type=mime_type)
+            return self.repo.api.addDatastream(dsLocation=upload_id, **add_args)
+
+        return self.repo.api.addDatastream(content=obj.getDatastreamObject(dsid).content,
+                                           **add_args)
+
     def output(self, v, msg):
         '''simple function to handle logging output based on verbosity'''
         if self.verbosity >= v:
@@ -17,21 +17,22 @@
 from time import sleep
 from django.conf import settings
 from collections import defaultdict
-from getpass import getpass
+from contextlib import closing
 import logging
-from optparse import make_option
+import os
+import queue
+import threading
+import time
 import requests
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
 
 from django.core.management.base import BaseCommand, CommandError
-from django.core.paginator import Paginator
+from django.db import connection
 from eulxml.xmlmap import load_xmlobject_from_string
 from openemory.publication.models import Publication
-from openemory.publication.symp_import import OESympImportPublication, \
+from openemory.publication.symp_import import OESympImportPublication
 from openemory.common.fedora import ManagementRepository
 
-    SympDate, SympPerson, SympRelation, SympWarning
-from openemory.util import percent_match
-
 
 logger = logging.getLogger(__name__)
 
@@ -41,170 +42,321 @@ class Command(BaseCommand):
      1. Construct a Symplectic-Elements Article.
      2. PUTs this article to Symplectic-Elements via the API
      If PIDs are provided in the arguments, that list of pids will be used instead of searching fedora.
+
+    Payloads are built from Fedora in the main thread and pushed to
+    Elements by a pool of worker threads, with a shared request rate
+    limit.  Requests that fail with a connection error, 429 or 5xx
+    response are retried with exponential backoff.  With ``--progress``,
+    successfully pushed pids are appended to a file and skipped when the
+    command is run again with the same file, so an interrupted run can
+    be resumed.  To benchmark throughput, point ``--base-url`` at a local
+    stub Elements API (see the ``elements_stub`` command).
     '''
     args = "[pid pid ...]"
     help = __doc__
 
-    option_list = BaseCommand.option_list + (
-        make_option('--noact', '-n',
-                    action='store_true',
-                    default=False,
-                    help='Reports the pid and total number of Articles that would be processed but does not really do anything.'),
-        make_option('--force', '-f',
-                    action='store_true',
-                    default=False,
-                    help='Forces processing by ignoring duplicate detection'),
-        make_option('--rel', '-r',
-                    action='store_true',
-                    default=False,
-                    help='Updates author relations even if a record would otherwise be skipped'),
-        )
+    #: response status codes that are retried
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+
+    #: response status codes that are retried for methods that are not
+    #: idempotent, where the server has not acted on the request
+    RETRY_STATUS_NOT_IDEMPOTENT = [429, 503]
+
+    #: methods that are always safe to retry after a connection error
+    IDEMPOTENT_METHODS = ['GET', 'PUT', 'DELETE']
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids', nargs='*', help='pids to process (default: all Articles)')
+        parser.add_argument('-n', '--noact', action='store_true', default=False,
+                            help='Reports the pid and total number of Articles that would be processed but does not really do anything.')
+        parser.add_argument('-f', '--force', action='store_true', default=False,
+                            help='Forces processing by ignoring duplicate detection')
+        parser.add_argument('-r', '--rel', action='store_true', default=False,
+                            help='Updates author relations even if a record would otherwise be skipped')
+        parser.add_argument('-w', '--workers', action='store', type=int, default=4,
+                            help='Number of concurrent requests to Elements (default: %(default)s)')
+        parser.add_argument('--rate', action='store', type=float, default=4,
+                            help='Maximum requests per second to Elements, across all workers; ' +
+                                 '0 for no limit (default: %(default)s)')
+        parser.add_argument('--retries', action='store', type=int, default=5,
+                            help='Number of times to retry a request that fails with a connection error, ' +
+                                 '429 or 5xx response (default: %(default)s)')
+        parser.add_argument('--progress', action='store', default=None,
+                            help='File to record processed pids in; pids already listed are skipped, ' +
+                                 'so an interrupted run can be resumed')
+        parser.add_argument('--base-url', action='store', default=None,
+                            help='Elements API base url (default: SYMPLECTIC_BASE_URL setting)')
 
     def handle(self, *args, **options):
+        self.options = options
         self.verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
         self.v_normal = 1
 
-        # counters
+        # counters; shared between worker threads
         self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+        # rate limit shared between worker threads: time of the next request slot
+        self.rate = options['rate']
+        self.next_request = 0
+        self.rate_lock = threading.Lock()
 
         # connection to repository
         repo = ManagementRepository()
 
         # Symplectic-Elements setup
+        workers = max(options['workers'], 1)
         self.session = requests.Session()
         self.session.auth = (settings.SYMPLECTIC_USER, settings.SYMPLECTIC_PASSWORD)
         self.session.verify=False
         self.session.stream=True
         self.session.headers.update({'Content-Type': 'text/xml'})
-
-        self.pub_query_url = "%s/%s" % (settings.SYMPLECTIC_BASE_URL, "publications")
-        self.pub_create_url = "%s/%s" % (settings.SYMPLECTIC_BASE_URL, "publication/records/manual")
-        self.relation_create_url = "%s/%s" % (settings.SYMPLECTIC_BASE_URL, "relationships")
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        base_url = options['base_url'] or settings.SYMPLECTIC_BASE_URL
+        self.pub_query_url = "%s/%s" % (base_url, "publications")
+        self.pub_create_url = "%s/%s" % (base_url, "publication/records/manual")
+        self.relation_create_url = "%s/%s" % (base_url, "relationships")
+
+        # pids already processed by a previous run
+        self.progress = None
+        done = set()
+        if options['progress']:
+            if os.path.exists(options['progress']):
+                with open(options['progress']) as progress:
+                    done = set(line.strip() for line in progress if line.strip())
+            self.progress = open(options['progress'], 'a')
 
         # if pids specified, use that list
         try:
-            if len(args) != 0:
-                pids = list(args)
-                pid_set = [repo.get_object(pid=p,type=Publication) for p in pids]
-
-
+            if len(options['pids']) != 0:
+                pid_set = [repo.get_object(pid=p,type=Publication) for p in options['pids']]
             else:
                 #search for Articles.
-                pid_set = repo.get_objects_with_cmodel(Publication.ARTICLE_CONTENT_MODEL, Article)
+                pid_set = repo.get_objects_with_cmodel(Publication.ARTICLE_CONTENT_MODEL, Publication)
 
         except Exception as e:
-            raise CommandError('Error getting pid list (%s)' % e.message)
+            raise CommandError('Error getting pid list (%s)' % e)
 
-        try:
-            articles = Paginator(pid_set, 20)
-            self.counts['total'] = articles.count
-        except Exception as e:
-            self.output(0, "Error paginating items: : %s " % (e.message))
+        self.counts['total'] = len(pid_set)
 
-        #process all Articles
-        for p in articles.page_range:
-            try:
-                objs = articles.page(p).object_list
-            except Exception as e:
-                #print error and go to next iteration of loop
-                self.output(0,"Error getting page: %s : %s " % (p, e.message))
-                self.counts['errors'] +=1
-                continue
-            for article in objs:
-                try:
-                    # if not article.exists:
-                    #     self.output(1, "Skipping %s because pid does not exist" % article.pid)
-                    #     self.counts['skipped'] +=1
-                    #     continue
-                    # title = article.descMetadata.content.title_info.title if (article.descMetadata.content.title_info and article.descMetadata.content.title_info.title) else None
-                    # if title is None or title == '':
-                    #     self.output(1, "Skipping %s because OE Title does not exist" % (article.pid))
-                    #     self.counts['skipped'] +=1
-                    #     continue
-
-                    # if not article.is_published:
-                    #     self.output(1, "Skipping %s because pid is not published" % article.pid)
-                    #     self.counts['skipped'] +=1
-                    #     continue
-
-                    # # try to detect article by PMC
-                    # if article.pmcid and not options['force']:
-                    #     response = self.session.get(self.pub_query_url, params = {'query' : 'external-identifiers.pmc="PMC%s"' % article.pmcid, 'detail': 'full'})
-                    #     entries = load_xmlobject_from_string(response.raw.read(), OESympImportPublication).entries
-                    #     self.output(2, "Query for PMC Match: GET %s %s" % (response.url, response.status_code))
-                    #     if response.status_code == 200:
-                    #         if len(entries) >= 1:
-                    #             self.output(1, "Skipping %s because PMC PMC%s already exists" % (article.pid, article.pmcid))
-                    #             self.counts['skipped'] +=1
-
-                    #             if options['rel']:
-                    #                 symp_pub, relations = article.as_symp(source=entries[0].source, source_id=entries[0].source_id)
-                    #                 self.process_relations(entries[0].source_id, relations, options)
-                    #                 sleep(1)
-                    #             continue
-                    #     else:
-                    #         self.output(1, "Skipping %s because trouble with request %s %s" % (article.pid, response.status_code, entries[0].title))
-                    #         self.counts['skipped'] +=1
-                    #         continue
-
-                    # # try to detect article by Title if it does not have PMC
-                    # if not options['force']:
-                    #     response = self.session.get(self.pub_query_url, params = {'query' : 'title~"%s"' % title, 'detail': 'full'})
-                    #     entries = load_xmlobject_from_string(response.raw.read(), OESympImportPublication).entries
-                    #     # Accouont for mutiple results
-                    #     titles = [e.title for e in entries]
-                    #     self.output(2, "Query for Title Match: GET %s %s" % (response.url, response.status_code))
-                    #     if response.status_code == 200:
-                    #         found = False
-                    #         for t in titles:
-                    #             success, percent = percent_match(title, t, 90)
-                    #             self.output(1, "Percent Title Match '%s' '%s' %s " % (title, t, percent))
-                    #             if success:
-                    #                 found = True
-                    #         if found:
-                    #             self.output(1, "Skipping %s because Title \"%s\" already exists" % (article.pid, title))
-                    #             self.counts['skipped'] +=1
-
-                    #             # update relations if rel is set
-                    #             if options['rel']:
-                    #                 symp_pub, relations = article.as_symp(source=entries[0].source, source_id=entries[0].source_id)
-                    #                 self.process_relations(entries[0].source_id, relations, options)
-                    #                 sleep(1)
-                    #             continue
-                    #     else:
-                    #         self.output(1, "Skipping %s because trouble with request %s %s" % (article.pid, response.status_code, entries[0].title))
-                    #         self.counts['skipped'] +=1
-                    #         continue
-
-                    # Process article and relations
-                    symp_pub, relations = article.as_symp()
-                    self.process_article(article.pid, symp_pub, options)
-                    self.process_relations(article.pid, relations, options)
-                    sleep(1)
+        # workers push payloads as they are built; the queue is bounded
+        # so that payloads are not built too far ahead of the requests
+        payloads = queue.Queue(maxsize=workers * 2)
+        threads = [threading.Thread(target=self.push_worker, args=(payloads,))
+                   for i in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
 
-                except Exception as e:
-                    self.output(0, "Error processing pid: %s : %s " % (article.pid, e.message))
-                    import traceback
-                    traceback.print_exc()
-                    self.counts['errors'] +=1
+        start = time.time()
+        try:
+            self.produce(pid_set, done, payloads)
+        finally:
+            for t in threads:
+                payloads.put(None)
+            for t in threads:
+                t.join()
+            if self.progress:
+                self.progress.close()
+        elapsed = time.time() - start
 
         # summarize what was done
         self.stdout.write("\n\n")
         self.stdout.write("Total number selected: %s\n" % self.counts['total'])
+        self.stdout.write("Already processed: %s\n" % self.counts['resumed'])
         self.stdout.write("Skipped: %s\n" % self.counts['skipped'])
         self.stdout.write("Errors: %s\n" % self.counts['errors'])
         self.stdout.write("Warnings: %s\n" % self.counts['warnings'])
+        self.stdout.write("Retries: %s\n" % self.counts['retries'])
         self.stdout.write("Articles Processed: %s\n" % self.counts['articles_processed'])
         self.stdout.write("Relations Processed: %s\n" % self.counts['relations_processed'])
+        self.stdout.write("Elapsed: %.1f sec (%.2f articles/sec with %d workers)\n" % \
+                          (elapsed, self.counts['articles_processed'] / elapsed if elapsed else 0,
+                           workers))
+
+    def produce(self, articles, done, payloads):
+        '''Build the Elements payloads for each article and queue them
+        for the push workers.'''
+        for article in articles:
+            if article.pid in done:
+                self.output(2, "Skipping %s because it was already processed" % article.pid)
+                self.incr('resumed')
+                continue
+            try:
+                # if not article.exists:
+                #     self.output(1, "Skipping %s because pid does not exist" % article.pid)
+                #     self.counts['skipped'] +=1
+                #     continue
+                # title = article.descMetadata.content.title_info.title if (article.descMetadata.content.title_info and article.descMetadata.content.title_info.title) else None
+                # if title is None or title == '':
+                #     self.output(1, "Skipping %s because OE Title does not exist" % (article.pid))
+                #     self.counts['skipped'] +=1
+                #     continue
+
+                # if not article.is_published:
+                #     self.output(1, "Skipping %s because pid is not published" % article.pid)
+                #     self.counts['skipped'] +=1
+                #     continue
+
+                # # try to detect article by PMC
+                # if article.pmcid and not options['force']:
+                #     response = self.session.get(self.pub_query_url, params = {'query' : 'external-identifiers.pmc="PMC%s"' % article.pmcid, 'detail': 'full'})
+                #     entries = load_xmlobject_from_string(response.raw.read(), OESympImportPublication).entries
+                #     self.output(2, "Query for PMC Match: GET %s %s" % (response.url, response.status_code))
+                #     if response.status_code == 200:
+                #         if len(entries) >= 1:
+                #             self.output(1, "Skipping %s because PMC PMC%s already exists" % (article.pid, article.pmcid))
+                #             self.counts['skipped'] +=1
+
+                #             if options['rel']:
+                #                 symp_pub, relations = article.as_symp(source=entries[0].source, source_id=entries[0].source_id)
+                #                 self.process_relations(entries[0].source_id, relations, options)
+                #                 sleep(1)
+                #             continue
+                #     else:
+                #         self.output(1, "Skipping %s because trouble with request %s %s" % (article.pid, response.status_code, entries[0].title))
+                #         self.counts['skipped'] +=1
+                #         continue
+
+                # # try to detect article by Title if it does not have PMC
+                # if not options['force']:
+                #     response = self.session.get(self.pub_query_url, params = {'query' : 'title~"%s"' % title, 'detail': 'full'})
+                #     entries = load_xmlobject_from_string(response.raw.read(), OESympImportPublication).entries
+                #     # Accouont for mutiple results
+                #     titles = [e.title for e in entries]
+                #     self.output(2, "Query for Title Match: GET %s %s" % (response.url, response.status_code))
+                #     if response.status_code == 200:
+                #         found = False
+                #         for t in titles:
+                #             success, percent = percent_match(title, t, 90)
+                #             self.output(1, "Percent Title Match '%s' '%s' %s " % (title, t, percent))
+                #             if success:
+                #                 found = True
+                #         if found:
+                #             self.output(1, "Skipping %s because Title \"%s\" already exists" % (article.pid, title))
+                #             self.counts['skipped'] +=1
+
+                #             # update relations if rel is set
+                #             if options['rel']:
+                #                 symp_pub, relations = article.as_symp(source=entries[0].source, source_id=entries[0].source_id)
+                #                 self.process_relations(entries[0].source_id, relations, options)
+                #                 sleep(1)
+                #             continue
+                #     else:
+                #         self.output(1, "Skipping %s because trouble with request %s %s" % (article.pid, response.status_code, entries[0].title))
+                #         self.counts['skipped'] +=1
+                #         continue
+
+                # Build article and relations
+                symp_pub, relations = article.as_symp()
+                payloads.put((article.pid, symp_pub, relations))
 
+            except Exception as e:
+                self.output(0, "Error processing pid: %s : %s " % (article.pid, e))
+                self.incr('errors')
+
+    def push_worker(self, payloads):
+        '''Push queued payloads to Elements until a ``None`` is received.'''
+        try:
+            while True:
+                item = payloads.get()
+                if item is None:
+                    return
+                pid, symp_pub, relations = item
+                try:
+                    if self.process_article(pid, symp_pub, self.options) and \
+                       self.process_relations(pid, relations, self.options):
+                        self.record_progress(pid)
+                except Exception as e:
+                    self.output(0, "Error processing pid: %s : %s " % (pid, e))
+                    self.incr('errors')
+        finally:
+            # as_symp is called in the main thread, but close any
+            # database connection a worker may have opened
+            connection.close()
+
+    def incr(self, key):
+        # counts are shared between worker threads
+        with self.lock:
+            self.counts[key] += 1
+
+    def record_progress(self, pid):
+        '''Append a successfully processed pid to the progress file.'''
+        if self.progress and not self.options['noact']:
+            with self.lock:
+                self.progress.write('%s\n' % pid)
+                self.progress.flush()
+
+    def throttle(self):
+        '''Wait for the next request slot allowed by the rate limit.'''
+        if not self.rate:
+            return
+        with self.rate_lock:
+            now = time.time()
+            slot = max(now, self.next_request)
+            self.next_request = slot + 1.0 / self.rate
+        if slot > now:
+            sleep(slot - now)
+
+    def send(self, method, url, data):
+        '''Send a request to Elements, retrying with exponential backoff
+        (or the server's Retry-After, if given) on connection errors and
+        :attr:`RETRY_STATUS` responses.  POST requests are only retried
+        after connection errors if the connection could not be made, and
+        only for :attr:`RETRY_STATUS_NOT_IDEMPOTENT` responses, so that a
+        request that may have been acted on is not repeated.
+        Returns the last response; the caller must close it.'''
+        retries = max(self.options['retries'], 0)
+        if method in self.IDEMPOTENT_METHODS:
+            retry_status = self.RETRY_STATUS
+        else:
+            retry_status = self.RETRY_STATUS_NOT_IDEMPOTENT
+        for attempt in range(retries + 1):
+            self.throttle()
+            try:
+                response = self.session.request(method, url, data=data)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == retries or \
+                   (method not in self.IDEMPOTENT_METHODS and not self.not_sent(e)):
+                    raise
+                self.output(1, "Retrying %s %s after connection error: %s" % (method, url, e))
+                delay = 2 ** attempt
+            else:
+                if response.status_code not in retry_status or attempt == retries:
+                    return response
+                self.output(1, "Retrying %s %s after %s response" % (method, url, response.status_code))
+                delay = 2 ** attempt
+                try:
+                    delay = max(delay, int(response.headers.get('Retry-After', 0)))
+                except ValueError:
+                    pass
+                response.close()
+            self.incr('retries')
+            sleep(delay)
+
+    @staticmethod
+    def not_sent(error):
+        '''Check whether a :class:`requests.exceptions.ConnectionError`
+        was raised while connecting, before any of the request was sent.'''
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        # requests wraps urllib3 errors in a MaxRetryError
+        reason = getattr(reason, 'reason', reason)
+        # includes NewConnectionError (connection refused, name lookup failed)
+        return isinstance(reason, ConnectTimeoutError)
 
     def output(self, v, msg):
         '''simple function to handle logging output based on verbosity'''
         if self.verbosity >= v:
-            self.stdout.write("%s\n" % msg.encode('utf-8'))
+            self.stdout.write("%s\n" % msg)
 
 
     def process_article(self, pid, symp_pub, options):
+        '''Put a single article.  Returns True unless there was an error.'''
         self.output(1,"Processing Article %s" % pid)
 
         # put article xml
@@ -212,74 +364,81 @@ class Command(BaseCommand):
         status = None
         if symp_pub.is_empty():
             self.output(1,"Skipping becase XML is empty")
-            self.counts['skipped']+=1
-            return
+            self.incr('skipped')
+            return True
         valid = symp_pub.is_valid()
         self.output(2,"XML valid: %s" % valid)
         if not valid:
             self.output(0, "Error publication xml is not valid for pid %s %s" % (pid, symp_pub.validation_errors()))
-            self.counts['errors']+=1
-            return
+            self.incr('errors')
+            return False
+        response = None
         if not options['noact']:
-            response = self.session.put(url, data=symp_pub.serialize())
+            response = self.send('PUT', url, symp_pub.serialize())
             status = response.status_code
-        self.output(2,"PUT %s %s" %  (url, status if status else "<NO ACT>"))
-        self.output(2, "=====================================================================")
-        self.output(2, symp_pub.serialize(pretty=True).decode('utf-8', 'replace'))
-        self.output(2,"---------------------------------------------------------------------")
-        if status and status not in [200, 201]:
-            self.output(0,"Error publication PUT returned code %s for %s" % (status, pid))
-            self.counts['errors']+=1
-            return
-        elif not options['noact']:
-            # checkd for warnings
-            for w in load_xmlobject_from_string(response.raw.read(), OESympImportPublication).warnings:
-                self.output(0, 'Warning: %s %s' % (pid, w.message))
-                self.counts['warnings']+=1
-        self.counts['articles_processed']+=1
-
-
-    def output(self, v, msg):
-        '''simple function to handle logging output based on verbosity'''
-        if self.verbosity >= v:
-            self.stdout.write("%s\n" % msg.encode('utf-8'))
+        try:
+            self.output(2,"PUT %s %s" %  (url, status if status else "<NO ACT>"))
+            self.output(2, "=====================================================================")
+            self.output(2, symp_pub.serialize(pretty=True).decode('utf-8', 'replace'))
+            self.output(2,"---------------------------------------------------------------------")
+            if status and status not in [200, 201]:
+                self.output(0,"Error publication PUT returned code %s for %s" % (status, pid))
+                self.incr('errors')
+                return False
+            elif response is not None:
+                # checkd for warnings
+                for w in load_xmlobject_from_string(response.raw.read(), OESympImportPublication).warnings:
+                    self.output(0, 'Warning: %s %s' % (pid, w.message))
+                    self.incr('warnings')
+        finally:
+            # return the connection to the pool
+            if response is not None:
+                response.close()
+        self.incr('articles_processed')
+        return True
 
 
     def process_relations(self, pid, relations, options):
-
+        '''Post the author relations for an article.  Returns True
+        unless there was an error with any of the relations.'''
         self.output(1,"Processing Relationss for %s" % pid)
+        success = True
 
         # put relationship xml
         url = self.relation_create_url
-        status= None
         for r in relations:
             self.output(0, "%s %s" % (r.from_object, r.to_object))
-            status = None
             valid = r.is_valid()
             self.output(2,"XML valid: %s" % valid)
             if not valid:
                 self.output(0, "Error because a relation xml is not valid for pid %s %s" % (pid, r.validation_errors()))
-                self.counts['errors']+=1
+                self.incr('errors')
+                success = False
+                continue
+            if options['noact']:
+                self.output(2,"POST %s <NO ACT>" % url)
+                self.output(2,r.serialize(pretty=True))
                 continue
-            if not options['noact']:
-                response = self.session.post(self.relation_create_url, data=r.serialize())
-                status = response.status_code
 
-            self.output(2,"POST %s %s" %  (url, status if status else "<NO ACT>"))
-            self.output(2,r.serialize(pretty=True))
-            self.output(2,"---------------------------------------------------------------------")
+            with closing(self.send('POST', self.relation_create_url, r.serialize())) as response:
+                status = response.status_code
+                self.output(2,"POST %s %s" %  (url, status))
+                self.output(2,r.serialize(pretty=True))
+                self.output(2,"---------------------------------------------------------------------")
+                if status not in [200, 201]:
+                    self.output(0,"Error relation POST returned code %s for %s" % (status, pid))
+                    self.incr('errors')
+                    success = False
+                    continue
+                # checkd for warnings
+                try:
+                    for w in load_xmlobject_from_string(response.raw.read(), OESympImportPublication).warnings:
+                        self.output(0, 'Warning: %s %s' % (pid, w.message))
+                        self.incr('warnings')
+                except:
+                    self.output(0,"Trouble reding warnings for relation record in %s" % pid)
         self.output(2,"=====================================================================")
-        if status and status not in [200, 201]:
-            self.output(0,"Error relation POST returned code %s for %s" % (status, pid))
-            self.counts['errors']+=1
-            return
-        elif not options['noact']:
-            # checkd for warnings
-            try:
-                for w in load_xmlobject_from_string(response.raw.read(), OESympImportPublication).warnings:
-                    self.output(0, 'Warning: %s %s' % (pid, w.message))
-                    self.counts['warnings']+=1
-            except:
-                self.output(0,"Trouble reding warnings for relation record in %s" % pid)
 
-        self.counts['relations_processed']+=1
\ No newline at end of file
+        if success:
+            self.incr('relations_processed')
+        return success
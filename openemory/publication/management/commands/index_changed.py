@@ -0,0 +1,365 @@
+# file openemory/publication/management/commands/index_changed.py
+#
+#   Copyright 2010 Emory University General Library
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from collections import defaultdict
+from datetime import datetime
+import logging
+import socket
+
+import pytz
+from dateutil import parser as dateparser
+from django.core.management.base import BaseCommand, CommandError
+from sunburnt import SolrError
+
+from openemory.common.fedora import ManagementRepository
+from openemory.publication.models import Publication, LastRun, IndexFailure
+from openemory.util import solr_interface, filter_unchanged, \
+     solr_atomic_update
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    '''Reindex only the :class:`~openemory.publication.models.Publication`
+    objects modified in Fedora since the last run, based on the
+    resource index ``lastModifiedDate``.  The watermark is stored as a
+    :class:`~openemory.publication.models.LastRun` and is only advanced
+    once the changed objects have been processed, so the command is safe
+    to run from cron every few minutes.  To recover missed updates,
+    run with ``--since`` (or ``--reset``) to move the watermark back.
+
+    Objects that can't be indexed are recorded as
+    :class:`~openemory.publication.models.IndexFailure` and retried on
+    later runs, up to
+    :attr:`~openemory.publication.models.IndexFailure.MAX_ATTEMPTS`
+    times, so that they don't hold back the watermark.
+
+    Objects where only the object state or provenance changed since
+    they were last indexed (withdrawn, reinstated, published or
+    reviewed) are updated with a Solr atomic update instead of
+    regenerating full index data, unless ``--full`` is specified.
+    '''
+    help = __doc__
+
+    #: name of the :class:`LastRun` record used as the watermark
+    LAST_RUN_NAME = 'Index changed objects'
+
+    #: dates are stored in :class:`LastRun` in local (Eastern) time,
+    #: consistent with import_from_symplectic
+    time_zone = pytz.timezone('US/Eastern')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--noact', action='store_true', default=False,
+                            help='Report the objects that would be reindexed but do not index them')
+        parser.add_argument('-s', '--since', action='store', default=None,
+                            help='Reindex objects modified since this date (YYYY-MM-DDTHH:MM:SS, Eastern time) ' +
+                                 'instead of the stored watermark')
+        parser.add_argument('--reset', action='store', default=None,
+                            help='Reset the stored watermark to this date (YYYY-MM-DDTHH:MM:SS, Eastern time) ' +
+                                 'and exit without indexing')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Always regenerate full index data, even when only state, ' +
+                                 'withdrawal or review information changed')
+        parser.add_argument('-b', '--batch-size', action='store', type=int, default=50,
+                            help='Number of objects to index per Solr update (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.verbosity = int(options['verbosity'])    # 1 = normal, 0 = minimal, 2 = all
+        self.v_normal = 1
+        self.counts = defaultdict(int)
+
+        last_run, created = LastRun.objects.get_or_create(name=self.LAST_RUN_NAME,
+            defaults={'start_time': datetime(1970, 1, 1)})
+
+        if options['reset']:
+            last_run.start_time = self.parse_date(options['reset'])
+            last_run.save()
+            self.output(1, 'Watermark reset to %s' % last_run.start_time)
+            return
+
+        if options['since']:
+            since = self.parse_date(options['since'])
+        else:
+            since = last_run.start_time
+
+        self.repo = ManagementRepository()
+        try:
+            self.solr = solr_interface()
+        except socket.error as se:
+            raise CommandError('Failed to connect to Solr (%s)' % se)
+
+        changed = self.changed_since(since)
+        self.output(1, 'Found %d objects modified since %s' % (len(changed), since))
+        # watermark advances to the newest modification seen
+        watermark = changed[-1][1] if changed else since
+
+        # retry objects that failed on previous runs
+        changed_pids = set(pid for pid, modified in changed)
+        retry = [pid for pid in IndexFailure.objects.filter(attempts__lt=IndexFailure.MAX_ATTEMPTS) \
+                                                    .values_list('pid', flat=True)
+                 if pid not in changed_pids]
+        changed.extend((pid, None) for pid in retry)
+        if retry:
+            self.output(1, 'Retrying %d objects that previously failed' % len(retry))
+        self.counts['total'] = len(changed)
+
+        failed = {}
+        batch_size = max(options['batch_size'], 1)
+        for i in range(0, len(changed), batch_size):
+            batch = changed[i:i + batch_size]
+            if options['noact']:
+                for pid, modified in batch:
+                    self.output(1, 'Would reindex %s (modified %s)' % (pid, modified))
+                continue
+            failed.update(self.index_batch(batch))
+
+        if not options['noact']:
+            if self.counts['indexed']:
+                self.solr.commit()
+            self.record_failures([pid for pid, modified in changed], failed)
+
+        if not options['noact'] and watermark > since:
+            # compare-and-set so that overlapping runs never move the watermark back
+            updated = LastRun.objects.filter(pk=last_run.pk, start_time=last_run.start_time) \
+                                     .update(start_time=watermark)
+            if not updated:
+                self.output(1, 'Watermark was updated by another run; not changed')
+            else:
+                self.output(1, 'Watermark advanced to %s' % watermark)
+
+        # summarize what was done
+        self.stdout.write("Total number selected: %s\n" % self.counts['total'])
+        self.stdout.write("Indexed: %s\n" % self.counts['indexed'])
+        self.stdout.write("Partial updates: %s\n" % self.counts['partial'])
+        self.stdout.write("Unchanged (not sent to Solr): %s\n" % self.counts['unchanged'])
+        self.stdout.write("Skipped: %s\n" % self.counts['skipped'])
+        self.stdout.write("Errors: %s\n" % self.counts['errors'])
+
+    def parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            raise CommandError('Could not parse date %s' % value)
+
+    def changed_since(self, since):
+        '''Query the Fedora resource index for publications modified at
+        or after the specified (Eastern, naive) datetime.
+
+        :returns: list of (pid, modified) tuples, oldest first, where
+            modified is a naive Eastern datetime
+        '''
+        since_utc = self.time_zone.localize(since).astimezone(pytz.utc)
+        # >= rather than > so objects modified in the same millisecond
+        # as the watermark are not missed; reindexing is idempotent
+        query = """SELECT ?pid ?modified
+                WHERE {
+                    ?pid <info:fedora/fedora-system:def/model#hasModel> <%s> .
+                    ?pid <info:fedora/fedora-system:def/view#lastModifiedDate> ?modified .
+                FILTER (
+                    ?modified >= xsd:dateTime('%sZ')
+                )
+                }
+                ORDER BY ?modified""" % (Publication.ARTICLE_CONTENT_MODEL,
+                                          since_utc.strftime('%Y-%m-%dT%H:%M:%S'))
+        try:
+            results = self.repo.risearch.sparql_query(query)
+        except Exception as e:
+            raise CommandError('Error querying the resource index: %s' % e)
+
+        changed = []
+        for row in results:
+            pid = row['pid'].replace('info:fedora/', '')
+            modified = dateparser.parse(row['modified']).astimezone(self.time_zone) \
+                                                      .replace(tzinfo=None)
+            changed.append((pid, modified))
+        return changed
+
+    def record_failures(self, pids, failed):
+        '''Update :class:`~openemory.publication.models.IndexFailure`
+        for the objects processed in this run: objects that failed are
+        added (or their attempts incremented) and logged, and any that
+        have now been indexed are removed.
+
+        :param pids: list of all pids processed
+        :param failed: dictionary of error message by pid for the
+            objects that could not be indexed
+        '''
+        previous = set(IndexFailure.objects.values_list('pid', flat=True))
+        indexed = [pid for pid in pids if pid in previous and pid not in failed]
+        if indexed:
+            IndexFailure.objects.filter(pid__in=indexed).delete()
+        for pid, error in failed.items():
+            failure, created = IndexFailure.objects.get_or_create(pid=pid)
+            failure.attempts += 1
+            failure.error = error
+            failure.save()
+            if failure.attempts >= IndexFailure.MAX_ATTEMPTS:
+                logger.error('Failed to index %s after %d attempts; not retrying: %s' % \
+                             (pid, failure.attempts, error))
+            else:
+                logger.warning('Failed to index %s (attempt %d); will retry: %s' % \
+                               (pid, failure.attempts, error))
+
+    def index_batch(self, batch):
+        '''Reindex a batch of (pid, modified) tuples with a single Solr
+        update.  Returns a dictionary of error message by pid for the
+        objects that could not be indexed.'''
+        articles = []
+        failed = {}
+        for pid, modified in batch:
+            try:
+                article = self.repo.get_object(pid=pid, type=Publication)
+                if not article.exists:
+                    self.output(1, "Skipping %s because pid does not exist" % pid)
+                    self.counts['skipped'] += 1
+                    continue
+                articles.append((article, modified))
+            except Exception as e:
+                self.output(0, "Error loading pid: %s : %s " % (pid, e))
+                self.counts['errors'] += 1
+                failed[pid] = str(e)
+
+        # objects where only state/provenance changed get an atomic update
+        if articles and not self.options['full']:
+            articles = self.partial_update(articles)
+
+        # author ESD data is resolved once for the whole batch
+        Publication.prefetch_author_esd([a for a, m in articles])
+
+        docs = []
+        for article, modified in articles:
+            try:
+                docs.append(article.index_data())
+                self.output(2, "Indexing %s" % article.pid)
+            except Exception as e:
+                self.output(0, "Error generating index data for %s : %s " % (article.pid, e))
+                self.counts['errors'] += 1
+                failed[article.pid] = str(e)
+
+        if docs:
+            try:
+                # don't resend documents identical to the indexed version
+                docs, unchanged = filter_unchanged(self.solr, docs)
+                self.counts['unchanged'] += unchanged
+                if docs:
+                    self.solr.add(docs)
+                self.counts['indexed'] += len(docs)
+            except SolrError as se:
+                self.output(0, "Solr error indexing batch: %s" % se)
+                self.counts['errors'] += len(docs)
+                for article, modified in articles:
+                    failed.setdefault(article.pid, str(se))
+
+        return failed
+
+    def partial_update(self, articles):
+        '''Send Solr atomic updates for any articles that only need
+        their :attr:`~openemory.publication.models.Publication.PARTIAL_INDEX_FIELDS`
+        updated.  Returns the list of (article, modified) tuples that
+        still need a full reindex, including any where the partial
+        update failed.'''
+        try:
+            partial = self.partial_candidates([a.pid for a, m in articles])
+        except Exception as e:
+            self.output(0, "Error checking for partial updates; using full reindex: %s" % e)
+            return articles
+        if not partial:
+            return articles
+
+        docs = []
+        full = []
+        for article, modified in articles:
+            if article.pid not in partial:
+                full.append((article, modified))
+                continue
+            try:
+                docs.append(article.partial_index_data())
+                self.output(2, "Partially updating %s" % article.pid)
+            except Exception as e:
+                self.output(0, "Error generating partial index data for %s : %s " % (article.pid, e))
+                full.append((article, modified))
+
+        if docs:
+            try:
+                solr_atomic_update(docs)
+                self.counts['indexed'] += len(docs)
+                self.counts['partial'] += len(docs)
+            except Exception as e:
+                self.output(0, "Partial update failed; falling back to full reindex: %s" % e)
+                full = articles
+        return full
+
+    def partial_candidates(self, pids):
+        '''Determine which of the specified pids only need a partial
+        update: the object is already indexed and none of its
+        datastreams, other than
+        :attr:`~openemory.publication.models.Publication.PARTIAL_INDEX_DATASTREAMS`,
+        have been modified since the indexed ``last_modified`` date.
+        Changes to object properties (state, owner, label) don't modify
+        any datastream, and are covered by the partial update.
+        Uses one Solr query and one resource index query.
+
+        :returns: set of pids
+        '''
+        pidfilter = None
+        for pid in pids:
+            if pidfilter is None:
+                pidfilter = self.solr.Q(pid=pid)
+            else:
+                pidfilter |= self.solr.Q(pid=pid)
+        results = self.solr.query(pidfilter).field_limit(['pid', 'last_modified']) \
+                      .paginate(rows=len(pids)).execute()
+        indexed = dict((r['pid'], self.utc(r['last_modified'])) for r in results
+                       if r.get('last_modified', None))
+        if not indexed:
+            return set()
+
+        query = """SELECT ?pid ?ds ?modified
+                WHERE {
+                    ?pid <info:fedora/fedora-system:def/view#disseminates> ?ds .
+                    ?ds <info:fedora/fedora-system:def/view#lastModifiedDate> ?modified .
+                FILTER (
+                    %s
+                )
+                }""" % ' || '.join('?pid = <info:fedora/%s>' % pid for pid in indexed)
+
+        content_modified = {}
+        for row in self.repo.risearch.sparql_query(query):
+            pid = row['pid'].replace('info:fedora/', '')
+            dsid = row['ds'].rsplit('/', 1)[-1]
+            if dsid in Publication.PARTIAL_INDEX_DATASTREAMS:
+                continue
+            modified = self.utc(row['modified'])
+            if pid not in content_modified or modified > content_modified[pid]:
+                content_modified[pid] = modified
+
+        return set(pid for pid, last_indexed in indexed.items()
+                   if pid in content_modified and content_modified[pid] <= last_indexed)
+
+    def utc(self, value):
+        '''Convert a date string or datetime from Solr or the resource
+        index to a timezone-aware UTC datetime for comparison.'''
+        if not hasattr(value, 'astimezone'):
+            value = dateparser.parse(str(value))
+        if value.tzinfo is None:
+            value = pytz.utc.localize(value)
+        return value.astimezone(pytz.utc)
+
+    def output(self, v, msg):
+        '''simple function to handle logging output based on verbosity'''
+        if self.verbosity >= v:
+            self.stdout.write("%s\n" % msg)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('publication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexFailure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('pid', models.CharField(unique=True, max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('last_attempt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
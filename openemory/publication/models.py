@@ -18,12 +18,15 @@ import logging
 import os
 import base64
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
-from eulfedora.server import Repository
+from dateutil import parser as dateparser
 from dateutil.relativedelta import relativedelta
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 from django.db import models
@@ -32,7 +35,7 @@ from django.template.defaultfilters import slugify
 from django.template.loader import get_template
 from django.utils.safestring import mark_safe
 from eulfedora.models import FileDatastream, \
-     XmlDatastream, Relation
+     XmlDatastream, Relation, XmlDatastreamObject, RdfDatastreamObject
 from eulfedora.util import RequestFailed, parse_rdf
 from eulfedora.indexdata.util import pdf_to_text
 from openemory.publication.symp_import import OESympImportPublication, \
@@ -60,11 +63,12 @@ from pprint import pprint
 import re
 import openemory
 from django.utils.crypto import get_random_string
-from openemory.common.fedora import DigitalObject, ManagementRepository, \
-    absolutize_url
+from openemory.common.fedora import DigitalObject, Repository, ManagementRepository, \
+    absolutize_url, CachedXmlDatastream, current_api_stats, track_api_calls
 from openemory.rdfns import DC, BIBO, FRBR, ns_prefixes
 from openemory.util import pmc_access_url
-from openemory.util import solr_interface
+from openemory.util import solr_interface, index_data_hash, INDEX_HASH_FIELD
+from openemory.publication.duplicates import duplicate_keys, DUPLICATE_KEY_FIELD
 from openemory.publication.symp import SympAtom
 from openemory.publication.symp_import import *
 from openemory.common import romeo
@@ -887,7 +891,17 @@ class NlmArticle(xmlmap.XmlObject):
         return self._identified_authors
 
     _identified_authors = None
-    def identifiable_authors(self, refresh=False, derive=False):
+    @staticmethod
+    def get_affiliation_user():
+        '''Get the placeholder :class:`~django.contrib.auth.models.User`
+        used by :meth:`identifiable_authors` for Emory-affiliated
+        authors, creating it if it does not yet exist.'''
+        user, created = User.objects.get_or_create(username="affiliation",
+            defaults={'first_name': "Other", 'last_name': "Emory Authors",
+                      'is_staff': True, 'email': "affiliation@emory.edu"})
+        return user
+
+    def identifiable_authors(self, refresh=False, derive=False, affiliation_user=None):
         '''Identify any Emory authors for the article and, if
         possible, return a list of corresponding
         :class:`~django.contrib.auth.models.User` objects.
@@ -908,6 +922,10 @@ class NlmArticle(xmlmap.XmlObject):
         By default, caches the identified authors on the first
         look-up, in order to avoid unecessarily repeating LDAP
         queries.
+
+        :param affiliation_user: the user returned by
+            :meth:`get_affiliation_user`, when it has already been
+            looked up (e.g., once for a whole harvest run)
         '''
 
         if self._identified_authors is None or refresh:
@@ -920,17 +938,10 @@ class NlmArticle(xmlmap.XmlObject):
             # generate a list of User objects based on the list of emory email addresses
             self._identified_authors = []
 
-            for af in emory_aff:
-                db_user = User.objects.filter(username="affiliation")
-                if db_user.count() > 0:
-                    self._identified_authors.append(db_user.get())
-                    break
-                else:
-                    user = User(username="affiliation",first_name="Other",last_name="Emory Authors", is_staff=True, email="affiliation@emory.edu")
-                    user.save()
-                    self._identified_authors.append(user)
-                    break
-                
+            if emory_aff:
+                if affiliation_user is None:
+                    affiliation_user = self.get_affiliation_user()
+                self._identified_authors.append(affiliation_user)
 
         return self._identified_authors
 
@@ -1327,7 +1338,7 @@ class Publication(DigitalObject):
     configured to be versioned and managed; default mimetype is
     ``application/pdf``.'''
 
-    descMetadata = XmlDatastream('descMetadata', 'Descriptive Metadata (MODS)',
+    descMetadata = CachedXmlDatastream('descMetadata', 'Descriptive Metadata (MODS)',
         PublicationMods, defaults={
             'versionable': True,
         })
@@ -1335,7 +1346,7 @@ class Publication(DigitalObject):
     # dc = XmlDatastream('DC', 'Dublin Core Record for this object')
     '''Descriptive Metadata datastream, as :class:`PublicationMods`'''
 
-    contentMetadata = XmlDatastream('contentMetadata', 'content metadata', NlmArticle, defaults={
+    contentMetadata = CachedXmlDatastream('contentMetadata', 'content metadata', NlmArticle, defaults={
         'versionable': True
         })
     '''Optional datastream for additional content metadata for a
@@ -1343,7 +1354,7 @@ class Publication(DigitalObject):
     :class:`NlmArticle`.'''
 
 
-    provenance = XmlDatastream('provenanceMetadata',
+    provenance = CachedXmlDatastream('provenanceMetadata',
                                        'Provenance metadata', PublicationPremis, defaults={
         'versionable': False
         })
@@ -1364,12 +1375,18 @@ class Publication(DigitalObject):
     # NOTE: authorAgreement isn't in the Hydra content model. Neither is
     # anything like it. So we just follow their naming style here.
 
-    sympAtom = XmlDatastream('SYMPLECTIC-ATOM', 'SYMPLECTIC-ATOM',
+    sympAtom = CachedXmlDatastream('SYMPLECTIC-ATOM', 'SYMPLECTIC-ATOM',
         SympAtom, defaults={
             'versionable': True,
         })
     '''Descriptive Metadata datastream, as :class:`PublicationMods`'''
 
+    _datastream_profiles = None
+
+    skipped_writes = 0
+    '''number of loaded datastreams that were not written to Fedora on
+    the last :meth:`save` because their content had not changed'''
+
     def get_absolute_url(self):
         ark_uri = self.descMetadata.content.ark_uri
         return ark_uri or reverse('publication:view',  kwargs={'pid': self.pid})
@@ -1473,6 +1490,12 @@ class Publication(DigitalObject):
           * set object owners based on ids from authors set in
             :attr:`descMetadata` content; if this would result in no owners,
             the previous value is left as is.
+          * map MODS values into DC
+
+        Only datastreams whose content has actually changed are sent
+        to Fedora; the number of loaded datastreams that were not
+        saved because they are unchanged is available afterwards as
+        :attr:`skipped_writes`.
         '''
         # update owners based on identified emory authors in the metadata
         new_owners = self.OWNER_ID_SEPARATOR.join(auth.id for auth
@@ -1480,16 +1503,25 @@ class Publication(DigitalObject):
                                                    if auth.id)
         # only update if there are new owners; don't clear out an existing owner
         # without setting a new owner
-        if new_owners:
+        if new_owners and new_owners != self.owner:
             self.owner = new_owners
 
         # Remove control character \r  from abstract
         if self.descMetadata.content.abstract is not None and self.descMetadata.content.abstract.text:
                 self.descMetadata.content.abstract.text = self.descMetadata.content.abstract.text.replace('\r', '')
 
-        # map MODS values into DC
+        # map MODS values into DC; this also repairs stale DC when the
+        # MODS is unchanged, and DC is only written if the result differs
         self._mods_to_dc()
 
+        if not self._create:
+            loaded = [dsobj for dsobj in self.dscache.values()
+                      if dsobj.exists and dsobj._content is not None]
+            self.skipped_writes = len([dsobj for dsobj in loaded
+                                       if not dsobj.isModified()])
+            logger.debug('Saving %s: %d unchanged datastreams not saved' % \
+                         (self.pid, self.skipped_writes))
+
         return super(Publication, self).save(*args, **kwargs)
 
     def as_rdf(self, node=None):
@@ -1618,7 +1650,7 @@ class Publication(DigitalObject):
                 # check for dc authors and add to them if set
                 data['creator'] = mods_authors
 
-                data['author_affiliation'] = list(set(a.affiliation
+                data['author_affiliation'] = sorted(set(a.affiliation
                                                       for a in mods.authors
                                                       if a.affiliation))
                 data['affiliations'] = self.affiliations
@@ -1655,6 +1687,46 @@ class Publication(DigitalObject):
             if pmcid in data['identifier']:	# don't double-index PMC id
                 data['identifier'].remove(pmcid)
 
+        # keys for finding candidate duplicates; see openemory.publication.duplicates
+        mods = self.descMetadata.content
+        doi = mods.final_version.doi if mods.final_version else None
+        data[DUPLICATE_KEY_FIELD] = duplicate_keys(mods.title or self.label, doi, self.pmcid)
+
+        # hash of the payload, so unchanged documents can be skipped on reindex
+        data[INDEX_HASH_FIELD] = index_data_hash(data)
+
+        return data
+
+    #: index fields that can be updated in place with a Solr atomic
+    #: update (see :meth:`partial_index_data`); includes the object
+    #: properties (owner, label) that can change without modifying
+    #: any datastream
+    PARTIAL_INDEX_FIELDS = ('state', 'withdrawn', 'review_date',
+                            'embargo_end', 'last_modified', 'owner', 'label')
+    #: datastreams whose changes only affect :attr:`PARTIAL_INDEX_FIELDS`
+    PARTIAL_INDEX_DATASTREAMS = ('provenanceMetadata',)
+
+    def partial_index_data(self):
+        '''Index data for just the :attr:`PARTIAL_INDEX_FIELDS`, for
+        use with :meth:`openemory.util.solr_atomic_update` when a
+        publication is withdrawn, reinstated, published or reviewed,
+        or its owner or label is changed, and nothing else has
+        changed.  Unlike :meth:`index_data`, this does not load the
+        PDF or generate full text.  Fields without a
+        value are set to None so they will be removed from the index.
+        '''
+        data = {
+            'id': 'pid: %s' % self.pid,
+            'state': self.state,
+            'withdrawn': self.is_withdrawn,
+            'last_modified': self.modified,
+            'owner': self.owners,
+            'label': self.label,
+            'review_date': None,
+            'embargo_end': self.descMetadata.content.embargo_end or None,
+        }
+        if self.provenance.exists and self.provenance.content.date_reviewed:
+            data['review_date'] = self.provenance.content.date_reviewed
         return data
 
     @property
@@ -1664,8 +1736,35 @@ class Publication(DigitalObject):
         mods = self.descMetadata.content
         return [a.id for a in mods.authors if a.id]
 
+    _author_esd_records = None
+    '''Optional dictionary of username -> ESD record shared across a
+    batch of publications; set by :meth:`prefetch_author_esd`.'''
+
+    @classmethod
+    def prefetch_author_esd(cls, publications):
+        '''Resolve ESD data for the authors of a chunk of publications
+        with a handful of bulk queries, and share the resolved records
+        across the chunk so that :attr:`author_esd` (used several
+        times by :meth:`index_data`) does not query per author.
+
+        :param publications: list of :class:`Publication` objects
+        '''
+        publications = list(publications)
+        netids = set()
+        for pub in publications:
+            netids.update(pub.author_netids)
+        records = cls._esd_model().by_netid(netids)
+        for pub in publications:
+            pub._author_esd_records = records
+        return records
+
     @property
     def author_esd(self):
+        if self._author_esd_records is not None:
+            return [self._author_esd_records[netid]
+                    for netid in self.author_netids
+                    if netid in self._author_esd_records]
+
         result = []
         for netid in self.author_netids:
             try:
@@ -1700,11 +1799,14 @@ class Publication(DigitalObject):
     # accounts (where EsdPerson lives) because accounts already depends on
     # publication. clearly, though, a better dependency structure is needed
     # here.
+    @staticmethod
+    def _esd_model():
+        profile_model = apps.get_model(settings.AUTH_PROFILE_MODULE)
+        return profile_model.esd_model()
+
     @staticmethod
     def split_department(division_dept_id):
-        app_label, model_name = settings.AUTH_PROFILE_MODULE.split('.')
-        profile_model = models.get_model(app_label, model_name)
-        esd_model = profile_model.esd_model()
+        esd_model = Publication._esd_model()
         return esd_model.split_department(division_dept_id)
 
     @property
@@ -1830,6 +1932,54 @@ class Publication(DigitalObject):
             return qs.aggregate(num_views=models.Sum('num_views'),
                                 num_downloads=models.Sum('num_downloads'))
 
+    #: number of threads used by :meth:`prefetch`
+    PREFETCH_WORKERS = 4
+
+    def prefetch(self, *datastreams):
+        '''Load the specified datastreams concurrently, so that views
+        can retrieve everything a template needs from Fedora in one
+        round of parallel requests instead of one request at a time
+        while rendering.  Datastreams are specified by attribute name
+        (e.g., ``descMetadata``, ``provenance``); XML and RDF
+        datastreams have their content loaded, other datastreams
+        (e.g., ``pdf``) only their profile.  The object profile is
+        loaded first, since datastream caching depends on it.
+
+        Errors are logged and otherwise ignored; the datastream will
+        be loaded (and any error raised) as usual when it is accessed.
+        '''
+        # object profile is needed for cache keys; load before starting threads
+        self.info
+
+        loaders = []
+        for name in datastreams:
+            ds = getattr(self, name)
+            if not ds.exists:
+                continue
+            if isinstance(ds, (XmlDatastreamObject, RdfDatastreamObject)):
+                loaders.append((name, lambda ds=ds: ds.content))
+            else:
+                loaders.append((name, lambda ds=ds: ds.info))
+        if len(loaders) < 2:
+            # nothing to be gained from threads
+            for name, load in loaders:
+                self._prefetch_datastream(name, load)
+            return
+
+        stats = current_api_stats()
+        def load(item):
+            with track_api_calls(stats):
+                self._prefetch_datastream(*item)
+
+        with ThreadPoolExecutor(max_workers=self.PREFETCH_WORKERS) as executor:
+            list(executor.map(load, loaders))
+
+    def _prefetch_datastream(self, name, load):
+        try:
+            load()
+        except Exception as e:
+            logger.debug('Error prefetching %s for %s: %s' % (name, self.pid, e))
+
     ### PDF generation methods for Article cover page ###
 
 
@@ -1899,54 +2049,88 @@ class Publication(DigitalObject):
         if not pdf.err:
             return result
 
-    def what_mime_type(self):
-        mime_type=''
-        all_allowed_mime = {'pdf' : 'application/pdf', 'docx':'application/vnd.openxmlformats-officedocument.wordprocessingml.document','doc' : 'application/msword','pptx' : 'application/vnd.openxmlformats-officedocument.presentationml.presentation','ppt': 'application/vnd.ms-powerpoint','jpeg' : 'image/jpeg','png' : 'image/png','tiff' : 'image/tiff', 'xls': 'application/vnd.ms-excel', 'xlsx' : 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
-        mime = None
-        mime_ds_list = None
-        mime_ds_list = [i for i in self.ds_list if self.ds_list[i].mimeType in all_allowed_mime.values()]
-
-
-        if mime_ds_list:
-            # sort by DS timestamp does not work yet asks for global name obj because of lambda function
-            new_dict = {}
-            for mime in mime_ds_list:
-                new_dict[mime] = self.getDatastreamObject(mime)
+    def datastream_profiles(self):
+        '''Mimetype and creation date of the current version of each
+        datastream on this object, retrieved with a single
+        ``listDatastreams`` call with ``profiles=true`` (Fedora 3.6 or
+        later) rather than one profile request per datastream.
+        Results are cached for the current version of the object.
 
-            try:
-                sorted_mimes = sorted(new_dict.items(), key=lambda x: x[1])
-            except:
-                sorted_mimes = []
-            # sorted_mimes = sorted(mime_ds_list, key=lambda p: str(obj.getDatastreamObject(p).last_modified()))
-            if sorted_mimes:
-                mime = sorted_mimes[-1][0]  # most recent
-
-            if mime:
-
-                mime_type =  self.ds_list[mime].mimeType
-
-                if mime_type == 'application/pdf':
-                    mymime = 'pdf'
-                elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' or mime_type == 'application/msword':
-                    mymime = 'word'
-                elif mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' or mime_type == 'application/vnd.ms-excel':
-                    mymime = 'excel'
-                elif mime_type == 'application/vnd.openxmlformats-officedocument.presentationml.presentation':
-                    mymime = 'powerpoint'
-                elif mime_type == 'application/vnd.ms-powerpoint':
-                    mymime = 'powerpoint2'
-                elif mime_type == 'image/jpeg':
-                    mymime = 'jpg'
-                elif mime_type == 'image/png':
-                    mymime = 'png'
-                elif mime_type == 'image/tiff':
-                    mymime = 'tiff'
-                else:
-                    mymime = 'pdf'
+        :returns: dictionary of dsid -> (mimetype, created)
+        '''
+        if self._datastream_profiles is not None:
+            return self._datastream_profiles
+
+        cache_key = None
+        if self.modified is not None:
+            cache_key = 'ds-profiles:%s:%s' % (self.pid, self.modified.isoformat())
+            self._datastream_profiles = cache.get(cache_key)
+            if self._datastream_profiles is not None:
+                return self._datastream_profiles
+
+        r = self.api.get('objects/%s/datastreams' % self.pid,
+                         params={'format': 'xml', 'profiles': 'true'})
+        doc = etree.fromstring(r.content)
+        profiles = {}
+        # profiles are in the management namespace inside an access
+        # namespace listing; match on local name to allow for either
+        for node in doc.xpath('//*[local-name()="datastreamProfile"]'):
+            created = node.xpath('string(*[local-name()="dsCreateDate"])')
+            profiles[node.get('dsID')] = (
+                node.xpath('string(*[local-name()="dsMIME"])'),
+                dateparser.parse(created) if created else None)
+
+        if not profiles:
+            # older versions of Fedora ignore profiles=true; fall back to
+            # the datastream list and individual datastream profiles
+            profiles = dict((dsid, (ds.mimeType, self.getDatastreamObject(dsid).created))
+                            for dsid, ds in self.ds_list.items())
+
+        self._datastream_profiles = profiles
+        if cache_key:
+            cache.set(cache_key, profiles)
+        return profiles
+
+    def newest_datastream(self, mimetypes):
+        '''Find the most recently created datastream with one of the
+        specified mimetypes, based on :meth:`datastream_profiles`.
+
+        :param mimetypes: list of allowed mimetypes
+        :returns: datastream id, or None if there is no match
+        '''
+        candidates = [(created is not None, created, dsid) for dsid, (mimetype, created)
+                      in self.datastream_profiles().items() if mimetype in mimetypes]
+        if candidates:
+            return max(candidates)[2]
 
+    def what_mime_type(self):
+        all_allowed_mime = {'pdf' : 'application/pdf', 'docx':'application/vnd.openxmlformats-officedocument.wordprocessingml.document','doc' : 'application/msword','pptx' : 'application/vnd.openxmlformats-officedocument.presentationml.presentation','ppt': 'application/vnd.ms-powerpoint','jpeg' : 'image/jpeg','png' : 'image/png','tiff' : 'image/tiff', 'xls': 'application/vnd.ms-excel', 'xlsx' : 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
 
+        # most recent datastream with an allowed mimetype
+        mime = self.newest_datastream(all_allowed_mime.values())
+        if mime:
+            mime_type = self.datastream_profiles()[mime][0]
+
+            if mime_type == 'application/pdf':
+                mymime = 'pdf'
+            elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' or mime_type == 'application/msword':
+                mymime = 'word'
+            elif mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' or mime_type == 'application/vnd.ms-excel':
+                mymime = 'excel'
+            elif mime_type == 'application/vnd.openxmlformats-officedocument.presentationml.presentation':
+                mymime = 'powerpoint'
+            elif mime_type == 'application/vnd.ms-powerpoint':
+                mymime = 'powerpoint2'
+            elif mime_type == 'image/jpeg':
+                mymime = 'jpg'
+            elif mime_type == 'image/png':
+                mymime = 'png'
+            elif mime_type == 'image/tiff':
+                mymime = 'tiff'
+            else:
+                mymime = 'pdf'
 
-                return mymime
+            return mymime
 
 
     def image_with_cover(self):
@@ -2099,6 +2283,22 @@ class Publication(DigitalObject):
             new_node[:] = self.dc.content.node[:]
             self.dc.content.node = new_node
 
+    def prepare_ingest(self):
+        '''Finalize a new object so that it can be ingested complete
+        with a single :meth:`save`, rather than saving once and then
+        again to clean up DC and add provenance: mints the pid (if
+        it has not already been set), removes DC namespaces that cause
+        OAI a problem, and initializes the PREMIS object so that
+        events can be added to :attr:`provenance` before ingest.
+
+        Should be called after the label and metadata have been set,
+        since the label is used when minting an ARK.
+        '''
+        if callable(self.pid):
+            self.pid = self.pid()
+        self._prep_dc_for_oai()
+        self.provenance.content.init_object(self.pid, 'pid')
+
     def as_symp(self, source='manual', source_id=None):
         """
         Takes an optional source param that will set the source in the :class:`SympRelation` objects.
@@ -2725,3 +2925,22 @@ class LastRun(models.Model):
 
     def __unicode__(self):
         return "%s %s" % (self.name, self.start_time)
+
+
+class IndexFailure(models.Model):
+    '''An object that the ``index_changed`` command could not index.
+    Failed objects are kept here instead of holding back the
+    watermark, and are retried on each run until they are indexed or
+    have failed :attr:`MAX_ATTEMPTS` times.'''
+    pid = models.CharField(max_length=255, unique=True)
+    #: number of failed attempts to index the object
+    attempts = models.PositiveIntegerField(default=0)
+    #: error from the most recent failed attempt
+    error = models.TextField(blank=True)
+    last_attempt = models.DateTimeField(auto_now=True)
+
+    #: number of attempts before an object is no longer retried
+    MAX_ATTEMPTS = 5
+
+    def __unicode__(self):
+        return "%s (%d attempts)" % (self.pid, self.attempts)
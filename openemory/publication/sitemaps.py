@@ -16,7 +16,7 @@
 
 from django.contrib.sitemaps import Sitemap
 from django.urls import reverse
-from eulfedora.server import Repository
+from openemory.common.fedora import Repository
 from openemory.publication.models import Publication
 from openemory.util import solr_interface
 
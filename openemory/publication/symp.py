@@ -197,7 +197,40 @@ class SympSource(xmlmap.XmlObject):
     chapter_num = xmlmap.StringField("pubs:field[@name='number']/pubs:text")
 
     ########## end additional metadata for all other content types ################
-   
+
+
+
+def _preferred(field, returns=None):
+    '''Property for a :class:`SympAtom` field that returns the value
+    from the preferred source; see :meth:`SympAtom.resolved`.'''
+    def fget(self):
+        return self.resolved()[field]
+    fget.__name__ = field
+    fget.__doc__ = 'wrapper arond field that chooses that prefered source'
+    if returns:
+        fget.__doc__ += '\n' + returns
+    return property(fget)
+
+
+_marc_languages = None
+
+def marc_language(lang):
+    '''Look up a language by name or code in the MARC languages Code
+    List, which is only loaded once per process.
+
+    :returns: a tuple containing language code and name, or empty
+        strings if the language is not found
+    '''
+    global _marc_languages
+    if _marc_languages is None:
+        marc_languages_xml = 'http://www.loc.gov/standards/codelists/languages.xml'
+        _marc_languages = xmlmap.load_xmlobject_from_file(marc_languages_xml)
+
+    ns = {'lang':'info:lc/xmlns/codelist-v1'}
+    nodes = _marc_languages.node.xpath("//lang:language[lang:name='%s' or lang:code='%s']" % (lang, lang), namespaces=ns)
+    if nodes:
+        return (nodes[0].findtext('lang:code', namespaces=ns), nodes[0].findtext('lang:name', namespaces=ns))
+    return ('', '')
 
 
 # expand for other content types
@@ -223,651 +256,118 @@ class SympAtom(xmlmap.XmlObject):
     '''Comment on publication when depositing in OpenEmory through connector'''
 
 
-    #access props for each field
-
-    @property
-    def title(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.title:
-            return self.wos.title
-        elif self.scopus and self.scopus.title:
-            return self.scopus.title
-        elif self.pubmed and self.pubmed.title:
-            return self.pubmed.title
-        elif self.crossref and self.crossref.title:
-            return self.crossref.title
-        elif self.arxiv and self.arxiv.title:
-            return self.arxiv.title
-        elif self.repec and self.repec.title:
-            return self.repec.title
-        elif self.dblp and self.dblp.title:
-            return self.dblp.title
-        elif self.manual and self.manual.title:
-            return self.manual.title
-        elif self.gb and self.gb.title:
-            return self.gb.title
-        else: return ''
-
-    @property
-    def presentation_place(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.presentation_place:
-            return self.wos.presentation_place
-        elif self.scopus and self.scopus.presentation_place:
-            return self.scopus.presentation_place
-        elif self.pubmed and self.pubmed.presentation_place:
-            return self.pubmed.presentation_place
-        elif self.crossref and self.crossref.presentation_place:
-            return self.crossref.presentation_place
-        elif self.arxiv and self.arxiv.presentation_place:
-            return self.arxiv.presentation_place
-        elif self.repec and self.repec.presentation_place:
-            return self.repec.presentation_place
-        elif self.dblp and self.dblp.presentation_place:
-            return self.dblp.presentation_place
-        elif self.manual and self.manual.presentation_place:
-            return self.manual.presentation_place
-        elif self.gb and self.gb.presentation_place:
-            return self.gb.presentation_place
-        else: return ''
-
-    @property
-    def license(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.license:
-            return self.wos.license
-        elif self.scopus and self.scopus.license:
-            return self.scopus.license
-        elif self.pubmed and self.pubmed.license:
-            return self.pubmed.license
-        elif self.crossref and self.crossref.license:
-            return self.crossref.license
-        elif self.arxiv and self.arxiv.license:
-            return self.arxiv.license
-        elif self.repec and self.repec.license:
-            return self.repec.license
-        elif self.dblp and self.dblp.license:
-            return self.dblp.license
-        elif self.manual and self.manual.license:
-            return self.manual.license
-        elif self.gb and self.gb.license:
-            return self.gb.license
-        else: return ''
-
-    @property
-    def pubstatus(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.pubstatus:
-            return self.wos.pubstatus
-        elif self.scopus and self.scopus.pubstatus:
-            return self.scopus.pubstatus
-        elif self.pubmed and self.pubmed.pubstatus:
-            return self.pubmed.pubstatus
-        elif self.crossref and self.crossref.pubstatus:
-            return self.crossref.pubstatus
-        elif self.arxiv and self.arxiv.pubstatus:
-            return self.arxiv.pubstatus
-        elif self.repec and self.repec.pubstatus:
-            return self.repec.pubstatus
-        elif self.dblp and self.dblp.pubstatus:
-            return self.dblp.pubstatus
-        elif self.manual and self.manual.pubstatus:
-            return self.manual.pubstatus
-        elif self.gb and self.gb.pubstatus:
-            return self.gb.pubstatus
-        else: return ''
-
-    @property
-    def pubnumber(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.pubnumber:
-            return self.wos.pubnumber
-        elif self.scopus and self.scopus.pubnumber:
-            return self.scopus.pubnumber
-        elif self.pubmed and self.pubmed.pubnumber:
-            return self.pubmed.pubnumber
-        elif self.crossref and self.crossref.pubnumber:
-            return self.crossref.pubnumber
-        elif self.arxiv and self.arxiv.pubnumber:
-            return self.arxiv.pubnumber
-        elif self.repec and self.repec.pubnumber:
-            return self.repec.pubnumber
-        elif self.dblp and self.dblp.pubnumber:
-            return self.dblp.pubnumber
-        elif self.manual and self.manual.pubnumber:
-            return self.manual.pubnumber
-        elif self.gb and self.gb.pubnumber:
-            return self.gb.pubnumber
-        else: return ''
-
-    @property
-    def report_number(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.report_number:
-            return self.wos.report_number
-        elif self.scopus and self.scopus.report_number:
-            return self.scopus.report_number
-        elif self.pubmed and self.pubmed.report_number:
-            return self.pubmed.report_number
-        elif self.crossref and self.crossref.report_number:
-            return self.crossref.report_number
-        elif self.arxiv and self.arxiv.report_number:
-            return self.arxiv.report_number
-        elif self.repec and self.repec.report_number:
-            return self.repec.report_number
-        elif self.dblp and self.dblp.report_number:
-            return self.dblp.report_number
-        elif self.manual and self.manual.report_number:
-            return self.manual.report_number
-        elif self.gb and self.gb.report_number:
-            return self.gb.report_number
-        else: return ''
-
-    @property
-    def notes(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.notes:
-            return self.wos.notes
-        elif self.scopus and self.scopus.notes:
-            return self.scopus.notes
-        elif self.pubmed and self.pubmed.notes:
-            return self.pubmed.notes
-        elif self.crossref and self.crossref.notes:
-            return self.crossref.notes
-        elif self.arxiv and self.arxiv.notes:
-            return self.arxiv.notes
-        elif self.repec and self.repec.notes:
-            return self.repec.notes
-        elif self.dblp and self.dblp.notes:
-            return self.dblp.notes
-        elif self.manual and self.manual.notes:
-            return self.manual.notes
-        elif self.gb and self.gb.notes:
-            return self.gb.notes
-        else: return ''
-
-    @property
-    def conference_start(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.conference_start:
-            return self.wos.conference_start
-        elif self.scopus and self.scopus.conference_start:
-            return self.scopus.conference_start
-        elif self.pubmed and self.pubmed.conference_start:
-            return self.pubmed.conference_start
-        elif self.crossref and self.crossref.conference_start:
-            return self.crossref.conference_start
-        elif self.arxiv and self.arxiv.conference_start:
-            return self.arxiv.conference_start
-        elif self.repec and self.repec.conference_start:
-            return self.repec.conference_start
-        elif self.dblp and self.dblp.conference_start:
-            return self.dblp.conference_start
-        elif self.manual and self.manual.conference_start:
-            return self.manual.conference_start
-        elif self.gb and self.gb.conference_start:
-            return self.gb.conference_start
-        else: return ''
-
-    @property
-    def conference_end(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.conference_end:
-            return self.wos.conference_end
-        elif self.scopus and self.scopus.conference_end:
-            return self.scopus.conference_end
-        elif self.pubmed and self.pubmed.conference_end:
-            return self.pubmed.conference_end
-        elif self.crossref and self.crossref.conference_end:
-            return self.crossref.conference_end
-        elif self.arxiv and self.arxiv.conference_end:
-            return self.arxiv.conference_end
-        elif self.repec and self.repec.conference_end:
-            return self.repec.conference_end
-        elif self.dblp and self.dblp.conference_end:
-            return self.dblp.conference_end
-        elif self.manual and self.manual.conference_end:
-            return self.manual.conference_end
-        elif self.gb and self.gb.conference_end:
-            return self.gb.conference_end
-        else: return ''
-
-    @property
-    def conference_name(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.conference_name:
-            return self.wos.conference_name
-        elif self.scopus and self.scopus.conference_name:
-            return self.scopus.conference_name
-        elif self.pubmed and self.pubmed.conference_name:
-            return self.pubmed.conference_name
-        elif self.crossref and self.crossref.conference_name:
-            return self.crossref.conference_name
-        elif self.arxiv and self.arxiv.conference_name:
-            return self.arxiv.conference_name
-        elif self.repec and self.repec.conference_name:
-            return self.repec.conference_name
-        elif self.dblp and self.dblp.conference_name:
-            return self.dblp.conference_name
-        elif self.manual and self.manual.conference_name:
-            return self.manual.conference_name
-        elif self.gb and self.gb.conference_name:
-            return self.gb.conference_name
-        else: return ''
-
-    @property
-    def conference_place(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.conference_place:
-            return self.wos.conference_place
-        elif self.scopus and self.scopus.conference_place:
-            return self.scopus.conference_place
-        elif self.pubmed and self.pubmed.conference_place:
-            return self.pubmed.conference_place
-        elif self.crossref and self.crossref.conference_place:
-            return self.crossref.conference_place
-        elif self.arxiv and self.arxiv.conference_place:
-            return self.arxiv.conference_place
-        elif self.repec and self.repec.conference_place:
-            return self.repec.conference_place
-        elif self.dblp and self.dblp.conference_place:
-            return self.dblp.conference_place
-        elif self.manual and self.manual.conference_place:
-            return self.manual.conference_place
-        elif self.gb and self.gb.conference_place:
-            return self.gb.conference_place
-        else: return ''
-
-    @property
-    def acceptance_date(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.acceptance_date:
-            return self.wos.acceptance_date
-        elif self.scopus and self.scopus.acceptance_date:
-            return self.scopus.acceptance_date
-        elif self.pubmed and self.pubmed.acceptance_date:
-            return self.pubmed.acceptance_date
-        elif self.crossref and self.crossref.acceptance_date:
-            return self.crossref.acceptance_date
-        elif self.arxiv and self.arxiv.acceptance_date:
-            return self.arxiv.acceptance_date
-        elif self.repec and self.repec.acceptance_date:
-            return self.repec.acceptance_date
-        elif self.dblp and self.dblp.acceptance_date:
-            return self.dblp.acceptance_date
-        elif self.manual and self.manual.acceptance_date:
-            return self.manual.acceptance_date
-        elif self.gb and self.gb.acceptance_date:
-            return self.gb.acceptance_date
-        else: return ''
-
-    @property
-    def book_title(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.book_title:
-            return self.wos.book_title
-        elif self.scopus and self.scopus.book_title:
-            return self.scopus.book_title
-        elif self.pubmed and self.pubmed.book_title:
-            return self.pubmed.book_title
-        elif self.crossref and self.crossref.book_title:
-            return self.crossref.book_title
-        elif self.arxiv and self.arxiv.book_title:
-            return self.arxiv.book_title
-        elif self.repec and self.repec.book_title:
-            return self.repec.book_title
-        elif self.dblp and self.dblp.book_title:
-            return self.dblp.book_title
-        elif self.manual and self.manual.book_title:
-            return self.manual.book_title
-        elif self.gb and self.gb.book_title:
-            return self.gb.book_title
-        else: return ''
-
-    @property
-    def series(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.series:
-            return self.wos.series
-        elif self.scopus and self.scopus.series:
-            return self.scopus.series
-        elif self.pubmed and self.pubmed.series:
-            return self.pubmed.series
-        elif self.crossref and self.crossref.series:
-            return self.crossref.series
-        elif self.arxiv and self.arxiv.series:
-            return self.arxiv.series
-        elif self.repec and self.repec.series:
-            return self.repec.series
-        elif self.dblp and self.dblp.series:
-            return self.dblp.series
-        elif self.manual and self.manual.series:
-            return self.manual.series
-        elif self.gb and self.gb.series:
-            return self.gb.series
-        else: return ''
-
-    @property
-    def edition(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.edition:
-            return self.wos.edition
-        elif self.scopus and self.scopus.edition:
-            return self.scopus.edition
-        elif self.pubmed and self.pubmed.edition:
-            return self.pubmed.edition
-        elif self.crossref and self.crossref.edition:
-            return self.crossref.edition
-        elif self.arxiv and self.arxiv.edition:
-            return self.arxiv.edition
-        elif self.repec and self.repec.edition:
-            return self.repec.edition
-        elif self.dblp and self.dblp.edition:
-            return self.dblp.edition
-        elif self.manual and self.manual.edition:
-            return self.manual.edition
-        elif self.gb and self.gb.edition:
-            return self.gb.edition
-        else: return ''
-
-    @property
-    def relationship(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.relationship:
-            return self.wos.relationship
-        elif self.scopus and self.scopus.relationship:
-            return self.scopus.relationship
-        elif self.pubmed and self.pubmed.relationship:
-            return self.pubmed.relationship
-        elif self.crossref and self.crossref.relationship:
-            return self.crossref.relationship
-        elif self.arxiv and self.arxiv.relationship:
-            return self.arxiv.relationship
-        elif self.repec and self.repec.relationship:
-            return self.repec.relationship
-        elif self.dblp and self.dblp.relationship:
-            return self.dblp.relationship
-        elif self.manual and self.manual.relationship:
-            return self.manual.relationship
-        elif self.gb and self.gb.relationship:
-            return self.gb.relationship
-        else: return ''
-
-    @property
-    def medium(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.medium:
-            return self.wos.medium
-        elif self.scopus and self.scopus.medium:
-            return self.scopus.medium
-        elif self.pubmed and self.pubmed.medium:
-            return self.pubmed.medium
-        elif self.crossref and self.crossref.medium:
-            return self.crossref.medium
-        elif self.arxiv and self.arxiv.medium:
-            return self.arxiv.medium
-        elif self.repec and self.repec.medium:
-            return self.repec.medium
-        elif self.dblp and self.dblp.medium:
-            return self.dblp.medium
-        elif self.manual and self.manual.medium:
-            return self.manual.medium
-        elif self.gb and self.gb.medium:
-            return self.gb.medium
-        else: return ''
-
-    @property
-    def num_chapters(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.num_chapters:
-            return self.wos.num_chapters
-        elif self.scopus and self.scopus.num_chapters:
-            return self.scopus.num_chapters
-        elif self.pubmed and self.pubmed.num_chapters:
-            return self.pubmed.num_chapters
-        elif self.crossref and self.crossref.num_chapters:
-            return self.crossref.num_chapters
-        elif self.arxiv and self.arxiv.num_chapters:
-            return self.arxiv.num_chapters
-        elif self.repec and self.repec.num_chapters:
-            return self.repec.num_chapters
-        elif self.dblp and self.dblp.num_chapters:
-            return self.dblp.num_chapters
-        elif self.manual and self.manual.num_chapters:
-            return self.manual.num_chapters
-        elif self.gb and self.gb.num_chapters:
-            return self.gb.num_chapters
-        else: return ''
-
-    @property
-    def pub_place(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.pub_place:
-            return self.wos.pub_place
-        elif self.scopus and self.scopus.pub_place:
-            return self.scopus.pub_place
-        elif self.pubmed and self.pubmed.pub_place:
-            return self.pubmed.pub_place
-        elif self.crossref and self.crossref.pub_place:
-            return self.crossref.pub_place
-        elif self.arxiv and self.arxiv.pub_place:
-            return self.arxiv.pub_place
-        elif self.repec and self.repec.pub_place:
-            return self.repec.pub_place
-        elif self.dblp and self.dblp.pub_place:
-            return self.dblp.pub_place
-        elif self.manual and self.manual.pub_place:
-            return self.manual.pub_place
-        elif self.gb and self.gb.pub_place:
-            return self.gb.pub_place
-        else: return ''
-
-    @property
-    def pub_url(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.pub_url:
-            return self.wos.pub_url
-        elif self.scopus and self.scopus.pub_url:
-            return self.scopus.pub_url
-        elif self.pubmed and self.pubmed.pub_url:
-            return self.pubmed.pub_url
-        elif self.crossref and self.crossref.pub_url:
-            return self.crossref.pub_url
-        elif self.arxiv and self.arxiv.pub_url:
-            return self.arxiv.pub_url
-        elif self.repec and self.repec.pub_url:
-            return self.repec.pub_url
-        elif self.dblp and self.dblp.pub_url:
-            return self.dblp.pub_url
-        elif self.manual and self.manual.pub_url:
-            return self.manual.pub_url
-        elif self.gb and self.gb.pub_url:
-            return self.gb.pub_url
-        else: return ''
-
-    @property
-    def isbn10(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.isbn10:
-            return self.wos.isbn10
-        elif self.scopus and self.scopus.isbn10:
-            return self.scopus.isbn10
-        elif self.pubmed and self.pubmed.isbn10:
-            return self.pubmed.isbn10
-        elif self.crossref and self.crossref.isbn10:
-            return self.crossref.isbn10
-        elif self.arxiv and self.arxiv.isbn10:
-            return self.arxiv.isbn10
-        elif self.repec and self.repec.isbn10:
-            return self.repec.isbn10
-        elif self.dblp and self.dblp.isbn10:
-            return self.dblp.isbn10
-        elif self.manual and self.manual.isbn10:
-            return self.manual.isbn10
-        elif self.gb and self.gb.isbn10:
-            return self.gb.isbn10
-        else: return ''
-
-    @property
-    def chapter_num(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.chapter_num:
-            return self.wos.chapter_num
-        elif self.scopus and self.scopus.chapter_num:
-            return self.scopus.chapter_num
-        elif self.pubmed and self.pubmed.chapter_num:
-            return self.pubmed.chapter_num
-        elif self.crossref and self.crossref.chapter_num:
-            return self.crossref.chapter_num
-        elif self.arxiv and self.arxiv.chapter_num:
-            return self.arxiv.chapter_num
-        elif self.repec and self.repec.chapter_num:
-            return self.repec.chapter_num
-        elif self.dblp and self.dblp.chapter_num:
-            return self.dblp.chapter_num
-        elif self.manual and self.manual.chapter_num:
-            return self.manual.chapter_num
-        elif self.gb and self.gb.chapter_num:
-            return self.gb.chapter_num
-        else: return ''
-
-    @property
-    def isbn13(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.isbn13:
-            return self.wos.isbn13
-        elif self.scopus and self.scopus.isbn13:
-            return self.scopus.isbn13
-        elif self.pubmed and self.pubmed.isbn13:
-            return self.pubmed.isbn13
-        elif self.crossref and self.crossref.isbn13:
-            return self.crossref.isbn13
-        elif self.arxiv and self.arxiv.isbn13:
-            return self.arxiv.isbn13
-        elif self.repec and self.repec.isbn13:
-            return self.repec.isbn13
-        elif self.dblp and self.dblp.isbn13:
-            return self.dblp.isbn13
-        elif self.manual and self.manual.isbn13:
-            return self.manual.isbn13
-        elif self.gb and self.gb.isbn13:
-            return self.gb.isbn13
-        else: return ''
-
-    @property
-    def author_url(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.author_url:
-            return self.wos.author_url
-        elif self.scopus and self.scopus.author_url:
-            return self.scopus.author_url
-        elif self.pubmed and self.pubmed.author_url:
-            return self.pubmed.author_url
-        elif self.crossref and self.crossref.author_url:
-            return self.crossref.author_url
-        elif self.arxiv and self.arxiv.author_url:
-            return self.arxiv.author_url
-        elif self.repec and self.repec.author_url:
-            return self.repec.author_url
-        elif self.dblp and self.dblp.author_url:
-            return self.dblp.author_url
-        elif self.manual and self.manual.author_url:
-            return self.manual.author_url
-        elif self.gb and self.gb.author_url:
-            return self.gb.author_url
-        else: return ''
-
-    @property
-    def author_address(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.author_address:
-            return self.wos.author_address
-        elif self.scopus and self.scopus.author_address:
-            return self.scopus.author_address
-        elif self.pubmed and self.pubmed.author_address:
-            return self.pubmed.author_address
-        elif self.crossref and self.crossref.author_address:
-            return self.crossref.author_address
-        elif self.arxiv and self.arxiv.author_address:
-            return self.arxiv.author_address
-        elif self.repec and self.repec.author_address:
-            return self.repec.author_address
-        elif self.dblp and self.dblp.author_address:
-            return self.dblp.author_address
-        elif self.manual and self.manual.author_address:
-            return self.manual.author_address
-        elif self.gb and self.gb.author_address:
-            return self.gb.author_address
-        else: return ''
-
-    @property
-    def confidential(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.confidential:
-            return self.wos.confidential
-        elif self.scopus and self.scopus.confidential:
-            return self.scopus.confidential
-        elif self.pubmed and self.pubmed.confidential:
-            return self.pubmed.confidential
-        elif self.crossref and self.crossref.confidential:
-            return self.crossref.confidential
-        elif self.arxiv and self.arxiv.confidential:
-            return self.arxiv.confidential
-        elif self.repec and self.repec.confidential:
-            return self.repec.confidential
-        elif self.dblp and self.dblp.confidential:
-            return self.dblp.confidential
-        elif self.manual and self.manual.confidential:
-            return self.manual.confidential
-        elif self.gb and self.gb.confidential:
-            return self.gb.confidential
-        else: return ''
+    #: data sources, in order of preference, as (attribute, Elements
+    #: source name); used to choose a value for fields that may be
+    #: provided by more than one source
+    SOURCE_PRECEDENCE = [
+        ('wos', 'web-of-science'),
+        ('scopus', 'scopus'),
+        ('pubmed', 'pubmed'),
+        ('crossref', 'crossref'),
+        ('arxiv', 'arxiv'),
+        ('repec', 'repec'),
+        ('dblp', 'dblp'),
+        ('manual', 'manual-entry'),
+        ('gb', 'google-books'),
+    ]
+
+    #: :class:`SympSource` fields resolved by source precedence, with
+    #: the value returned when no source provides one
+    RESOLVED_FIELDS = {
+        'title': '', 'presentation_place': '', 'license': '',
+        'pubstatus': '', 'pubnumber': '', 'report_number': '', 'notes': '',
+        'conference_start': '', 'conference_end': '', 'conference_name': '',
+        'conference_place': '', 'acceptance_date': '', 'book_title': '',
+        'series': '', 'edition': '', 'relationship': '', 'medium': '',
+        'num_chapters': '', 'pub_place': '', 'pub_url': '', 'isbn10': '',
+        'chapter_num': '', 'isbn13': '', 'author_url': '',
+        'author_address': '', 'confidential': '', 'sponsor': '', 'issn': '',
+        'language': '', 'abstract': '', 'volume': '', 'issue': '',
+        'publisher': '', 'journal': '', 'doi': '',
+        'pubdate': False, 'authors': False, 'pages': False,
+        'keywords': [], 'report_title': [],
+    }
+
+    _resolved = None
+    _resolved_from = None
+
+    def resolved(self):
+        '''Merged view of the source entries in the feed: a dictionary of
+        each field in :attr:`RESOLVED_FIELDS` to the value from the most
+        preferred source (see :attr:`SOURCE_PRECEDENCE`) that provides
+        one.  The feed is only walked once; the result is reused by all
+        of the field properties.
+        '''
+        if self._resolved is None:
+            self._resolved, self._resolved_from = self._resolve()
+        return self._resolved
+
+    def _resolve(self):
+        # find the first entry for each source in a single pass over the feed
+        source_path = '{%(ns)s}data-source/{%(ns)s}source-name' % {'ns': self.pubs_ns}
+        entries = {}
+        for entry in self.node.iterchildren('{%s}entry' % self.atom_ns):
+            entries.setdefault(entry.findtext(source_path), entry)
+        sources = [(attr, SympSource(entries[name]))
+                   for attr, name in self.SOURCE_PRECEDENCE if name in entries]
+
+        values = {}
+        chosen = {}
+        for field, default in self.RESOLVED_FIELDS.items():
+            values[field] = default
+            for attr, source in sources:
+                value = getattr(source, field)
+                # pagination is only used from curated sources if it has a start page
+                if field == 'pages' and value and not value.begin_page \
+                        and attr not in ('manual', 'gb'):
+                    continue
+                if value:
+                    values[field] = value
+                    chosen[field] = attr
+                    break
+        return values, chosen
 
-    @property
-    def sponsor(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.sponsor:
-            return self.wos.sponsor
-        elif self.scopus and self.scopus.sponsor:
-            return self.scopus.sponsor
-        elif self.pubmed and self.pubmed.sponsor:
-            return self.pubmed.sponsor
-        elif self.crossref and self.crossref.sponsor:
-            return self.crossref.sponsor
-        elif self.arxiv and self.arxiv.sponsor:
-            return self.arxiv.sponsor
-        elif self.repec and self.repec.sponsor:
-            return self.repec.sponsor
-        elif self.dblp and self.dblp.sponsor:
-            return self.dblp.sponsor
-        elif self.manual and self.manual.sponsor:
-            return self.manual.sponsor
-        elif self.gb and self.gb.sponsor:
-            return self.gb.sponsor
-        else: return ''
+    #access props for each field
 
-    @property
-    def issn(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.issn:
-            return self.wos.issn
-        elif self.scopus and self.scopus.issn:
-            return self.scopus.issn
-        elif self.pubmed and self.pubmed.issn:
-            return self.pubmed.issn
-        elif self.crossref and self.crossref.issn:
-            return self.crossref.issn
-        elif self.arxiv and self.arxiv.issn:
-            return self.arxiv.issn
-        elif self.repec and self.repec.issn:
-            return self.repec.issn
-        elif self.dblp and self.dblp.issn:
-            return self.dblp.issn
-        elif self.manual and self.manual.issn:
-            return self.manual.issn
-        elif self.gb and self.gb.issn:
-            return self.gb.issn
-        else: return ''
+    title = _preferred('title')
+    presentation_place = _preferred('presentation_place')
+    license = _preferred('license')
+    pubstatus = _preferred('pubstatus')
+    pubnumber = _preferred('pubnumber')
+    report_number = _preferred('report_number')
+    notes = _preferred('notes')
+    conference_start = _preferred('conference_start')
+    conference_end = _preferred('conference_end')
+    conference_name = _preferred('conference_name')
+    conference_place = _preferred('conference_place')
+    acceptance_date = _preferred('acceptance_date')
+    book_title = _preferred('book_title')
+    series = _preferred('series')
+    edition = _preferred('edition')
+    relationship = _preferred('relationship')
+    medium = _preferred('medium')
+    num_chapters = _preferred('num_chapters')
+    pub_place = _preferred('pub_place')
+    pub_url = _preferred('pub_url')
+    isbn10 = _preferred('isbn10')
+    chapter_num = _preferred('chapter_num')
+    isbn13 = _preferred('isbn13')
+    author_url = _preferred('author_url')
+    author_address = _preferred('author_address')
+    confidential = _preferred('confidential')
+    sponsor = _preferred('sponsor')
+    issn = _preferred('issn')
+    abstract = _preferred('abstract')
+    volume = _preferred('volume')
+    issue = _preferred('issue')
+    pubdate = _preferred('pubdate', ':returns: :class: `SympDate`')
+    authors = _preferred('authors', ':returns: list of :class: `SympPeople`')
+    pages = _preferred('pages', ':returns: :class: `SympPages`')
+    publisher = _preferred('publisher')
+    journal = _preferred('journal')
+    doi = _preferred('doi')
+    keywords = _preferred('keywords')
+    report_title = _preferred('report_title')
 
     @property
     def language(self):
@@ -875,301 +375,11 @@ class SympAtom(xmlmap.XmlObject):
         wrapper arond field that chooses that prefered source
          :returns: a tuple containng language code and name
         '''
-        marc_languages_xml = 'http://www.loc.gov/standards/codelists/languages.xml'
-        langs =  xmlmap.load_xmlobject_from_file(marc_languages_xml)
-
-        ns = {'lang':'info:lc/xmlns/codelist-v1'}
-
-        if self.wos and self.wos.language:
-            lang = self.wos.language
-        elif self.scopus and self.scopus.language:
-            lang = self.scopus.language
-        elif self.pubmed and self.pubmed.language:
-            lang = self.pubmed.language
-        elif self.crossref and self.crossref.language:
-            lang = self.crossref.language
-        elif self.arxiv and self.arxiv.language:
-            lang = self.arxiv.language
-        elif self.repec and self.repec.language:
-            lang = self.repec.language
-        elif self.dblp and self.dblp.language:
-            lang = self.dblp.language
-        elif self.manual and self.manual.language:
-            return self.manual.language
-        elif self.gb and self.gb.language:
-            return self.gb.language
-        else: lang = ''
-
-
-        nodes = langs.node.xpath("//lang:language[lang:name='%s' or lang:code='%s']" % (lang, lang), namespaces=ns)
-        if nodes:
-            return (nodes[0].findtext('lang:code', namespaces=ns), nodes[0].findtext('lang:name', namespaces=ns))
-
-        else:
-            return ('', '')
-
-    @property
-    def abstract(self):
-        if self.wos and self.wos.abstract:
-            return self.wos.abstract
-        elif self.scopus and self.scopus.abstract:
-            return self.scopus.abstract
-        elif self.pubmed and self.pubmed.abstract:
-            return self.pubmed.abstract
-        elif self.crossref and self.crossref.abstract:
-            return self.crossref.abstract
-        elif self.arxiv and self.arxiv.abstract:
-            return self.arxiv.abstract
-        elif self.repec and self.repec.abstract:
-            return self.repec.abstract
-        elif self.dblp and self.dblp.abstract:
-            return self.dblp.abstract
-        elif self.manual and self.manual.abstract:
-            return self.manual.abstract
-        elif self.gb and self.gb.abstract:
-            return self.gb.abstract
-        else: return ''
-
-    @property
-    def volume(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.volume:
-            return self.wos.volume
-        elif self.scopus and self.scopus.volume:
-            return self.scopus.volume
-        elif self.pubmed and self.pubmed.volume:
-            return self.pubmed.volume
-        elif self.crossref and self.crossref.volume:
-            return self.crossref.volume
-        elif self.arxiv and self.arxiv.volume:
-            return self.arxiv.volume
-        elif self.repec and self.repec.volume:
-            return self.repec.volume
-        elif self.dblp and self.dblp.volume:
-            return self.dblp.volume
-        elif self.manual and self.manual.volume:
-            return self.manual.volume
-        elif self.gb and self.gb.volume:
-            return self.gb.volume
-        else: return ''
-
-    @property
-    def issue(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.issue:
-            return self.wos.issue
-        elif self.scopus and self.scopus.issue:
-            return self.scopus.issue
-        elif self.pubmed and self.pubmed.issue:
-            return self.pubmed.issue
-        elif self.crossref and self.crossref.issue:
-            return self.crossref.issue
-        elif self.arxiv and self.arxiv.issue:
-            return self.arxiv.issue
-        elif self.repec and self.repec.issue:
-            return self.repec.issue
-        elif self.dblp and self.dblp.issue:
-            return self.dblp.issue
-        elif self.manual and self.manual.issue:
-            return self.manual.issue
-        elif self.gb and self.gb.issue:
-            return self.gb.issue
-        else: return ''
-
-
-    @property
-    def pubdate(self):
-        '''
-        wrapper arond field that chooses that prefered source
-         :returns: :class: `SympDate`
-        '''
-        if self.wos and self.wos.pubdate:
-            return self.wos.pubdate
-        elif self.scopus and self.scopus.pubdate:
-            return self.scopus.pubdate
-        elif self.pubmed and self.pubmed.pubdate:
-            return self.pubmed.pubdate
-        elif self.crossref and self.crossref.pubdate:
-            return self.crossref.pubdate
-        elif self.arxiv and self.arxiv.pubdate:
-            return self.arxiv.pubdate
-        elif self.repec and self.repec.pubdate:
-            return self.repec.pubdate
-        elif self.dblp and self.dblp.pubdate:
-            return self.dblp.pubdate
-        elif self.manual and self.manual.pubdate:
-            return self.manual.pubdate
-        elif self.gb and self.gb.pubdate:
-            return self.gb.pubdate
-        else: return False
-
-    @property
-    def authors(self):
-        '''
-        wrapper arond field that chooses that prefered source
-         :returns: :class: `SympDate`
-        '''
-        if self.wos and self.wos.authors:
-            return self.wos.authors
-        elif self.scopus and self.scopus.authors:
-            return self.scopus.authors
-        elif self.pubmed and self.pubmed.authors:
-            return self.pubmed.authors
-        elif self.crossref and self.crossref.authors:
-            return self.crossref.authors
-        elif self.arxiv and self.arxiv.authors:
-            return self.arxiv.authors
-        elif self.repec and self.repec.authors:
-            return self.repec.authors
-        elif self.dblp and self.dblp.authors:
-            return self.dblp.authors
-        elif self.manual and self.manual.authors:
-            return self.manual.authors
-        elif self.gb and self.gb.authors:
-            return self.gb.authors
-        else: return False
-
-    @property
-    def pages(self):
-        '''
-        wrapper arond field that chooses that prefered source
-        :returns: :class: `SympPages`
-        '''
-        if self.wos and self.wos.pages and self.wos.pages.begin_page:
-            return self.wos.pages
-        elif self.scopus and self.scopus.pages and self.scopus.pages.begin_page:
-            return self.scopus.pages
-        elif self.pubmed and self.pubmed.pages and self.pubmed.pages.begin_page:
-            return self.pubmed.pages
-        elif self.crossref and self.crossref.pages and self.crossref.pages.begin_page:
-            return self.crossref.pages
-        elif self.arxiv and self.arxiv.pages and self.arxiv.pages.begin_page:
-            return self.arxiv.pages
-        elif self.repec and self.repec.pages and self.repec.pages.begin_page:
-            return self.repec.pages
-        elif self.dblp and self.dblp.pages and self.dblp.pages.begin_page:
-            return self.dblp.pages
-        elif self.manual and self.manual.pages:
-            return self.manual.pages
-        elif self.gb and self.gb.pages:
-            return self.gb.pages
-        else: return False
-
-
-    @property
-    def publisher(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.publisher:
-            return self.wos.publisher
-        elif self.scopus and self.scopus.publisher:
-            return self.scopus.publisher
-        elif self.pubmed and self.pubmed.publisher:
-            return self.pubmed.publisher
-        elif self.crossref and self.crossref.publisher:
-            return self.crossref.publisher
-        elif self.arxiv and self.arxiv.publisher:
-            return self.arxiv.publisher
-        elif self.repec and self.repec.publisher:
-            return self.repec.publisher
-        elif self.dblp and self.dblp.publisher:
-            return self.dblp.publisher
-        elif self.manual and self.manual.publisher:
-            return self.manual.publisher
-        elif self.gb and self.gb.publisher:
-            return self.gb.publisher
-        else: return ''
-
-    @property
-    def journal(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.journal:
-            return self.wos.journal
-        elif self.scopus and self.scopus.journal:
-            return self.scopus.journal
-        elif self.pubmed and self.pubmed.journal:
-            return self.pubmed.journal
-        elif self.crossref and self.crossref.journal:
-            return self.crossref.journal
-        elif self.arxiv and self.arxiv.journal:
-            return self.arxiv.journal
-        elif self.repec and self.repec.journal:
-            return self.repec.journal
-        elif self.dblp and self.dblp.journal:
-            return self.dblp.journal
-        elif self.manual and self.manual.journal:
-            return self.manual.journal
-        elif self.gb and self.gb.journal:
-            return self.gb.journal
-        else: return ''
-
-    @property
-    def doi(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.doi:
-            return self.wos.doi
-        elif self.scopus and self.scopus.doi:
-            return self.scopus.doi
-        elif self.pubmed and self.pubmed.doi:
-            return self.pubmed.doi
-        elif self.crossref and self.crossref.doi:
-            return self.crossref.doi
-        elif self.arxiv and self.arxiv.doi:
-            return self.arxiv.doi
-        elif self.repec and self.repec.doi:
-            return self.repec.doi
-        elif self.dblp and self.dblp.doi:
-            return self.dblp.doi
-        elif self.manual and self.manual.doi:
-            return self.manual.doi
-        elif self.gb and self.gb.doi:
-            return self.gb.doi
-        else: return ''
-
-    @property
-    def keywords(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.keywords:
-            return self.wos.keywords
-        elif self.scopus and self.scopus.keywords:
-            return self.scopus.keywords
-        elif self.pubmed and self.pubmed.keywords:
-            return self.pubmed.keywords
-        elif self.crossref and self.crossref.keywords:
-            return self.crossref.keywords
-        elif self.arxiv and self.arxiv.keywords:
-            return self.arxiv.keywords
-        elif self.repec and self.repec.keywords:
-            return self.repec.keywords
-        elif self.dblp and self.dblp.keywords:
-            return self.dblp.keywords
-        elif self.manual and self.manual.keywords:
-            return self.manual.keywords
-        elif self.gb and self.gb.keywords:
-            return self.gb.keywords
-        else: return [] # empty keywords
-
-    @property
-    def report_title(self):
-        '''wrapper arond field that chooses that prefered source'''
-        if self.wos and self.wos.report_title:
-            return self.wos.report_title
-        elif self.scopus and self.scopus.report_title:
-            return self.scopus.report_title
-        elif self.pubmed and self.pubmed.report_title:
-            return self.pubmed.report_title
-        elif self.crossref and self.crossref.report_title:
-            return self.crossref.report_title
-        elif self.arxiv and self.arxiv.report_title:
-            return self.arxiv.report_title
-        elif self.repec and self.repec.report_title:
-            return self.repec.report_title
-        elif self.dblp and self.dblp.report_title:
-            return self.dblp.report_title
-        elif self.manual and self.manual.report_title:
-            return self.manual.report_title
-        elif self.gb and self.gb.report_title:
-            return self.gb.report_title
-        else: return [] # empty keywords
+        lang = self.resolved()['language']
+        # languages from manual entry and google books are returned as-is
+        if self._resolved_from.get('language') in ('manual', 'gb'):
+            return lang
+        return marc_language(lang)
 
     # avaliable sources
     wos = xmlmap.NodeField("atom:entry[pubs:data-source/pubs:source-name='web-of-science']", SympSource)
@@ -15,12 +15,15 @@
 #   limitations under the License.
 
 import sys
+from collections import defaultdict
 from contextlib import contextmanager
 import datetime
 import json
 import logging
 import os
 import sunburnt
+import queue
+import threading
 from slugify import slugify
 from eulfedora.rdfns import model as relsextns
 from cStringIO import StringIO
@@ -46,7 +49,7 @@ from eulfedora.rdfns import relsext, oai
 from eulxml import xmlmap
 from eulxml.xmlmap import mods, premis
 from django_auth_ldap.backend import LDAPBackend as EmoryLDAPBackend
-from mock import patch, Mock, MagicMock
+from mock import patch, Mock, MagicMock, PropertyMock
 from PyPDF2 import PdfFileReader
 from PyPDF2.utils import PdfReadError
 # from pdfminer.pdfparser import PDFParser, PDFDocument
@@ -68,15 +71,20 @@ from openemory.publication.forms import UploadForm, PublicationModsEditForm, \
 from openemory.publication.models import NlmArticle, Publication, PublicationMods,  \
      FundingGroup, AuthorName, AuthorNote, Keyword, FinalVersion, CodeList, \
      ResearchField, ResearchFields, NlmPubDate, NlmLicense, PublicationPremis, \
-     ArticleStatistics, year_quarter, FeaturedArticle, SupplementalMaterial
+     ArticleStatistics, year_quarter, FeaturedArticle, SupplementalMaterial, \
+     IndexFailure
 from openemory.publication.forms import PublicationModsEditForm as amods, ArticleEditForm
 from openemory.publication import views as pubviews
 from openemory.publication.management.commands.quarterly_stats_by_author import Command
 from openemory.rdfns import DC, BIBO, FRBR
 
+from openemory.publication.duplicates import duplicate_keys, find_clusters, \
+     BANDS, DUPLICATE_KEY_FIELD
+from openemory.publication.indexing import index_publications
 from openemory.publication.symp import SympAtom
 
-from openemory.util import pmc_access_url, percent_match, pdf_to_text
+from openemory.util import pmc_access_url, percent_match, pdf_to_text, \
+     index_data_hash, filter_unchanged, INDEX_HASH_FIELD, TitleMatcher
 
 # credentials for shared fixture accounts
 from openemory.accounts.tests import USER_CREDENTIALS
@@ -216,6 +224,29 @@ class NlmArticleTest(TestCase):
         self.assertFalse(mockldapinst.find_user_by_email.called,
              'non-emory email should not be looked up in ldap')
 
+    def test_identifiable_authors_affiliation(self):
+        emory_author = Mock(aff_ids=['A1'], affiliation='Emory University, Atlanta')
+        other_author = Mock(aff_ids=['A2'], affiliation='Georgia Tech')
+        User.objects.filter(username='affiliation').delete()
+        with patch.object(NlmArticle, 'authors', new_callable=PropertyMock) as mockauthors:
+            mockauthors.return_value = [other_author, emory_author]
+            # placeholder user is created when needed
+            authors = self.article.identifiable_authors(refresh=True)
+            self.assertEqual(['affiliation'], [u.username for u in authors])
+            self.assertEqual(1, User.objects.filter(username='affiliation').count())
+
+            # an affiliation user looked up in advance is used without querying
+            affil_user = NlmArticle.get_affiliation_user()
+            with patch('openemory.publication.models.User') as mockuser:
+                self.assertEqual([affil_user], self.article.identifiable_authors(
+                    refresh=True, affiliation_user=affil_user))
+                mockuser.objects.get_or_create.assert_not_called()
+
+            # no emory affiliation - no authors
+            mockauthors.return_value = [other_author]
+            self.assertEqual([], self.article.identifiable_authors(
+                refresh=True, affiliation_user=affil_user))
+
 
     @staticmethod
     def mock_find_by_email(email, derive=False):
@@ -552,6 +583,8 @@ class ArticleTest(TestCase):
                                         affiliation='Nickelodeon'))
         idxdata = self.article_nlm.index_data()
         self.assertEqual(idxdata['title'], amods.title)
+        self.assert_(set(duplicate_keys(amods.title)) <= set(idxdata[DUPLICATE_KEY_FIELD]),
+                     'title duplicate keys should be indexed')
         self.assertEqual(len(amods.funders), len(idxdata['funder']))
         for fg in amods.funders:
             self.assert_(fg.name in idxdata['funder'])
@@ -636,6 +669,22 @@ class ArticleTest(TestCase):
         self.assertEqual('mmouse,dduck,batman', article.owner,
             'article owner should contain all author ids from MODS')
 
+    def test_save_unchanged(self):
+        article = self.repo.get_object(self.article.pid, type=Publication)
+        modified = article.modified
+        # MODS loaded but unchanged: DC is recalculated but nothing is written
+        article.save()
+        self.assertEqual(2, article.skipped_writes)
+        article = self.repo.get_object(self.article.pid, type=Publication)
+        self.assertEqual(modified, article.modified)
+
+        # changed MODS is saved and mapped to DC
+        article.descMetadata.content.title = 'A newly revised title'
+        article.save()
+        self.assertEqual(0, article.skipped_writes)
+        article = self.repo.get_object(self.article.pid, type=Publication)
+        self.assertEqual('A newly revised title', article.dc.content.title)
+
     def test_embargo_end_date(self):
         obj = Publication(Mock())  # mock api
         self.assertEqual(None, obj.embargo_end_date,
@@ -658,6 +707,38 @@ class ArticleTest(TestCase):
         obj.descMetadata.content.embargo_end = lastyear.isoformat()
         self.assertFalse(obj.is_embargoed)
 
+    def test_prefetch(self):
+        article = self.repo.get_object(self.article.pid, type=Publication)
+        article.prefetch('descMetadata', 'dc', 'pdf', 'provenance')
+        # xml content loaded
+        self.assertNotEqual(None, article.descMetadata._content)
+        self.assertEqual(self.article.label, article.descMetadata._content.title)
+        self.assertNotEqual(None, article.dc._content)
+        # only profile loaded for binary datastreams
+        self.assertNotEqual(None, article.pdf._info)
+        self.assertEqual(None, article.pdf._content)
+        # nonexistent datastream is not loaded
+        self.assertFalse(article.provenance.exists)
+        self.assertEqual(None, article.provenance._content)
+
+    def test_datastream_profiles(self):
+        article = self.repo.get_object(self.article.pid, type=Publication)
+        profiles = article.datastream_profiles()
+        self.assertEqual('application/pdf', profiles['content'][0])
+        self.assert_(isinstance(profiles['content'][1], datetime.datetime))
+        self.assertEqual('text/xml', profiles['descMetadata'][0])
+        # result is reused for the same version of the object
+        other = self.repo.get_object(self.article.pid, type=Publication)
+        other.modified
+        with patch.object(article.api, 'get') as mockget:
+            self.assertEqual(profiles, article.datastream_profiles())
+            self.assertEqual(profiles, other.datastream_profiles())
+            mockget.assert_not_called()
+
+        self.assertEqual('content', article.newest_datastream(['application/pdf']))
+        self.assertEqual(None, article.newest_datastream(['image/png']))
+        self.assertEqual('pdf', article.what_mime_type())
+
     def test_pdf_cover(self):
         # add additional metadata to test cover page contents
         amods = self.article.descMetadata.content
@@ -816,6 +897,17 @@ class ArticleTest(TestCase):
         self.assertFalse('xsi' in dc.nsmap)
         self.assertEqual(len(dc.attrib), 0)
 
+    def test_prepare_ingest(self):
+        obj = self.repo.get_object(type=Publication)
+        obj.label = 'A new article'
+        self.assert_('xsi' in obj.dc.content.node.nsmap)
+        obj.prepare_ingest()
+        # pid is minted, DC is OAI-ready, and PREMIS events can be added
+        self.assertFalse(callable(obj.pid))
+        self.assert_('xsi' not in obj.dc.content.node.nsmap)
+        self.assertEqual(obj.pid, obj.provenance.content.object.id)
+        self.assertEqual('pid', obj.provenance.content.object.id_type)
+
     def test_as_symp(self):
         # Add additional fields to article
         self.article.descMetadata.content.create_abstract()
@@ -3887,6 +3979,418 @@ class TestExpireEmbargoCommand(TestCase):
             self.assertTrue('Skipped: 3'in output)
             self.assertTrue('Errors: 0'in output)
 
+class TestIndexChangedCommand(TestCase):
+
+    @patch('openemory.publication.management.commands.index_changed.solr_interface')
+    @patch('openemory.publication.management.commands.index_changed.ManagementRepository')
+    def test_index_changed(self, mockrepo, mocksolr_interface):
+        from openemory.publication.models import LastRun
+        start = datetime.datetime(2016, 1, 1, 12, 0, 0)
+        LastRun.objects.create(name='Index changed objects', start_time=start)
+
+        mockrepo.return_value.risearch.sparql_query.return_value = [
+            {'pid': 'info:fedora/test:1', 'modified': '2016-01-02T17:00:00.000Z'},
+            {'pid': 'info:fedora/test:2', 'modified': '2016-01-03T17:00:00.000Z'},
+        ]
+        mockobj = Mock(spec=Publication)
+        mockobj.exists = True
+        mockobj.author_netids = []
+        mockobj.index_data.return_value = {'pid': 'test:1'}
+        mockrepo.return_value.get_object.return_value = mockobj
+        mocksolr = mocksolr_interface.return_value
+        # not previously indexed, so no partial updates
+        mocksolr.query.return_value.field_limit.return_value.paginate.return_value \
+            .execute.return_value = []
+
+        io = StringIO()
+        call_command('index_changed', verbosity=1, stdout=io)
+        output = io.getvalue()
+        self.assertTrue('Total number selected: 2' in output)
+        self.assertTrue('Indexed: 2' in output)
+        mocksolr.add.assert_called_once_with([{'pid': 'test:1'}, {'pid': 'test:1'}])
+        mocksolr.commit.assert_called_once()
+        # watermark advanced to the newest modification date (Eastern time)
+        self.assertEqual(datetime.datetime(2016, 1, 3, 12, 0, 0),
+                         LastRun.objects.get(name='Index changed objects').start_time)
+
+        # failed objects are recorded for retry; the watermark still advances
+        mockrepo.return_value.get_object.side_effect = Exception('fedora down')
+        io = StringIO()
+        call_command('index_changed', verbosity=1, since='2016-01-01T00:00:00', stdout=io)
+        self.assertTrue('Errors: 2' in io.getvalue())
+        self.assertEqual(datetime.datetime(2016, 1, 3, 12, 0, 0),
+                         LastRun.objects.get(name='Index changed objects').start_time)
+        self.assertEqual([('test:1', 1, 'fedora down'), ('test:2', 1, 'fedora down')],
+                         list(IndexFailure.objects.order_by('pid')
+                                          .values_list('pid', 'attempts', 'error')))
+
+        # failed objects are retried on the next run, even if not modified
+        mockrepo.return_value.risearch.sparql_query.return_value = []
+        call_command('index_changed', verbosity=1, stdout=StringIO())
+        self.assertEqual([2, 2], list(IndexFailure.objects.values_list('attempts', flat=True)))
+
+        # until they are indexed
+        mockrepo.return_value.get_object.side_effect = None
+        mocksolr.add.reset_mock()
+        io = StringIO()
+        call_command('index_changed', verbosity=1, stdout=io)
+        self.assertTrue('Total number selected: 2' in io.getvalue())
+        mocksolr.add.assert_called_once_with([{'pid': 'test:1'}, {'pid': 'test:1'}])
+        self.assertFalse(IndexFailure.objects.exists())
+
+        # or have failed too many times
+        IndexFailure.objects.create(pid='test:3', attempts=IndexFailure.MAX_ATTEMPTS)
+        io = StringIO()
+        call_command('index_changed', verbosity=1, stdout=io)
+        self.assertTrue('Total number selected: 0' in io.getvalue())
+
+    @patch('openemory.publication.management.commands.index_changed.solr_atomic_update')
+    @patch('openemory.publication.management.commands.index_changed.solr_interface')
+    @patch('openemory.publication.management.commands.index_changed.ManagementRepository')
+    def test_index_changed_partial(self, mockrepo, mocksolr_interface, mockatomic):
+        mockrisearch = mockrepo.return_value.risearch
+        mockrisearch.sparql_query.side_effect = [
+            # changed objects
+            [{'pid': 'info:fedora/test:1', 'modified': '2016-01-02T17:00:00.000Z'}],
+            # datastream modification dates; only provenance changed since indexing
+            [{'pid': 'info:fedora/test:1', 'ds': 'info:fedora/test:1/descMetadata',
+              'modified': '2015-12-01T17:00:00.000Z'},
+             {'pid': 'info:fedora/test:1', 'ds': 'info:fedora/test:1/provenanceMetadata',
+              'modified': '2016-01-02T17:00:00.000Z'}],
+        ]
+        mocksolr = mocksolr_interface.return_value
+        mocksolr.query.return_value.field_limit.return_value.paginate.return_value \
+            .execute.return_value = [{'pid': 'test:1',
+                                      'last_modified': '2015-12-01T17:00:00.000Z'}]
+        mockobj = Mock(spec=Publication)
+        mockobj.pid = 'test:1'
+        mockobj.exists = True
+        mockobj.partial_index_data.return_value = {'id': 'pid: test:1', 'state': 'I'}
+        mockrepo.return_value.get_object.return_value = mockobj
+
+        io = StringIO()
+        call_command('index_changed', verbosity=1, since='2016-01-01T00:00:00', stdout=io)
+        self.assertTrue('Partial updates: 1' in io.getvalue())
+        mockatomic.assert_called_once_with([{'id': 'pid: test:1', 'state': 'I'}])
+        self.assertEqual(0, mockobj.index_data.call_count,
+                         'full index data should not be generated for a partial update')
+        mocksolr.add.assert_not_called()
+
+    def test_partial_index_data(self):
+        obj = Publication(Mock(), pid='test:1')
+        modified = datetime.datetime(2016, 1, 2, 17, 0, 0)
+        props = {'state': 'A', 'modified': modified, 'owners': ['jsmith', 'jdoe'],
+                 'label': 'Changed label', 'is_withdrawn': False}
+        with patch.multiple(Publication, **dict((k, PropertyMock(return_value=v))
+                                                for k, v in props.items())):
+            with patch.object(Publication, 'descMetadata', new_callable=PropertyMock) as mockmods:
+                with patch.object(Publication, 'provenance', new_callable=PropertyMock) as mockprov:
+                    mockmods.return_value.content.embargo_end = None
+                    mockprov.return_value.exists = False
+                    data = obj.partial_index_data()
+        # object properties that change without touching a datastream are included
+        self.assertEqual(['jsmith', 'jdoe'], data['owner'])
+        self.assertEqual('Changed label', data['label'])
+        self.assertEqual('A', data['state'])
+        self.assertEqual(modified, data['last_modified'])
+        self.assertEqual(None, data['review_date'])
+        self.assertEqual(set(Publication.PARTIAL_INDEX_FIELDS) | set(['id']), set(data.keys()))
+
+
+class IndexPublicationsTest(TestCase):
+
+    def mock_publication(self, pid, index_data=None):
+        obj = Mock(spec=Publication)
+        obj.pid = pid
+        obj.exists = True
+        obj.author_netids = []
+        obj.index_data.return_value = index_data or {'pid': pid}
+        return obj
+
+    @patch.object(Publication, 'prefetch_author_esd')
+    def test_index_publications(self, mockprefetch):
+        objects = {
+            'test:1': self.mock_publication('test:1'),
+            'test:2': self.mock_publication('test:2'),
+            'test:3': self.mock_publication('test:3'),
+            'test:4': self.mock_publication('test:4'),
+        }
+        # test:2 can't be loaded; test:3 fails generating index data
+        objects['test:3'].index_data.side_effect = Exception('pdf error')
+        missing = self.mock_publication('test:5')
+        missing.exists = False
+        objects['test:5'] = missing
+
+        def get_object(pid, type=None):
+            if pid == 'test:2':
+                raise Exception('fedora error')
+            return objects[pid]
+        mockrepo = Mock()
+        mockrepo.get_object.side_effect = get_object
+        mocksolr = Mock()
+
+        counts = index_publications(['test:1', 'test:2', 'test:3', 'test:4', 'test:5'],
+                                    mockrepo, mocksolr, chunk_size=3, workers=2,
+                                    skip_unchanged=False)
+        self.assertEqual(2, counts['errors'])
+        self.assertEqual(1, counts['skipped'])
+        self.assertEqual(2, counts['indexed'])
+        # errors don't keep the rest of the chunk from being indexed;
+        # one add per chunk
+        self.assertEqual([[{'pid': 'test:1'}], [{'pid': 'test:4'}]],
+                         [args[0] for args, kwargs in mocksolr.add.call_args_list])
+        # author data is prefetched once per chunk, for loaded objects only
+        self.assertEqual(2, mockprefetch.call_count)
+        self.assertEqual([objects['test:1'], objects['test:3']],
+                         mockprefetch.call_args_list[0][0][0])
+
+    @patch.object(Publication, 'prefetch_author_esd')
+    def test_index_publications_unchanged(self, mockprefetch):
+        objects = dict((pid, self.mock_publication(pid, {'pid': pid, INDEX_HASH_FIELD: 'hash-%s' % pid}))
+                       for pid in ['test:1', 'test:2'])
+        mockrepo = Mock()
+        mockrepo.get_object.side_effect = lambda pid, type=None: objects[pid]
+        mocksolr = Mock()
+        # test:1 is indexed with the same hash; test:2 has changed
+        mocksolr.query.return_value.field_limit.return_value.paginate.return_value \
+            .execute.return_value = [{'pid': 'test:1', INDEX_HASH_FIELD: 'hash-test:1'},
+                                     {'pid': 'test:2', INDEX_HASH_FIELD: 'old'}]
+
+        counts = index_publications(['test:1', 'test:2'], mockrepo, mocksolr)
+        self.assertEqual(1, counts['unchanged'])
+        self.assertEqual(1, counts['indexed'])
+        mocksolr.add.assert_called_once_with([{'pid': 'test:2', INDEX_HASH_FIELD: 'hash-test:2'}])
+
+        # nothing changed: nothing is sent
+        mocksolr.reset_mock()
+        mocksolr.query.return_value.field_limit.return_value.paginate.return_value \
+            .execute.return_value = [{'pid': 'test:1', INDEX_HASH_FIELD: 'hash-test:1'}]
+        counts = index_publications(['test:1'], mockrepo, mocksolr)
+        self.assertEqual(1, counts['unchanged'])
+        mocksolr.add.assert_not_called()
+
+
+class TestImportFromSymplecticCommand(TestCase):
+
+    def test_copy_content(self):
+        from openemory.publication.management.commands import import_from_symplectic
+        cmd = import_from_symplectic.Command()
+        cmd.repo = Mock(fedora_root='http://fedora.host/fedora/')
+        obj = Mock(pid='test:1')
+        api = cmd.repo.api
+        api.addDatastream.return_value = Mock(status_code=201)
+
+        # stream mode: content is streamed into an upload, not loaded
+        cmd.options = {'copy_mode': 'stream'}
+        response = api.getDatastreamDissemination.return_value
+        response.headers = {'Content-Length': '1024'}
+        api.upload.return_value = 'uploaded://1'
+        cmd.copy_content(obj, 'file.pdf', 'application/pdf')
+        api.getDatastreamDissemination.assert_called_with('test:1', 'file.pdf', stream=True)
+        self.assertEqual(1024, api.upload.call_args[1]['size'])
+        self.assertEqual('uploaded://1', api.addDatastream.call_args[1]['dsLocation'])
+        obj.getDatastreamObject.assert_not_called()
+        response.close.assert_called_once_with()
+
+        # dissemination response is closed when the upload fails
+        response.reset_mock()
+        api.upload.side_effect = Exception('upload failed')
+        self.assertRaises(Exception, cmd.copy_content, obj, 'file.pdf', 'application/pdf')
+        response.close.assert_called_once_with()
+        api.upload.side_effect = None
+
+        # reference mode: fedora copies content from its own api
+        cmd.options = {'copy_mode': 'reference'}
+        api.reset_mock()
+        cmd.copy_content(obj, 'file.pdf', 'application/pdf')
+        self.assertEqual('http://local.fedora.server/fedora/objects/test:1/datastreams/file.pdf/content',
+                         api.addDatastream.call_args[1]['dsLocation'])
+        self.assertEqual('content', api.addDatastream.call_args[1]['dsID'])
+        api.getDatastreamDissemination.assert_not_called()
+
+    def test_process_pid_errors(self):
+        from openemory.publication.management.commands import import_from_symplectic
+        cmd = import_from_symplectic.Command()
+        cmd.options = {'force': False, 'noact': True}
+        cmd.counts = defaultdict(int)
+        cmd.errors = {}
+        cmd.duplicates = {}
+        cmd.lock = threading.Lock()
+        cmd.repo = Mock()
+        missing = Mock(exists=False)
+        cmd.repo.get_object.side_effect = [Exception('Fedora error'), missing]
+
+        # an error on one object is recorded without stopping the next
+        cmd.process_pid('test:1', '2016-01-01T00:00:00')
+        cmd.process_pid('test:2', '2016-01-01T00:00:00')
+        self.assertEqual(1, cmd.counts['errors'])
+        self.assertEqual({'test:1': 'Fedora error'}, cmd.errors)
+
+    def test_find_pids(self):
+        from openemory.publication.management.commands import import_from_symplectic
+        cmd = import_from_symplectic.Command()
+        cmd.repo = Mock()
+        sparql = cmd.repo.risearch.sparql_query
+        sparql.side_effect = [
+            [{'pid': 'info:fedora/test:1', 'created': '2016-01-01T00:00:01.000Z'},
+             {'pid': 'info:fedora/test:2', 'created': '2016-01-01T00:00:02.000Z'}],
+            # next page starts at the last date seen, so test:2 is repeated
+            [{'pid': 'info:fedora/test:2', 'created': '2016-01-01T00:00:02.000Z'},
+             {'pid': 'info:fedora/test:3', 'created': '2016-01-01T00:00:03.000Z'}],
+            [{'pid': 'info:fedora/test:3', 'created': '2016-01-01T00:00:03.000Z'}],
+        ]
+        pids = cmd.find_pids('2016-01-01T00:00:00', 2)
+        self.assertEqual(['info:fedora/test:1', 'info:fedora/test:2', 'info:fedora/test:3'], pids)
+        self.assertEqual(3, sparql.call_count)
+        query = sparql.call_args_list[0][0][0]
+        # matched on the indexed dissemination type, not a regex
+        self.assertIn('<info:fedora/*/SYMPLECTIC-ATOM>', query)
+        self.assertNotIn('regex', query)
+        self.assertIn("xsd:dateTime('2016-01-01T00:00:00Z')", query)
+        self.assertEqual(2, sparql.call_args_list[0][1]['limit'])
+        self.assertIn("xsd:dateTime('2016-01-01T00:00:02.000Z')", sparql.call_args_list[1][0][0])
+
+
+class ViewArticleObjectsTest(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+        self.request = RequestFactory().get('/publications/test:1/')
+        self.request.user = AnonymousUser()
+        self.obj = Mock(spec=Publication, pidspace='test', owner='owner',
+                        exists=True, modified=datetime.datetime(2016, 1, 1))
+
+    @patch('openemory.publication.views.render')
+    @patch('openemory.publication.views.ManagementRepository')
+    @patch('openemory.publication.views.Repository')
+    def test_view_article(self, mockrepo, mockmgmt, mockrender):
+        from openemory.publication import views as pubviews
+        mockrender.return_value = HttpResponse()
+        mockrepo.return_value = Mock(username='guest')
+        mockrepo.return_value.get_object.return_value = self.obj
+        mockmgmt.return_value = Mock(username='fedoraAdmin')
+        mockmgmt.return_value.get_object.return_value = self.obj
+
+        pubviews.view_article(self.request, 'test:1')
+        # last-modified check and the view share one object per repository
+        mockrepo.return_value.get_object.assert_called_once_with(pid='test:1', type=Publication)
+        self.assertTrue(mockmgmt.return_value.get_object.call_count <= 1)
+
+    @patch('openemory.publication.views.ManagementRepository')
+    @patch('openemory.publication.views.Repository')
+    def test_view_article_pidspace_redirect(self, mockrepo, mockmgmt):
+        from openemory.publication import views as pubviews
+        self.obj.pidspace = 'openemory'
+        mockrepo.return_value = Mock(username='guest')
+        mockrepo.return_value.get_object.return_value = self.obj
+        mockmgmt.return_value = Mock(username='fedoraAdmin')
+        mockmgmt.return_value.get_object.return_value = Mock(exists=True)
+
+        with self.settings(FEDORA_PIDSPACE='test'):
+            response = pubviews.view_article(self.request, 'openemory:1')
+        self.assertEqual(301, response.status_code)
+        mockrepo.return_value.get_object.assert_called_once_with(pid='openemory:1', type=Publication)
+        mockmgmt.return_value.get_object.assert_called_once_with(pid='test:1', type=Publication)
+
+
+class TestImportToSymplecticCommand(TestCase):
+
+    def setUp(self):
+        from openemory.publication.management.commands import import_to_symplectic
+        self.cmd = import_to_symplectic.Command()
+        self.cmd.options = {'retries': 2, 'noact': False}
+        self.cmd.verbosity = 0
+        self.cmd.counts = defaultdict(int)
+        self.cmd.lock = threading.Lock()
+        self.cmd.rate = 0
+        self.cmd.session = Mock()
+
+    @patch('openemory.publication.management.commands.import_to_symplectic.sleep')
+    def test_send_retries(self, mocksleep):
+        busy = Mock(status_code=429, headers={'Retry-After': '5'})
+        error = Mock(status_code=503, headers={})
+        ok = Mock(status_code=200)
+        self.cmd.session.request.side_effect = [busy, error, ok]
+        response = self.cmd.send('PUT', 'http://elements/publication', '<xml/>')
+        self.assertEqual(ok, response)
+        self.assertEqual(2, self.cmd.counts['retries'])
+        # Retry-After is honored, otherwise exponential backoff
+        self.assertEqual([5, 2], [args[0] for args, kwargs in mocksleep.call_args_list])
+
+        # last response is returned once retries are used up
+        mocksleep.reset_mock()
+        self.cmd.session.request.side_effect = [error, error, error]
+        self.assertEqual(error, self.cmd.send('PUT', 'http://elements/publication', '<xml/>'))
+        self.assertEqual(2, mocksleep.call_count)
+
+    @patch('openemory.publication.management.commands.import_to_symplectic.sleep')
+    def test_send_post_connection_errors(self, mocksleep):
+        import requests
+        from requests.packages.urllib3.exceptions import ConnectTimeoutError
+        ok = Mock(status_code=200)
+        # connection could not be made, so the request was not sent: retried
+        refused = requests.exceptions.ConnectionError(ConnectTimeoutError('refused'))
+        self.cmd.session.request.side_effect = [refused, ok]
+        self.assertEqual(ok, self.cmd.send('POST', 'http://elements/relationships', '<xml/>'))
+        self.assertEqual(1, self.cmd.counts['retries'])
+
+        # connection dropped after the request may have been sent: not retried,
+        # so that relationships are not created twice
+        self.cmd.session.request.reset_mock()
+        aborted = requests.exceptions.ConnectionError('Connection aborted.')
+        self.cmd.session.request.side_effect = [aborted, ok]
+        self.assertRaises(requests.exceptions.ConnectionError, self.cmd.send,
+                          'POST', 'http://elements/relationships', '<xml/>')
+        self.assertEqual(1, self.cmd.session.request.call_count)
+        # but a PUT can safely be repeated
+        self.cmd.session.request.side_effect = [aborted, ok]
+        self.assertEqual(ok, self.cmd.send('PUT', 'http://elements/publication', '<xml/>'))
+
+        # server errors may come after the relationship was created: not retried
+        self.cmd.session.request.reset_mock()
+        error = Mock(status_code=502, headers={})
+        self.cmd.session.request.side_effect = [error, ok]
+        self.assertEqual(error, self.cmd.send('POST', 'http://elements/relationships', '<xml/>'))
+        self.assertEqual(1, self.cmd.session.request.call_count)
+        # but busy or unavailable responses are
+        busy = Mock(status_code=503, headers={})
+        self.cmd.session.request.side_effect = [busy, ok]
+        self.assertEqual(ok, self.cmd.send('POST', 'http://elements/relationships', '<xml/>'))
+
+    def test_produce_resume(self):
+        payloads = queue.Queue()
+        done_article = Mock(pid='test:1')
+        new_article = Mock(pid='test:2')
+        new_article.as_symp.return_value = ('pub', ['rel'])
+        self.cmd.produce([done_article, new_article], set(['test:1']), payloads)
+        done_article.as_symp.assert_not_called()
+        self.assertEqual(('test:2', 'pub', ['rel']), payloads.get_nowait())
+        self.assertEqual(1, self.cmd.counts['resumed'])
+
+    def test_process_relations(self):
+        self.cmd.relation_create_url = 'http://elements/relationships'
+        relations = [Mock(), Mock()]
+        for r in relations:
+            r.is_valid.return_value = True
+            r.serialize.return_value = b'<relation/>'
+        failed = Mock(status_code=400)
+        ok = Mock(status_code=200)
+        ok.raw.read.return_value = '<api:import-record xmlns:api="http://www.symplectic.co.uk/publications/api"/>'
+        # an earlier relation failing is an error, even if the last one succeeds
+        with patch.object(self.cmd, 'send', side_effect=[failed, ok]):
+            self.assertFalse(self.cmd.process_relations('test:1', relations, self.cmd.options))
+        self.assertEqual(1, self.cmd.counts['errors'])
+        self.assertEqual(0, self.cmd.counts['relations_processed'])
+
+        with patch.object(self.cmd, 'send', side_effect=[ok, ok]):
+            self.assertTrue(self.cmd.process_relations('test:1', relations, self.cmd.options))
+        self.assertEqual(1, self.cmd.counts['relations_processed'])
+        # every response is closed, so connections go back to the pool
+        failed.close.assert_called_once_with()
+        self.assertEqual(3, ok.close.call_count)
+
+
 class ArticleModsForm(TestCase):
     fixtures = ['test-license']
 
@@ -3974,6 +4478,91 @@ class TestUtil(TestCase):
         success, percent = percent_match(str1, str2, 50)
         self.assertFalse(success)
 
+    def test_title_matcher(self):
+        titles = ['This is a string that should match',
+                  'This is a string that should match!!',
+                  'This is a strng that shuld match',
+                  'This one',
+                  'Something else entirely, with a much longer title than the others']
+        matcher = TitleMatcher(titles)
+        query = 'this is a STRING that should match'
+        for percent in (10, 50, 80, 90, 100):
+            expected = [(t, percent_match(query, t, percent)[1]) for t in titles
+                        if percent_match(query, t, percent)[0]]
+            self.assertEqual(expected, matcher.matches(query, percent),
+                             'matches should be the same as percent_match at %s%%' % percent)
+
+        self.assertEqual((titles[0], 100.0), matcher.best_match(query, 90))
+        self.assertEqual(None, matcher.best_match('no match here', 90))
+        # empty titles don't match instead of dividing by zero
+        self.assertEqual([], TitleMatcher(['!!']).matches('', 0))
+
+    def test_index_data_hash(self):
+        data = {'pid': 'test:1', 'title': 'A title', 'creator': ['Smith, J']}
+        same = {'creator': ['Smith, J'], 'title': 'A title', 'pid': 'test:1',
+                'abstract': None}
+        self.assertEqual(index_data_hash(data), index_data_hash(same),
+                         'hash should ignore key order and empty values')
+        data[INDEX_HASH_FIELD] = index_data_hash(data)
+        self.assertEqual(data[INDEX_HASH_FIELD], index_data_hash(data),
+                         'hash should ignore the hash field itself')
+        self.assertNotEqual(data[INDEX_HASH_FIELD],
+                            index_data_hash(dict(data, title='Another title')))
+
+    def test_filter_unchanged(self):
+        unchanged = {'pid': 'test:1', INDEX_HASH_FIELD: 'abc'}
+        changed = {'pid': 'test:2', INDEX_HASH_FIELD: 'def'}
+        new = {'pid': 'test:3', INDEX_HASH_FIELD: '123'}
+        mocksolr = MagicMock()
+        mocksolr.query.return_value.field_limit.return_value.paginate.return_value \
+            .execute.return_value = [{'pid': 'test:1', INDEX_HASH_FIELD: 'abc'},
+                                     {'pid': 'test:2', INDEX_HASH_FIELD: 'old'}]
+        docs, skipped = filter_unchanged(mocksolr, [unchanged, changed, new])
+        self.assertEqual([changed, new], docs)
+        self.assertEqual(1, skipped)
+
+
+class DuplicatesTest(TestCase):
+    title = 'Recombinant TLR5 Agonist CBLB502 Promotes NK Cell-Mediated Anti-CMV Immunity in Mice'
+
+    def test_duplicate_keys(self):
+        keys = duplicate_keys(self.title, 'doi:10.1371/Journal.pone.0096165', '4040')
+        self.assertIn('doi:10.1371/journal.pone.0096165', keys)
+        self.assertIn('pmc:4040', keys)
+        self.assertEqual(BANDS + 2, len(keys))
+        # keys are stable and ignore case and punctuation
+        self.assertEqual(keys, duplicate_keys(self.title.lower().replace('-', ' '),
+                                              'http://dx.doi.org/10.1371/journal.pone.0096165', '4040'))
+        self.assertEqual([], duplicate_keys(''))
+
+    def test_find_clusters(self):
+        similar = self.title.replace('Mice', 'Mouse')
+        docs = [
+            {'pid': 'test:1', 'title': self.title, DUPLICATE_KEY_FIELD: duplicate_keys(self.title)},
+            {'pid': 'test:2', 'title': similar, DUPLICATE_KEY_FIELD: duplicate_keys(similar)},
+            {'pid': 'test:3', 'title': 'A different article',
+             DUPLICATE_KEY_FIELD: duplicate_keys('A different article', doi='10.1/abc')},
+            {'pid': 'test:4', 'title': 'Another different article',
+             DUPLICATE_KEY_FIELD: duplicate_keys('Another different article', doi='doi:10.1/ABC')},
+            {'pid': 'test:5', 'title': 'Unrelated', DUPLICATE_KEY_FIELD: duplicate_keys('Unrelated')},
+        ]
+        clusters, ignored = find_clusters(docs)
+        self.assertEqual(2, len(clusters))
+        self.assertEqual(['test:1', 'test:2'], clusters[0]['pids'])
+        self.assertEqual(set(['title']), clusters[0]['reasons'])
+        self.assertEqual(['test:3', 'test:4'], clusters[1]['pids'])
+        self.assertIn('doi', clusters[1]['reasons'])
+        self.assertEqual(0, ignored)
+
+        # titles below the similarity threshold are not clustered
+        clusters, ignored = find_clusters(docs[:2], threshold=0.99)
+        self.assertEqual([], clusters)
+
+        # keys shared by too many publications are ignored
+        clusters, ignored = find_clusters(docs[2:4], max_bucket=1)
+        self.assertEqual([], clusters)
+        self.assertEqual(1, ignored)
+
 
 class TestSympDS(TestCase):
 
@@ -4027,3 +4616,24 @@ class TestSympDS(TestCase):
         self.assertEqual(self.sympAtom.journal, 'PLOS ONE')
         self.assertEqual(self.sympAtom.doi, '10.1371/journal.pone.0096165')
         self.assertEqual(self.sympAtom.keywords[0], 'Science & Technology')
+
+    def test_resolved(self):
+        resolved = self.sympAtom.resolved()
+        # values come from the first source in precedence order that has one
+        self.assertEqual(self.sympAtom.wos.title, resolved['title'])
+        self.assertEqual(self.sympAtom.pubmed.abstract, resolved['abstract'])
+        # wos pagination has no start page, so pubmed pages are preferred
+        self.assertEqual('e96165', resolved['pages'].begin_page)
+        # defaults when no source provides a value
+        self.assertEqual('', resolved['isbn13'])
+        self.assertEqual([], resolved['report_title'])
+
+        # feed is only walked once, no matter how many properties are accessed
+        with patch.object(SympAtom, '_resolve', autospec=True,
+                          side_effect=SympAtom._resolve) as mockresolve:
+            atom = xmlmap.load_xmlobject_from_string(self.sympAtom.serialize(), xmlclass=SympAtom)
+            atom.title
+            atom.doi
+            atom.pages
+            atom.keywords
+            self.assertEqual(1, mockresolve.call_count)
@@ -44,14 +44,13 @@ from eulcommon.djangoextras.http import HttpResponseSeeOtherRedirect
 from eulcommon.searchutil import search_terms
 from eulfedora.models import DigitalObjectSaveFailure
 from eulfedora.rdfns import relsext, oai
-from eulfedora.server import Repository
 from eulfedora.util import RequestFailed, PermissionDenied
 from eulfedora.views import raw_datastream, raw_audit_trail
 from PyPDF2.utils import PdfReadError
 from sunburnt import *
 from django.template import Context
 from django.core.mail import EmailMultiAlternatives
-from openemory.common.fedora import ManagementRepository
+from openemory.common.fedora import Repository, ManagementRepository, request_object
 from openemory.accounts.auth import login_required, permission_required
 from openemory.common import romeo
 from openemory.harvest.models import HarvestRecord
@@ -122,8 +121,6 @@ def ingest(request):
             # which system is being referenced.  Will likely have to
             # add to the Harvest record model.
 
-            # TODO: Update so premis events are included on object
-            # ingest, rather than requiring a secondary save?
             if 'pmcid' not in request.POST or not request.POST['pmcid']:
                 return HttpResponseBadRequest('No record specified for ingest',
                                               content_type='text/plain')
@@ -148,25 +145,17 @@ def ingest(request):
                 # Add to OpenEmory Collection
                 obj.collection = coll
 
+                # clean up DC for OAI and add harvested premis event
+                # so the object is ingested complete in a single save
+                obj.prepare_ingest()
+                obj.provenance.content.harvested(request.user, record.pmcid)
 
                 saved = obj.save('Ingest from harvested record PubMed Central %d' % \
                                  record.pmcid)
-                # Modify DC namespaces for OAI
-                obj._prep_dc_for_oai()
-                saved = obj.save('Modified Namespaces for DC')
-                # saved = True
                 if saved:
-
-
                     # mark the database record as ingested
                     record.mark_ingested()
 
-                    #add harvested premis event
-                    obj.provenance.content.init_object(obj.pid, 'pid')
-                    if not obj.provenance.content.harvest_event:
-                        obj.provenance.content.harvested(request.user, record.pmcid)
-                        obj.save('added harvested event')
-
                     # return a 201 Created with new location
                     response = HttpResponse('Ingested as %s' % obj.pid,
                                             content_type='text/plain',
@@ -249,10 +238,30 @@ def ingest(request):
 
 
                 try:
+                    # clean up DC for OAI and add uploaded premis event
+                    # so the object is ingested complete in a single save
+                    obj.prepare_ingest()
+
+                    # LEGAL NOTE: Legal counsel recommends what we
+                    # require assent to deposit before processing
+                    # file upload. We do this by making the assent
+                    # field required in the form. Thus assent here
+                    # should always be True. We're leaving this
+                    # check in place in case current or future code
+                    # error accidentally changes that precondition.
+                    #
+                    # For the statement that the user agreed to, we
+                    # check the form. The admin form has a required
+                    # legal_statement that specifies this. The
+                    # regular admin form has no such field: It only
+                    # presents the author option.
+                    assent = form.cleaned_data.get('assent', False)
+                    statement = (form.cleaned_data.get('legal_statement', 'AUTHOR')
+                                 if assent else None)
+                    obj.provenance.content.uploaded(request.user,
+                            legal_statement=statement)
+
                     saved = obj.save('upload via OpenEmory')
-                    # Modify DC namespaces for OAI
-                    obj._prep_dc_for_oai()
-                    saved = obj.save('Modified Namespaces for DC')
 
                     if saved:
                         messages.success(request,
@@ -263,31 +272,6 @@ def ingest(request):
                         query_string =  urlencode({'category': 'ingest'})
                         final_url = '{}?{}'.format(next_url, query_string)
 
-                        #add uploaded premis event
-                        obj.provenance.content.init_object(obj.pid, 'pid')
-                        
-                        if not obj.provenance.content.upload_event:
-                            # LEGAL NOTE: Legal counsel recommends what we
-                            # require assent to deposit before processing
-                            # file upload. We do this by making the assent
-                            # field required in the form. Thus assent here
-                            # should always be True. We're leaving this
-                            # check in place in case current or future code
-                            # error accidentally changes that precondition.
-                            #
-                            # For the statement that the user agreed to, we
-                            # check the form. The admin form has a required
-                            # legal_statement that specifies this. The
-                            # regular admin form has no such field: It only
-                            # presents the author option.
-                            assent = form.cleaned_data.get('assent', False)
-                            statement = (form.cleaned_data.get('legal_statement', 'AUTHOR')
-                                         if assent else None)
-
-                            obj.provenance.content.uploaded(request.user,
-                                    legal_statement=statement)
-                            obj.save('added upload event')
-
                         return HttpResponseSeeOtherRedirect(final_url)
                 except RequestFailed as rf:
                     context['error'] = rf
@@ -310,8 +294,9 @@ def object_last_modified(request, pid):
     :meth:`django.views.decorators.last_modified`.'''
     # TODO: does this make sense to put in eulfedora?
     try:
+        # load as a Publication so the view can reuse the same object
         repo = Repository(request=request)
-        return repo.get_object(pid=pid).modified
+        return request_object(request, repo, pid, type=Publication).modified
     except RequestFailed:
         pass
 
@@ -322,11 +307,11 @@ def _get_article_for_request(request, pid, category='edit'):
             repo = ManagementRepository()
         else:
             repo = Repository(request=request)
-        obj = repo.get_object(pid=pid, type=Publication)
+        obj = request_object(request, repo, pid, type=Publication)
 
         if request.user.username in obj.owner:
             repo = ManagementRepository()
-            obj = repo.get_object(pid=pid, type=Publication)
+            obj = request_object(request, repo, pid, type=Publication)
 
 
         # TODO: if object is not published (i.e. status != 'A'),
@@ -397,10 +382,10 @@ def view_article(request, pid):
     """View to display an
     :class:`~openemory.publication.models.Article` .
     """
-    repo = Repository(username='fedoraAdmin',
-                                     password='fedoraAdmin')
-    obj = repo.get_object(pid=pid, type=Publication)
-    
+    # same repository as object_last_modified, so the object is shared
+    repo = Repository(request=request)
+    obj = request_object(request, repo, pid, type=Publication)
+
     # *** SPECIAL CASE (should be semi-temporary)
     # (Added 12/2012; can be removed once openemory:* pids are no longer
     # indexed, possibly after a few months.)
@@ -410,12 +395,14 @@ def view_article(request, pid):
     # existing object.  Otherwise, 404 as usual.
     if obj.pidspace == 'openemory':
         realpid = pid.replace('openemory', settings.FEDORA_PIDSPACE)
-        obj = repo.get_object(pid=realpid, type=Publication)
+        obj = request_object(request, ManagementRepository(), realpid, type=Publication)
         if obj.exists:
             return HttpResponsePermanentRedirect(reverse('publication:view',
                 kwargs={'pid': realpid}))
 
     obj = _get_article_for_request(request, pid)
+    # load the datastreams used by the template in parallel
+    obj.prefetch('descMetadata', 'provenance', 'dc')
 
     # only increment stats on GET requests (i.e., not on HEAD)
     if request.method == 'GET':
@@ -446,6 +433,9 @@ def edit_metadata(request, pid):
         tpl = get_template('403.html')
         return HttpResponseForbidden(tpl.render(RequestContext(request)))
 
+    # load the datastreams used by the edit form in parallel
+    obj.prefetch('descMetadata', 'provenance', 'rels_ext')
+
     # initial form data
     initial_data = {
         'reviewed': bool(obj.provenance.exists and \
@@ -789,6 +779,7 @@ def bibliographic_metadata(request, pid):
     to support other formats in the future.'''
 
     article = _get_article_for_request(request, pid)
+    article.prefetch('descMetadata')
     return _article_as_ris(article, request)
 
 def _article_as_ris(obj, request):
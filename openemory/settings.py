@@ -110,6 +110,7 @@ MIDDLEWARE = (
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'openemory.common.middleware.FedoraApiCallMiddleware',
     # flatpages middleware should always be last (fallback for 404)
     'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware',
 )
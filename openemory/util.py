@@ -21,7 +21,10 @@ Common utility methods used elsewhere in the site.
 
 import hashlib
 import httplib2
+import json
 import magic
+import pytz
+import requests
 from django.conf import settings
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 import sunburnt
@@ -110,6 +113,102 @@ def solr_interface():
 
 
 
+#: Solr field used to store a hash of the indexed payload
+INDEX_HASH_FIELD = 'index_hash'
+
+
+def index_data_hash(data):
+    '''Calculate a content hash for a dictionary of Solr index data
+    (as returned by an ``index_data`` method), so that a document
+    that is unchanged from the version already in Solr can be
+    detected without sending it.  The data is normalized by
+    serializing with sorted keys; the hash field itself is ignored.
+
+    :param data: dictionary of index data
+    :returns: hex-digest formatted SHA-1 hash as a string
+    '''
+    normalized = dict((k, v) for k, v in data.items()
+                      if k != INDEX_HASH_FIELD and v is not None)
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def filter_unchanged(solr, docs):
+    '''Given a list of index data dictionaries with pid and
+    :data:`INDEX_HASH_FIELD` set, query Solr once for the hashes of
+    the currently indexed versions and return only the documents that
+    have changed, so that unchanged documents can be skipped instead
+    of being re-added.
+
+    :param solr: :class:`sunburnt.SolrInterface`
+    :param docs: list of index data dictionaries
+    :returns: tuple of list of changed documents and number of
+        unchanged documents skipped
+    '''
+    hashed = [d for d in docs if d.get(INDEX_HASH_FIELD) and d.get('pid')]
+    if not hashed:
+        return docs, 0
+
+    pidfilter = None
+    for d in hashed:
+        if pidfilter is None:
+            pidfilter = solr.Q(pid=d['pid'])
+        else:
+            pidfilter |= solr.Q(pid=d['pid'])
+    results = solr.query(pidfilter).field_limit(['pid', INDEX_HASH_FIELD]) \
+                  .paginate(rows=len(hashed)).execute()
+    indexed = dict((r['pid'], r.get(INDEX_HASH_FIELD, None)) for r in results)
+
+    changed = [d for d in docs
+               if not d.get(INDEX_HASH_FIELD) or \
+               indexed.get(d.get('pid'), None) != d[INDEX_HASH_FIELD]]
+    return changed, len(docs) - len(changed)
+
+
+def solr_atomic_update(docs):
+    '''Send Solr atomic (partial) updates, setting only the fields
+    included in each document and leaving all other stored fields as
+    they are.  :mod:`sunburnt` does not support atomic updates, so the
+    JSON update is posted directly to the configured
+    **SOLR_SERVER_URL**.  Requires the update log and stored fields
+    configured in the OpenEmory Solr schema.  Because the stored
+    :data:`INDEX_HASH_FIELD` no longer describes the full document
+    after a partial update, it is cleared.
+
+    :param docs: list of dictionaries, each with an ``id`` and the
+        field values to set; a value of None removes the field
+    :raises: :class:`requests.HTTPError` if Solr rejects the update
+    '''
+    updates = []
+    for doc in docs:
+        update = dict((field, {'set': value}) for field, value in doc.items()
+                      if field != 'id')
+        update[INDEX_HASH_FIELD] = {'set': None}
+        update['id'] = doc['id']
+        updates.append(update)
+
+    verify = getattr(settings, 'SOLR_CA_CERT_PATH', True)
+    if getattr(settings, 'SOLR_DISABLE_CERT_CHECK', False):
+        verify = False
+    response = requests.post('%s/update' % settings.SOLR_SERVER_URL.rstrip('/'),
+                             params={'wt': 'json'},
+                             data=json.dumps(updates, default=solr_date_str),
+                             headers={'Content-Type': 'application/json'},
+                             verify=verify)
+    response.raise_for_status()
+    return len(updates)
+
+
+def solr_date_str(value):
+    '''Format a :class:`datetime.datetime` in the UTC format Solr
+    requires for date fields; used as a :func:`json.dumps` default.'''
+    if hasattr(value, 'utcoffset') and value.utcoffset() is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)
+    return str(value)
+
+
 def paginate(request, query):
     '''Common pagination logic, straight out of django docs.  Takes a
     :class:`~django.http.HttpRequest` and a result set that can be
@@ -157,22 +256,111 @@ def pdf_to_text(pdfstream):
     return _strip_xml_invalids(pdftext.decode('utf-8','ignore'))
 
 
+_title_punctuation = re.compile(r'[^A-Za-z0-9\s]+')
+_title_whitespace = re.compile(r'\s+')
+# characters that can remain in a normalized title
+_title_alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 '
+
+
+def normalize_title(title):
+    '''Normalize a title for comparison, as used by
+    :meth:`percent_match`: punctuation is removed, case is folded and
+    whitespace is collapsed.'''
+    return _title_whitespace.sub(' ', _title_punctuation.sub('', title).upper())
+
+
 def percent_match(str1, str2, percent):
-    str1 = re.sub('[^A-Za-z0-9\s]+', '', str1).upper()
-    str1 = re.sub('\s+', ' ', str1)
+    str1 = normalize_title(str1)
+    str2 = normalize_title(str2)
+    return _percent_match_normalized(str1, str2, percent,
+                                     difflib.SequenceMatcher(b=str2))
 
-    str2 = re.sub('[^A-Za-z0-9\s]+', '', str2).upper()
-    str2 = re.sub('\s+', ' ', str2)
 
+def _percent_match_normalized(str1, str2, percent, matcher):
+    # matcher is a SequenceMatcher with str2 already set as the second sequence
     if len(str1) > len(str2):
         length = len(str1)
     else:
         length = len(str2)
 
-    blocks = difflib.SequenceMatcher(a=str1, b=str2).get_matching_blocks()
+    matcher.set_seq1(str1)
+    blocks = matcher.get_matching_blocks()
 
     match = 0
     for b in blocks:
        match+=b.size
 
-    return (float(match)/float(length)*100 >= percent, float(match)/float(length)*100)
\ No newline at end of file
+    return (float(match)/float(length)*100 >= percent, float(match)/float(length)*100)
+
+
+class TitleMatcher(object):
+    '''Match one title against many candidate titles, with the same
+    results as calling :meth:`percent_match` for each candidate, e.g.::
+
+        matcher = TitleMatcher(titles)
+        for title, percent in matcher.matches(query, 90):
+            ...
+
+    Candidate titles are normalized once when they are added, and the
+    :class:`difflib.SequenceMatcher` for each candidate is created once
+    and reused for every query.  The query is normalized once per call.
+    Candidates that cannot reach the requested percent are skipped
+    before running the matcher, based on title length and on the
+    characters the two titles have in common (the matching blocks
+    cannot be longer than either).
+
+    Not thread-safe; use a separate instance per thread.
+    '''
+
+    def __init__(self, titles=None):
+        self.candidates = []
+        for title in titles or []:
+            self.add(title)
+
+    def add(self, title):
+        '''Add a candidate title.'''
+        normalized = normalize_title(title)
+        self.candidates.append((title, normalized, _char_counts(normalized), None))
+
+    def matches(self, query, percent):
+        '''Find the candidate titles that match the query by at least
+        ``percent``, as determined by :meth:`percent_match`.
+
+        :returns: list of (title, percent) tuples, in the order the
+            candidates were added
+        '''
+        query = normalize_title(query)
+        query_chars = None
+        results = []
+        for i, (title, normalized, chars, matcher) in enumerate(self.candidates):
+            length = max(len(query), len(normalized))
+            if not length:
+                # percent_match divides by zero; treat as no match
+                continue
+            # upper bound: matching blocks can't be longer than the shorter title
+            if min(len(query), len(normalized)) * 100.0 / length < percent:
+                continue
+            # upper bound: or include more of any character than both titles have
+            if query_chars is None:
+                query_chars = _char_counts(query)
+            if sum(map(min, query_chars, chars)) * 100.0 / length < percent:
+                continue
+            if matcher is None:
+                matcher = difflib.SequenceMatcher(b=normalized)
+                self.candidates[i] = (title, normalized, chars, matcher)
+            success, match = _percent_match_normalized(query, normalized, percent, matcher)
+            if success:
+                results.append((title, match))
+        return results
+
+    def best_match(self, query, percent):
+        '''Return the (title, percent) of the best matching candidate
+        title that matches by at least ``percent``, or None.'''
+        matches = self.matches(query, percent)
+        if matches:
+            return max(matches, key=lambda m: m[1])
+
+
+def _char_counts(normalized):
+    # count of each character in a normalized title, in alphabet order
+    return [normalized.count(c) for c in _title_alphabet]